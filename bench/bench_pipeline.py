@@ -0,0 +1,525 @@
+"""
+재생 파이프라인 오프라인 벤치마크 (Discord/YouTube 없이, ffmpeg 필요)
+
+    python bench/bench_pipeline.py [--guilds 1,10,100,500] [--ffmpeg PATH] [--out results.json] [--baseline old.json]
+
+- 가짜 추출기: 검색어마다 로컬 HTTP 서버의 생성 오디오 URL 을 돌려줌 (--extract-ms 로 지연 흉내)
+- 로컬 HTTP 오디오 서버: ffmpeg 로 만든 Opus(webm)/WAV 파일을 서빙 → ffmpeg 는 실제 _make_ffmpeg_opts 경로를 탐
+- 가짜 VoiceClient: discord.py AudioPlayer 처럼 스레드에서 20ms 간격으로 AudioSource.read() 를 당김
+- 가짜 Interaction 으로 /play, /skip 명령 콜백을 그대로 호출
+
+길드 수별로 첫 프레임까지 시간, 스킵→소리 지연, 프리로드 적중률, 스트림당 CPU, 이벤트 루프 지연을 측정해
+표로 출력하고 --out 을 주면 JSON 으로 저장. --baseline 을 주면 허용치(--tolerance) 이상 나빠진 항목이 있을 때 종료 코드 1
+"""
+import argparse
+import asyncio
+import functools
+import http.server
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+_WORK_DIR = tempfile.mkdtemp(prefix="musicbot-bench-")
+# music 모듈은 import 시점에 환경 변수를 읽으므로 먼저 격리
+os.environ.setdefault("AUDIO_CACHE_DIR", "")
+os.environ.setdefault("LOUDNESS_DB", os.path.join(_WORK_DIR, "loudness.json"))
+os.environ.setdefault("STATE_DB", os.path.join(_WORK_DIR, "state.sqlite3"))
+os.environ.setdefault("METRICS_PORT", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord  # noqa: E402
+import music  # noqa: E402
+
+FRAME_SECONDS = 0.02
+LAG_PROBE_INTERVAL = 0.02
+LOWER_IS_BETTER = ("ttff_p50_ms", "ttff_p95_ms", "skip_p50_ms", "skip_p95_ms", "cpu_per_stream_pct", "loop_lag_p99_ms")
+HIGHER_IS_BETTER = ("preload_hit_rate",)
+
+
+# ---------- 오디오 파일/HTTP 서버 ----------
+def generate_audio(directory: str, seconds: int, ffmpeg: str) -> dict[str, str]:
+    """사인파로 Opus(webm, copy 경로)와 WAV(재인코딩 경로) 파일을 하나씩 생성"""
+    files = {"opus": "tone.webm", "pcm": "tone.wav"}
+    codecs = {"opus": ["-c:a", "libopus", "-b:a", "128k"], "pcm": ["-c:a", "pcm_s16le"]}
+    for kind, name in files.items():
+        subprocess.run(
+            [ffmpeg, "-nostdin", "-loglevel", "error", "-y", "-f", "lavfi",
+             "-i", f"sine=frequency={440 if kind == 'opus' else 660}:duration={seconds}",
+             "-ac", "2", "-ar", "48000", *codecs[kind], os.path.join(directory, name)],
+            check=True,
+        )
+    return files
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def start_audio_server(directory: str) -> tuple[http.server.ThreadingHTTPServer, str]:
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="bench-http", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def make_fake_extractor(base_url: str, files: dict[str, str], codec: str, seconds: int, extract_ms: float):
+    """search_target(query) 를 받아 yt-dlp 추출 결과와 같은 모양의 dict 반환"""
+
+    def extract(target: str) -> dict:
+        if extract_ms:
+            time.sleep(extract_ms / 1000)
+        if target.startswith("http"):  # 스트림 URL 갱신: 같은 영상 id 유지
+            query = vid = target.rsplit("v=", 1)[-1][:11]
+        else:
+            query = target.split(":", 1)[-1]
+            vid = music.hashlib.sha1(query.encode()).hexdigest()[:11]
+        kind = codec if codec != "mixed" else ("opus" if int(vid, 16) % 2 else "pcm")
+        return {
+            "url": f"{base_url}/{files[kind]}?v={vid}",
+            "webpage_url": f"https://www.youtube.com/watch?v={vid}",
+            "title": query,
+            "thumbnail": "",
+            "duration": seconds,
+            "http_headers": {"Accept": "*/*"},
+            "format_id": "251" if kind == "opus" else "wav",
+            "acodec": "opus" if kind == "opus" else "pcm_s16le",
+            "ext": "webm" if kind == "opus" else "wav",
+            "abr": 128.0 if kind == "opus" else 1536.0,
+            "asr": 48000,
+        }
+
+    return extract
+
+
+# ---------- 가짜 Discord 객체 ----------
+class FakeVoiceClient:
+    """discord.VoiceClient 대역. play() 마다 AudioPlayer 처럼 스레드 하나가 20ms 간격으로 read()"""
+
+    def __init__(self, channel: "FakeVoiceChannel", recorder: "Recorder"):
+        self.channel = channel
+        self.recorder = recorder
+        self._connected = True
+        self._thread: threading.Thread | None = None
+        self._end = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+        self.frames = 0
+        self.late_frames = 0
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def is_playing(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and self._resumed.is_set() and not self._end.is_set()
+
+    def is_paused(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._resumed.is_set()
+
+    def play(self, source, *, after=None):
+        if self.is_playing():
+            raise discord.ClientException("Already playing audio.")
+        self._end = threading.Event()
+        self._resumed.set()
+        self._thread = threading.Thread(target=self._run, args=(source, after, self._end), daemon=True,
+                                        name=f"fake-voice-{self.channel.guild_id}")
+        self._thread.start()
+
+    def _run(self, source, after, end: threading.Event):
+        guild_id = self.channel.guild_id
+        last_track = object()
+        loops, start = 0, time.perf_counter()
+        error = None
+        try:
+            while not end.is_set():
+                if not self._resumed.is_set():
+                    self._resumed.wait()
+                    loops, start = 0, time.perf_counter()
+                    continue
+                data = source.read()
+                if not data:
+                    break
+                track = getattr(source, "track", None)
+                if track is not last_track:  # 새 곡의 첫 프레임 (새 소스든 연속 소스 안의 전환이든)
+                    last_track = track
+                    self.recorder.first_frame(guild_id, time.perf_counter())
+                self.frames += 1
+                loops += 1
+                delay = start + FRAME_SECONDS * loops - time.perf_counter()
+                if delay < 0:
+                    self.late_frames += 1
+                else:
+                    time.sleep(delay)
+        except Exception as e:
+            error = e
+        finally:
+            if after is not None:
+                try:
+                    after(error)
+                except Exception:
+                    pass
+
+    def stop(self):
+        self._end.set()
+        self._resumed.set()
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    async def disconnect(self, *, force: bool = False):
+        self.stop()
+        self._connected = False
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild_id: int, recorder: "Recorder"):
+        self.id = guild_id * 10 + 1
+        self.guild_id = guild_id
+        self.recorder = recorder
+        self.members = []
+
+    async def connect(self, **kwargs) -> FakeVoiceClient:
+        return FakeVoiceClient(self, self.recorder)
+
+
+class FakeMessage:
+    _ids = iter(range(10 ** 12, 10 ** 13))
+
+    def __init__(self, channel: "FakeTextChannel"):
+        self.id = next(self._ids)
+        self.channel = channel
+
+    async def edit(self, **kwargs):
+        self.channel.edits += 1
+
+    async def delete(self):
+        self.channel.deletes += 1
+
+
+class FakeTextChannel:
+    def __init__(self, guild_id: int):
+        self.id = guild_id * 10 + 2
+        self.sends = self.edits = self.deletes = 0
+
+    async def send(self, content=None, **kwargs) -> FakeMessage:
+        self.sends += 1
+        return FakeMessage(self)
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f"bench-{guild_id}"
+
+
+class _Followup:
+    def __init__(self, channel: FakeTextChannel):
+        self.channel = channel
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+class _Response:
+    async def defer(self, **kwargs):
+        pass
+
+
+class FakeInteraction:
+    """명령 콜백이 쓰는 Interaction 속성만 흉내"""
+
+    def __init__(self, guild: FakeGuild, text: FakeTextChannel, voice: FakeVoiceChannel):
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = text
+        self.user = type("FakeMember", (), {"voice": type("FakeVoiceState", (), {"channel": voice})()})()
+        self.response = _Response()
+        self.followup = _Followup(text)
+
+
+class FakeBot:
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.guilds = []
+        self.cluster = None
+
+    def add_view(self, view, **kwargs):
+        pass
+
+    def get_cog(self, name):
+        return None
+
+    def get_guild(self, guild_id):
+        return None
+
+    async def wait_until_ready(self):
+        return None
+
+
+# ---------- 측정 ----------
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.frames: dict[int, list[float]] = {}
+
+    def first_frame(self, guild_id: int, at: float):
+        with self._lock:
+            self.frames.setdefault(guild_id, []).append(at)
+
+    def first_after(self, guild_id: int, since: float) -> float | None:
+        with self._lock:
+            return next((t for t in self.frames.get(guild_id, []) if t >= since), None)
+
+
+class LagMonitor:
+    """LAG_PROBE_INTERVAL 로 잠들었다 깨어난 시각의 초과분 = 이벤트 루프 지연"""
+
+    def __init__(self):
+        self.samples: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    async def _run(self):
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            self.samples.append(max(0.0, time.perf_counter() - t0 - LAG_PROBE_INTERVAL))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+
+def ffmpeg_children_cpu() -> float | None:
+    """종료·회수된 자식 프로세스(ffmpeg)가 쓴 CPU 초 누계 (resource 모듈 없으면 None)
+
+    살아 있는 자식은 빠지므로 측정 구간 전후의 차이는 그 사이 끝난 ffmpeg 만 반영함
+    → 구간 안에서 곡이 바뀌도록 --track-seconds 를 --window 보다 짧게 잡아야 의미 있음
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def pct(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def ms(v: float | None) -> float | None:
+    return None if v is None else round(v * 1000, 1)
+
+
+# ---------- 시나리오 ----------
+async def run_scenario(n_guilds: int, args, extract_fn) -> dict:
+    recorder = Recorder()
+    bot = FakeBot()
+    cog = music.MusicBot(bot)
+    cog.extractor_pool.shutdown()
+    cog.extractor_pool = music.ExtractorPool(mode="thread", extract_fn=extract_fn)
+    # 시나리오끼리 저장 상태가 섞이지 않게 DB 를 따로 씀
+    cog.state_store.close()
+    cog.state_store = music.StateStore(os.path.join(_WORK_DIR, f"state-{n_guilds}.sqlite3"))
+    await cog.cog_load()
+    lag = LagMonitor()
+    lag.start()
+
+    base_id = 10 ** 17
+    ctx = []
+    for i in range(n_guilds):
+        gid = base_id + i
+        ctx.append(FakeInteraction(FakeGuild(gid), FakeTextChannel(gid), FakeVoiceChannel(gid, recorder)))
+
+    # 1) 길드마다 /play 한 번(첫 곡) + 대기열 곡 추가
+    started: dict[int, float] = {}
+
+    async def start_guild(inter: FakeInteraction):
+        started[inter.guild_id] = time.perf_counter()
+        await cog.play.callback(cog, inter, query=f"g{inter.guild_id} track 0")
+        for k in range(1, args.tracks):
+            await cog.play.callback(cog, inter, query=f"g{inter.guild_id} track {k}")
+
+    await asyncio.gather(*(start_guild(inter) for inter in ctx))
+    deadline = time.perf_counter() + args.timeout
+    while time.perf_counter() < deadline and any(recorder.first_after(g, t) is None for g, t in started.items()):
+        await asyncio.sleep(0.05)
+    ttff = [f - t for g, t in started.items() if (f := recorder.first_after(g, t)) is not None]
+
+    # 2) 프리로드가 자리 잡은 뒤 정상 상태에서 CPU 측정
+    await asyncio.sleep(args.settle)
+    cpu0, child0, wall0 = time.process_time(), ffmpeg_children_cpu(), time.perf_counter()
+    frames0 = sum(vc.frames for vc in cog.voice_clients.values())
+    await asyncio.sleep(args.window)
+    cpu1, child1, wall1 = time.process_time(), ffmpeg_children_cpu(), time.perf_counter()
+    frames1 = sum(vc.frames for vc in cog.voice_clients.values())
+    stream_seconds = (frames1 - frames0) * FRAME_SECONDS
+    cpu_total = (cpu1 - cpu0) + ((child1 - child0) if child0 is not None and child1 is not None else 0.0)
+
+    # 3) 스킵 → 다음 곡 첫 프레임까지
+    skips: list[float] = []
+    for _ in range(args.skips):
+        marks = {}
+        for inter in ctx:
+            marks[inter.guild_id] = time.perf_counter()
+            await cog.skip.callback(cog, inter)
+        deadline = time.perf_counter() + args.timeout
+        while time.perf_counter() < deadline and any(recorder.first_after(g, t) is None for g, t in marks.items()):
+            await asyncio.sleep(0.02)
+        skips.extend(f - t for g, t in marks.items() if (f := recorder.first_after(g, t)) is not None)
+        await asyncio.sleep(args.settle)
+
+    hits, misses = cog.preload_hits, cog.preload_misses
+    late = sum(vc.late_frames for vc in cog.voice_clients.values())
+    frames = sum(vc.frames for vc in cog.voice_clients.values())
+    result = {
+        "guilds": n_guilds,
+        "ttff_p50_ms": ms(pct(ttff, 0.5)),
+        "ttff_p95_ms": ms(pct(ttff, 0.95)),
+        "ttff_max_ms": ms(max(ttff) if ttff else None),
+        "ttff_missing": n_guilds - len(ttff),
+        "skip_p50_ms": ms(pct(skips, 0.5)),
+        "skip_p95_ms": ms(pct(skips, 0.95)),
+        "skip_missing": n_guilds * args.skips - len(skips),
+        "preload_hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+        "cpu_per_stream_pct": round(cpu_total / stream_seconds * 100, 2) if stream_seconds else None,
+        "python_cpu_pct": round((cpu1 - cpu0) / (wall1 - wall0) * 100, 1),
+        "loop_lag_p50_ms": ms(pct(lag.samples, 0.5)),
+        "loop_lag_p99_ms": ms(pct(lag.samples, 0.99)),
+        "loop_lag_max_ms": ms(max(lag.samples) if lag.samples else None),
+        "late_frame_ratio": round(late / frames, 4) if frames else None,
+        "source_paths": dict(cog.source_path_counts),
+        "ui_writes": cog.ui_renderer.stats()["writes"],
+    }
+
+    # 정리
+    lag.stop()
+    for inter in ctx:
+        await cog.disconnect_and_cleanup(inter.guild_id, inter)
+    cog.cog_unload()
+    await asyncio.sleep(0.5)
+    return result
+
+
+def compare(results: list[dict], baseline_path: str, tolerance: float) -> list[str]:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        base = {r["guilds"]: r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        old = base.get(r["guilds"])
+        if not old:
+            continue
+        for key in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            new_v, old_v = r.get(key), old.get(key)
+            if new_v is None or old_v is None or old_v == 0:
+                continue
+            change = (new_v - old_v) / abs(old_v)
+            worse = change > tolerance if key in LOWER_IS_BETTER else change < -tolerance
+            if worse:
+                regressions.append(f"guilds={r['guilds']} {key}: {old_v} -> {new_v} ({change:+.0%})")
+    return regressions
+
+
+def git_revision() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline play-pipeline benchmark")
+    parser.add_argument("--guilds", default="1,10,100,500", help="쉼표로 구분한 길드 수 목록")
+    parser.add_argument("--tracks", type=int, default=4, help="길드당 /play 곡 수")
+    parser.add_argument("--codec", choices=("opus", "pcm", "mixed"), default="mixed")
+    parser.add_argument("--track-seconds", type=int, default=120)
+    parser.add_argument("--extract-ms", type=float, default=0.0, help="가짜 추출 지연(ms)")
+    parser.add_argument("--settle", type=float, default=2.0, help="단계 사이 대기(초)")
+    parser.add_argument("--window", type=float, default=5.0, help="CPU 측정 구간(초)")
+    parser.add_argument("--skips", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--out", help="결과 JSON 저장 경로 (생략하면 저장 안 함)")
+    parser.add_argument("--ffmpeg", help="ffmpeg 실행 파일 (기본: PATH 의 ffmpeg)")
+    parser.add_argument("--ffprobe", help="ffprobe 실행 파일 (기본: PATH 의 ffprobe)")
+    parser.add_argument("--baseline", help="비교할 이전 결과 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="허용 악화 비율")
+    args = parser.parse_args()
+
+    ffmpeg = args.ffmpeg or shutil.which("ffmpeg")
+    ffprobe = args.ffprobe or shutil.which("ffprobe")
+    if not ffmpeg or not ffprobe:
+        parser.error("ffmpeg/ffprobe 를 찾을 수 없음 (--ffmpeg/--ffprobe 로 지정)")
+    # 봇 기본값은 Windows 경로라 소스를 만들기 전에 바꿔 둠
+    music.FFMPEG_PATH, music.FFPROBE_PATH = ffmpeg, ffprobe
+    audio_dir = os.path.join(_WORK_DIR, "audio")
+    os.makedirs(audio_dir, exist_ok=True)
+    files = generate_audio(audio_dir, args.track_seconds, ffmpeg)
+    server, base_url = start_audio_server(audio_dir)
+    extract_fn = make_fake_extractor(base_url, files, args.codec, args.track_seconds, args.extract_ms)
+
+    results = []
+    header = f"{'guilds':>6} {'ttff p50/p95':>14} {'skip p50/p95':>14} {'preload':>8} {'cpu/stream':>10} {'lag p99':>8} {'late':>7}"
+    print(header)
+    try:
+        for n in (int(x) for x in args.guilds.split(",") if x.strip()):
+            r = asyncio.run(run_scenario(n, args, extract_fn))
+            results.append(r)
+            print(
+                f"{n:>6} {r['ttff_p50_ms']!s:>6}/{r['ttff_p95_ms']!s:<7} {r['skip_p50_ms']!s:>6}/{r['skip_p95_ms']!s:<7} "
+                f"{r['preload_hit_rate']!s:>8} {r['cpu_per_stream_pct']!s:>9}% {r['loop_lag_p99_ms']!s:>8} "
+                f"{r['late_frame_ratio']!s:>7}"
+            )
+    finally:
+        server.shutdown()
+        shutil.rmtree(_WORK_DIR, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "discord_py": discord.__version__,
+            "args": vars(args),
+            "statistics": "percentiles over per-guild samples; cpu includes reaped ffmpeg children (RUSAGE_CHILDREN) when available",
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"results -> {args.out}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
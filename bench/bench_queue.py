@@ -0,0 +1,81 @@
+"""
+대기열 엔진 벤치마크 (Discord 연결 없이 실행)
+
+    python bench/bench_queue.py [곡 수=10000]
+
+기존 list[dict] + pop(0) + 전체 join 방식과 GuildQueue(deque + Track) 를 비교
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import music  # noqa: E402
+
+HEADERS = {"User-Agent": music.UA, "Accept": "*/*"}
+
+
+def make_info(i: int) -> dict:
+    vid = f"{i:011d}"
+    return {
+        "url": f"https://rr1---sn.googlevideo.com/videoplayback?expire=9999999999&id={vid}",
+        "webpage_url": f"https://www.youtube.com/watch?v={vid}",
+        "title": f"Track number {i} - some artist (official audio)",
+        "thumbnail": f"https://i.ytimg.com/vi/{vid}/hqdefault.jpg",
+        "duration": 200 + i % 100,
+        "http_headers": dict(HEADERS),
+        "format_id": "251",
+        "acodec": "opus",
+        "ext": "webm",
+        "abr": 130.0,
+        "asr": 48000,
+    }
+
+
+def timed(label: str, fn):
+    t0 = time.perf_counter()
+    fn()
+    print(f"{label:<40} {(time.perf_counter() - t0) * 1000:9.2f} ms")
+
+
+def bench(n: int):
+    infos = [make_info(i) for i in range(n)]
+
+    tracemalloc.start()
+    legacy = [dict(info) for info in infos]
+    legacy_mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    queue = music.GuildQueue()
+    for info in infos:
+        queue.append(music.Track.from_info(info))
+    queue_mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"tracks: {n}")
+    print(f"{'memory list[dict]':<40} {legacy_mem / 1024:9.1f} KiB")
+    print(f"{'memory GuildQueue[Track]':<40} {queue_mem / 1024:9.1f} KiB")
+
+    timed("list.pop(0) drain", lambda: [legacy.pop(0) for _ in range(len(legacy))])
+    timed("GuildQueue.popleft drain", lambda: [queue.popleft() for _ in range(len(queue))])
+
+    legacy = [dict(info) for info in infos]
+    for info in infos:
+        queue.append(music.Track.from_info(info))
+
+    timed("list full join (/queue legacy)", lambda: "\n".join(f"{i+1}. {s['title']}" for i, s in enumerate(legacy)))
+    timed("GuildQueue.page(last) x100", lambda: [queue.page(queue.page_count() - 1) for _ in range(100)])
+    timed("duplicate check x100 (list scan)", lambda: [
+        any(s["webpage_url"] == legacy[-1]["webpage_url"] for s in legacy) for _ in range(100)
+    ])
+    timed("duplicate check x10k (GuildQueue)", lambda: [queue.contains(infos[-1]["webpage_url"]) for _ in range(10000)])
+    timed("remove(middle) x100", lambda: [queue.remove(len(queue) // 2) for _ in range(100)])
+    timed("move(last -> 0) x100", lambda: [queue.move(len(queue) - 1, 0) for _ in range(100)])
+    timed("shuffle", queue.shuffle)
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,79 @@
+"""
+라디오 모드 청취자당 비용 벤치마크 (Discord/ffmpeg 없이 실행)
+
+    python bench/bench_radio.py [프레임 수=1500]
+
+길드마다 소스를 따로 두는 기존 방식(N개 디코딩)과 RadioStation 하나 + 청취자 커서 N개를
+같은 프레임 수만큼 읽어 CPU 시간을 비교(생산 스레드 포함, 프로세스 CPU 시간). 원본 소스는
+프레임마다 디코딩/인코딩 비용을 흉내 내는 작업(ENCODE_COST)을 수행함. 청취자가 생산 스레드를
+앞지르면 무음 프레임을 받으므로 그 수도 함께 출력
+"""
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import music  # noqa: E402
+
+ENCODE_COST = 40  # 프레임당 sha256 반복 횟수 (ffmpeg 디코딩/인코딩 대용)
+LISTENERS = (1, 10, 100, 500)
+
+
+class FakeOpusSource(music.discord.AudioSource):
+    def __init__(self, frames: int):
+        self.left = frames
+        self.produced = 0
+
+    def read(self) -> bytes:
+        if self.left <= 0:
+            return b""
+        self.left -= 1
+        self.produced += 1
+        digest = b"\x00" * 32
+        for _ in range(ENCODE_COST):
+            digest = hashlib.sha256(digest).digest()
+        return digest * 5  # 160바이트 ≒ 64kbps Opus 프레임
+
+    def is_opus(self) -> bool:
+        return True
+
+
+def per_guild(n: int, frames: int) -> float:
+    sources = [FakeOpusSource(frames) for _ in range(n)]
+    t0 = time.process_time()
+    for _ in range(frames):
+        for src in sources:
+            src.read()
+    return time.process_time() - t0
+
+
+def radio(n: int, frames: int) -> tuple[float, int, int]:
+    station = music.RadioStation("bench", request_next=lambda st: None)
+    src = FakeOpusSource(frames)
+    station.set_next(None, src)
+    listeners = [station.attach() for _ in range(n)]
+    t0 = time.process_time()
+    for _ in range(frames):
+        # 음성 스레드들이 20ms 마다 한 프레임씩 읽는 순서를 흉내
+        for listener in listeners:
+            listener.read()
+    elapsed = time.process_time() - t0
+    for listener in listeners:
+        listener.cleanup()
+    station.suspend()
+    return elapsed, src.produced, station.silence_frames
+
+
+def main(frames: int):
+    print(f"frames per listener: {frames} ({frames * music.FRAME_MS / 1000:.0f}s of audio)")
+    print(f"{'listeners':>9} {'per-guild cpu':>14} {'radio cpu':>10} {'radio/listener/frame':>21} {'decodes':>8} {'silence':>8}")
+    for n in LISTENERS:
+        legacy = per_guild(n, frames)
+        shared, decodes, silence = radio(n, frames)
+        print(f"{n:>9} {legacy:>13.3f}s {shared:>9.3f}s {shared / (n * frames) * 1e6:>18.2f} µs {decodes:>8} {silence:>8}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1500)
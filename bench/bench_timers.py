@@ -0,0 +1,109 @@
+"""
+타이머 churn 벤치마크 (Discord 연결 없이 실행)
+
+    python bench/bench_timers.py [길드 수=10000] [길드당 이벤트 수=20]
+
+길드마다 이벤트(대기열 추가/UI 갱신)가 올 때마다 태스크를 취소하고 새로 만드는 기존 방식과
+TimerScheduler 하나로 재예약하는 방식을 비교. 유휴 타이머(600초)는 길드마다 하나씩 살아 있음
+"""
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import music  # noqa: E402
+
+KINDS = ("ui", "preload")
+DEBOUNCE = 2.0  # 예약 루프보다 길게 잡아 디바운스 도중 만료가 섞이지 않게
+
+
+async def legacy(guilds: int, events: int) -> dict:
+    tasks: dict[tuple, asyncio.Task] = {}
+    fired = 0
+
+    def schedule(key, delay):
+        if t := tasks.get(key):
+            t.cancel()
+
+        async def _task():
+            nonlocal fired
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                return
+            fired += 1
+
+        tasks[key] = asyncio.create_task(_task())
+
+    t0 = time.perf_counter()
+    for g in range(guilds):
+        schedule(("idle", g), music.INACTIVITY_TIMEOUT)
+    for _ in range(events):
+        for g in range(guilds):
+            for kind in KINDS:
+                schedule((kind, g), DEBOUNCE)
+        await asyncio.sleep(0)  # 취소된 태스크들이 실제로 정리되도록 한 바퀴
+    elapsed = time.perf_counter() - t0
+    peak_tasks = len(asyncio.all_tasks())
+    mem = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+    await asyncio.sleep(DEBOUNCE + 0.5)
+    for t in tasks.values():
+        t.cancel()
+    return {"schedule_s": elapsed, "tasks": peak_tasks, "mem_kib": mem / 1024, "fired": fired}
+
+
+async def wheel(guilds: int, events: int) -> dict:
+    timers = music.TimerScheduler()
+    fired = 0
+
+    def on_fire():
+        nonlocal fired
+        fired += 1
+
+    t0 = time.perf_counter()
+    for g in range(guilds):
+        timers.schedule(("idle", g), music.INACTIVITY_TIMEOUT, on_fire)
+    for _ in range(events):
+        for g in range(guilds):
+            for kind in KINDS:
+                timers.schedule((kind, g), DEBOUNCE, on_fire)
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - t0
+    peak_tasks = len(asyncio.all_tasks())
+    mem = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+    await asyncio.sleep(DEBOUNCE + 0.5)
+    stats = timers.stats()
+    timers.shutdown()
+    return {"schedule_s": elapsed, "tasks": peak_tasks, "mem_kib": mem / 1024, "fired": fired,
+            "heap": stats["heap"], "pending": stats["pending"]}
+
+
+def run(fn, guilds: int, events: int) -> dict:
+    # 시간은 tracemalloc 없이, 메모리는 따로 한 번 더 돌려서 측정
+    result = asyncio.run(fn(guilds, events))
+    tracemalloc.start()
+    try:
+        result["mem_kib"] = asyncio.run(fn(guilds, events))["mem_kib"]
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+def main(guilds: int, events: int):
+    print(f"guilds: {guilds}, events per guild: {events} x {len(KINDS)} kinds")
+    for label, fn in (("create/cancel tasks", legacy), ("TimerScheduler", wheel)):
+        r = run(fn, guilds, events)
+        print(f"{label:<20} schedule {r['schedule_s'] * 1000:9.1f} ms  live tasks {r['tasks']:>7}  "
+              f"mem {r['mem_kib']:9.1f} KiB  fired {r['fired']}")
+        if "pending" in r:
+            print(f"{'':<20} pending after fire {r['pending']}  heap {r['heap']}")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+    )
@@ -1,50 +1,179 @@
-# bot.py (핵심 부분만)
-import os, asyncio, traceback
-import discord
-from discord.ext import commands
-from dotenv import load_dotenv
-
-load_dotenv()
-TOKEN = os.getenv("DISCORD_TOKEN")
-
-intents = discord.Intents.default()
-intents.guilds = True
-
-class MyBot(commands.Bot):
-    def __init__(self):
-        super().__init__(command_prefix="!", intents=intents)
-        self._synced = False  # 초기화!
-
-    async def setup_hook(self):
-        try:
-            await self.load_extension("music")  # music.py가 같은 폴더거나 올바른 패키지 경로
-            print("[OK] music extension loaded")
-        except Exception:
-            print("[ERR] failed to load music extension")
-            traceback.print_exc()
-
-        local_cmds = self.tree.get_commands()
-        print(f"[INFO] local commands after load: {len(local_cmds)} -> {[c.name for c in local_cmds]}")
-
-bot = MyBot()
-
-@bot.event
-async def on_ready():
-    print(f"✅ Logged in as {bot.user} (id={bot.user.id})")
-
-    # (선택) 로컬 트리에 뭐가 올라갔는지 확인
-    locals = [c.name for c in bot.tree.get_commands()]
-    print(f"[INFO] local commands: {locals}")
-
-    # 각 길드에 글로벌 트리 복사 후, 길드 동기화(=즉시 반영)
-    for g in bot.guilds:
-        bot.tree.copy_global_to(guild=g)       # ★ 이 줄이 핵심
-        synced = await bot.tree.sync(guild=g)  # 길드 즉시 반영
-        print(f"[OK] synced {g.name}({g.id}): {[c.name for c in synced]}")
-
-async def main():
-    async with bot:
-        await bot.start(TOKEN)
-
-if __name__ == "__main__":
-    asyncio.run(main())
+# bot.py (핵심 부분만)
+import os, asyncio, traceback, time, json, hashlib
+import discord
+from discord.ext import commands
+from dotenv import load_dotenv
+
+from cluster import ClusterLink
+
+load_dotenv()
+TOKEN = os.getenv("DISCORD_TOKEN")
+
+intents = discord.Intents.default()
+intents.guilds = True
+
+# 커맨드 트리 동기화 상태: 길드별 마지막으로 동기화한 트리 해시
+SYNC_STATE_PATH = os.getenv("COMMAND_SYNC_STATE", "command_sync.json")
+SYNC_CONCURRENCY = int(os.getenv("COMMAND_SYNC_CONCURRENCY", "4"))
+SYNC_RETRIES = int(os.getenv("COMMAND_SYNC_RETRIES", "3"))   # 실패한 길드만 다시 시도하는 횟수
+SYNC_RETRY_DELAY = 10.0                                      # 첫 재시도 대기(초), 이후 두 배씩
+
+# 샤딩: SHARDED=1 이면 자동 샤딩. cluster.py 실행기는 프로세스마다 SHARD_IDS/SHARD_COUNT/CLUSTER_IPC 를 넣어 줌
+SHARD_IDS = [int(x) for x in os.getenv("SHARD_IDS", "").split(",") if x.strip()] or None
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+CLUSTER_ID = int(os.getenv("CLUSTER_ID", "0"))
+CLUSTER_IPC = os.getenv("CLUSTER_IPC")
+SHARDED = os.getenv("SHARDED") == "1" or SHARD_IDS is not None or SHARD_COUNT is not None
+if CLUSTER_IPC:
+    # 같은 작업 폴더를 쓰는 클러스터끼리 상태 파일을 덮어쓰지 않게
+    SYNC_STATE_PATH = f"{os.path.splitext(SYNC_STATE_PATH)[0]}.{CLUSTER_ID}.json"
+
+_BotBase = commands.AutoShardedBot if SHARDED else commands.Bot
+
+class MyBot(_BotBase):
+    def __init__(self):
+        shard_kwargs = {}
+        if SHARDED:
+            shard_kwargs = {"shard_ids": SHARD_IDS, "shard_count": SHARD_COUNT}
+        super().__init__(command_prefix="!", intents=intents, **shard_kwargs)
+        self.cluster: ClusterLink | None = None
+        self._synced = False  # 모든 길드 동기화가 성공했을 때만 True (실패가 남았으면 다음 on_ready 에서 다시)
+        self._started_at = time.perf_counter()
+        self._sync_state: dict[str, str] = {}
+        self._sync_task: asyncio.Task | None = None
+        try:
+            with open(SYNC_STATE_PATH, "r", encoding="utf-8") as f:
+                self._sync_state = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def _elapsed(self) -> str:
+        return f"{time.perf_counter() - self._started_at:.2f}s"
+
+    def tree_hash(self) -> str:
+        """로컬 커맨드 트리(글로벌) 정의의 해시. 바뀌지 않았으면 길드 동기화를 건너뜀"""
+        payload = []
+        for c in self.tree.get_commands():
+            try:
+                payload.append(c.to_dict(self.tree))
+            except TypeError:  # discord.py < 2.4
+                payload.append(c.to_dict())
+        payload.sort(key=lambda d: (d.get("type", 1), d["name"]))
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _save_sync_state(self):
+        tmp = SYNC_STATE_PATH + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._sync_state, f)
+            os.replace(tmp, SYNC_STATE_PATH)
+        except OSError:
+            pass
+
+    async def sync_guild(self, guild: discord.abc.Snowflake, digest: str) -> bool:
+        # 각 길드에 글로벌 트리 복사 후, 길드 동기화(=즉시 반영)
+        self.tree.copy_global_to(guild=guild)  # ★ 이 줄이 핵심
+        synced = await self.tree.sync(guild=guild)
+        self._sync_state[str(guild.id)] = digest
+        print(f"[OK] synced {getattr(guild, 'name', guild.id)}({guild.id}): {len(synced)} commands")
+        return True
+
+    async def sync_guilds(self):
+        """바뀐 길드만 동기화하고, 실패한 길드는 간격을 늘려 가며 다시 시도. 전부 성공하면 _synced"""
+        digest = self.tree_hash()
+        for attempt in range(SYNC_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(SYNC_RETRY_DELAY * 2 ** (attempt - 1))
+            if await self._sync_stale(digest):
+                self._synced = True
+                return
+        print(f"[WARN] command sync incomplete after {SYNC_RETRIES} retries; will retry on next ready")
+
+    async def _sync_stale(self, digest: str) -> bool:
+        """해시가 다른 길드들을 병렬 동기화. 모두 성공하면 True"""
+        started = time.perf_counter()
+        stale = [g for g in self.guilds if self._sync_state.get(str(g.id)) != digest]
+        sem = asyncio.Semaphore(max(1, SYNC_CONCURRENCY))
+
+        async def one(g):
+            async with sem:
+                try:
+                    return await self.sync_guild(g, digest)
+                except Exception:
+                    print(f"[ERR] sync failed {g.name}({g.id})")
+                    traceback.print_exc()
+                    return False
+
+        results = await asyncio.gather(*(one(g) for g in stale))
+        self._save_sync_state()
+        print(
+            f"[INFO] command sync: {sum(results)} synced, {len(stale) - sum(results)} failed, "
+            f"{len(self.guilds) - len(stale)} up to date ({time.perf_counter() - started:.2f}s, "
+            f"since start {self._elapsed()})"
+        )
+        return all(results)
+
+    def cluster_stats(self) -> dict:
+        """IPC 로 보내는 이 프로세스의 통계"""
+        stats = {
+            "guilds": len(self.guilds),
+            "latency_ms": round(self.latency * 1000, 1) if self.latency == self.latency else None,  # NaN 제외
+            "shards": sorted(self.shards) if SHARDED else [0],
+        }
+        if cog := self.get_cog("MusicBot"):
+            stats.update(cog.cluster_stats())
+        return stats
+
+    async def setup_hook(self):
+        if CLUSTER_IPC:
+            # 확장 로드 전에 만들어 둬야 cog_load 에서 클러스터 명령 핸들러를 등록할 수 있음
+            self.cluster = ClusterLink(CLUSTER_ID, SHARD_IDS or [0], SHARD_COUNT or 1, self.cluster_stats, CLUSTER_IPC)
+        try:
+            await self.load_extension("music")  # music.py가 같은 폴더거나 올바른 패키지 경로
+            print("[OK] music extension loaded")
+        except Exception:
+            print("[ERR] failed to load music extension")
+            traceback.print_exc()
+        if self.cluster:
+            await self.cluster.start()
+            print(f"[OK] cluster #{CLUSTER_ID} shards={SHARD_IDS} ipc={CLUSTER_IPC}")
+        print(f"[TIME] setup_hook done at {self._elapsed()}")
+
+        local_cmds = self.tree.get_commands()
+        print(f"[INFO] local commands after load: {len(local_cmds)} -> {[c.name for c in local_cmds]}")
+
+bot = MyBot()
+
+@bot.event
+async def on_ready():
+    print(f"✅ Logged in as {bot.user} (id={bot.user.id}) — time-to-ready {bot._elapsed()}, {len(bot.guilds)} guilds")
+    if bot._synced or (bot._sync_task and not bot._sync_task.done()):
+        return  # 재연결 후 on_ready: 이미 동기화했거나 진행 중
+
+    # (선택) 로컬 트리에 뭐가 올라갔는지 확인
+    locals = [c.name for c in bot.tree.get_commands()]
+    print(f"[INFO] local commands: {locals}")
+
+    # 변경된 길드만 병렬(동시 SYNC_CONCURRENCY)로 동기화. 준비 완료를 막지 않도록 백그라운드로
+    bot._sync_task = asyncio.create_task(bot.sync_guilds())
+
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    digest = bot.tree_hash()
+    if bot._sync_state.get(str(guild.id)) != digest:
+        try:
+            await bot.sync_guild(guild, digest)
+            bot._save_sync_state()
+        except Exception:
+            traceback.print_exc()
+
+async def main():
+    async with bot:
+        try:
+            await bot.start(TOKEN)
+        finally:
+            if bot.cluster:
+                await bot.cluster.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,515 @@
+"""
+멀티 프로세스 클러스터 실행기
+
+    python cluster.py --clusters 4 [--shards 16]        # 실제 실행 (샤드 수 생략 시 Discord 권장값)
+    python cluster.py --clusters 3 --shards 6 --fake     # Discord 없이 가짜 게이트웨이 워커로 IPC/집계 확인
+
+프로세스(클러스터)마다 bot.py 를 맡은 샤드 범위(SHARD_IDS)로 실행하고, 127.0.0.1 TCP 소켓 하나로
+통계를 모으고 클러스터 간 관리 명령을 중계함. 메시지는 줄 단위 JSON.
+연결하면 서로 확인함: 허브가 nonce 를 보내면 워커는 CLUSTER_SECRET 으로 만든 HMAC 과 자기 nonce 를 hello 에 담고,
+허브는 그 nonce 에 대한 HMAC 을 welcome 으로 돌려줌. 워커는 welcome 을 확인하기 전에는 명령을 받지 않음
+(비밀값 자체는 오가지 않음). 실행기는 CLUSTER_SECRET 이 없으면 실행마다 새로 만들어 워커에 넘김
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import random
+import secrets
+import signal
+import sys
+import time
+import urllib.request
+
+CLUSTER_IPC_ADDR = os.getenv("CLUSTER_IPC", "127.0.0.1:8765")
+CLUSTER_SECRET = os.getenv("CLUSTER_SECRET", "")
+CLUSTER_STATS_INTERVAL = float(os.getenv("CLUSTER_STATS_INTERVAL", "10"))
+CLUSTER_AUTH_TIMEOUT = 5.0
+CLUSTER_REQUEST_TIMEOUT = 5.0
+CLUSTER_RESTART_BACKOFF_MAX = 60.0
+_DISCORD_EPOCH_SHIFT = 22
+
+
+def shard_for_guild(guild_id: int, shard_count: int) -> int:
+    return (guild_id >> _DISCORD_EPOCH_SHIFT) % shard_count
+
+
+def shard_ranges(shard_count: int, clusters: int) -> list[list[int]]:
+    """샤드를 클러스터 수만큼 연속 구간으로 나눔 (앞쪽 클러스터가 하나씩 더 가짐)"""
+    clusters = max(1, min(clusters, shard_count))
+    base, extra = divmod(shard_count, clusters)
+    out, start = [], 0
+    for i in range(clusters):
+        n = base + (1 if i < extra else 0)
+        out.append(list(range(start, start + n)))
+        start += n
+    return out
+
+
+def recommended_shards(token: str) -> int:
+    req = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "DiscordBot (cluster, 1.0)"},
+    )
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return int(json.load(resp)["shards"])
+
+
+def _split_addr(addr: str) -> tuple[str, int]:
+    host, _, port = addr.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+async def _send(writer: asyncio.StreamWriter, msg: dict):
+    writer.write(json.dumps(msg, separators=(",", ":")).encode() + b"\n")
+    await writer.drain()
+
+
+def _auth_digest(secret: str, role: str, *nonces: str) -> str:
+    """role("worker"/"hub")을 섞어 한쪽의 서명을 반대쪽 응답으로 되돌려 쓰지 못하게 함"""
+    return hmac.new(secret.encode(), "\n".join((role, *nonces)).encode(), hashlib.sha256).hexdigest()
+
+
+def aggregate(stats: dict[int, dict]) -> dict:
+    """클러스터별 통계의 숫자 필드를 합산"""
+    total: dict = {"clusters": len(stats)}
+    for data in stats.values():
+        for k, v in data.items():
+            if isinstance(v, (int, float)) and not isinstance(v, bool) and k not in ("latency_ms", "stats_age_s"):
+                total[k] = total.get(k, 0) + v
+    latencies = [d["latency_ms"] for d in stats.values() if isinstance(d.get("latency_ms"), (int, float))]
+    if latencies:
+        total["latency_ms_max"] = max(latencies)
+    return total
+
+
+# ---------- 워커 쪽 연결 ----------
+class ClusterLink:
+    """
+    클러스터 프로세스 → 허브 연결. 주기적으로 stats_fn() 결과를 보내고,
+    허브가 중계한 명령은 handlers[cmd](args) 로 처리해 응답
+    """
+
+    def __init__(self, cluster_id: int, shard_ids: list[int], shard_count: int, stats_fn,
+                 addr: str = CLUSTER_IPC_ADDR, secret: str = CLUSTER_SECRET):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.addr = addr
+        self.secret = secret
+        self.stats_fn = stats_fn
+        self.auth_failures = 0
+        self.handlers: dict = {}
+        self._writer: asyncio.StreamWriter | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self._waiting: dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def start(self):
+        if not self.secret:
+            raise ValueError("CLUSTER_SECRET is required to join the cluster hub")
+        self._spawn(self._run())
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self):
+        delay = 1.0
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(*_split_addr(self.addr))
+                try:
+                    trusted = await self._handshake(reader, writer)
+                except (OSError, ValueError, asyncio.TimeoutError):
+                    writer.close()
+                    raise
+                if not trusted:
+                    self.auth_failures += 1
+                    print(f"[cluster {self.cluster_id}] IPC hub at {self.addr} failed authentication")
+                    writer.close()
+                    raise ValueError("cluster hub failed authentication")
+                self._writer = writer
+                delay = 1.0
+                stats_task = asyncio.create_task(self._stats_loop())
+                try:
+                    await self._read(reader)
+                finally:
+                    stats_task.cancel()
+            except asyncio.CancelledError:
+                raise
+            except (OSError, ValueError, asyncio.TimeoutError):
+                pass
+            self._writer = None
+            for fut in self._waiting.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError("cluster hub disconnected"))
+            self._waiting.clear()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    async def _handshake(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """challenge → hello(우리 nonce 포함) → welcome 검증. 허브도 비밀값을 아는지 확인되면 True"""
+        challenge = json.loads(await asyncio.wait_for(reader.readline(), CLUSTER_AUTH_TIMEOUT))
+        if challenge.get("op") != "challenge":
+            return False
+        hub_nonce, nonce = str(challenge.get("nonce")), secrets.token_hex(16)
+        await _send(writer, {
+            "op": "hello", "cluster": self.cluster_id,
+            "shards": self.shard_ids, "shard_count": self.shard_count, "pid": os.getpid(),
+            "nonce": nonce, "auth": _auth_digest(self.secret, "worker", hub_nonce, nonce),
+        })
+        welcome = json.loads(await asyncio.wait_for(reader.readline(), CLUSTER_AUTH_TIMEOUT))
+        return welcome.get("op") == "welcome" and hmac.compare_digest(
+            str(welcome.get("auth", "")), _auth_digest(self.secret, "hub", hub_nonce, nonce)
+        )
+
+    async def _stats_loop(self):
+        while self.connected:
+            try:
+                await _send(self._writer, {"op": "stats", "cluster": self.cluster_id, "data": self.stats_fn()})
+            except OSError:
+                return
+            await asyncio.sleep(CLUSTER_STATS_INTERVAL)
+
+    async def _read(self, reader: asyncio.StreamReader):
+        while line := await reader.readline():
+            msg = json.loads(line)
+            op = msg.get("op")
+            if op == "command":
+                self._spawn(self._handle(msg))
+            elif op == "response" and (fut := self._waiting.pop(msg.get("id"), None)):
+                if not fut.done():
+                    fut.set_result({int(k): v for k, v in msg.get("results", {}).items()})
+
+    async def _handle(self, msg: dict):
+        handler = self.handlers.get(msg.get("cmd"))
+        try:
+            data = await handler(msg.get("args") or {}) if handler else {"error": "unknown command"}
+        except Exception as e:
+            data = {"error": repr(e)}
+        try:
+            await _send(self._writer, {"op": "reply", "id": msg["id"], "cluster": self.cluster_id, "data": data})
+        except (OSError, AttributeError):
+            pass
+
+    async def request(self, cmd: str, args: dict | None = None, *, target: int | None = None,
+                      guild_id: int | None = None, timeout: float = CLUSTER_REQUEST_TIMEOUT) -> dict[int, dict]:
+        """
+        다른 클러스터(기본: 전체)에 명령 실행. guild_id 를 주면 그 길드를 가진 클러스터로만.
+        {cluster_id: 응답} 반환. "cluster_stats" 는 허브가 모아 둔 통계로 바로 응답
+        """
+        if not self.connected:
+            raise ConnectionError("cluster hub not connected")
+        req_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._waiting[req_id] = fut
+        await _send(self._writer, {
+            "op": "request", "id": req_id, "cmd": cmd, "args": args or {},
+            "target": target, "guild_id": guild_id, "timeout": timeout,
+        })
+        try:
+            return await asyncio.wait_for(fut, timeout + 1.0)
+        finally:
+            self._waiting.pop(req_id, None)
+
+    async def close(self):
+        for t in list(self._tasks):
+            t.cancel()
+        if self._writer:
+            self._writer.close()
+
+
+# ---------- 허브(실행기 쪽) ----------
+class ClusterHub:
+    def __init__(self, addr: str = CLUSTER_IPC_ADDR, secret: str = CLUSTER_SECRET):
+        self.addr = addr
+        self.secret = secret
+        self.auth_failures = 0
+        self.clusters: dict[int, asyncio.StreamWriter] = {}
+        self.shards: dict[int, list[int]] = {}
+        self.shard_count = 0
+        self.stats: dict[int, dict] = {}
+        self.stats_at: dict[int, float] = {}
+        self._waiting: dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self):
+        if not self.secret:
+            raise ValueError("CLUSTER_SECRET is required to run the cluster hub")
+        host, port = _split_addr(self.addr)
+        self._server = await asyncio.start_server(self._on_client, host, port)
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        for w in self.clusters.values():
+            w.close()
+
+    async def _authenticate(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> dict | None:
+        """challenge → hello 검증 → welcome(워커 nonce 서명)으로 허브도 증명. 통과하면 hello 메시지, 아니면 None"""
+        nonce = secrets.token_hex(16)
+        await _send(writer, {"op": "challenge", "nonce": nonce})
+        msg = json.loads(await asyncio.wait_for(reader.readline(), CLUSTER_AUTH_TIMEOUT))
+        worker_nonce = str(msg.get("nonce") or "")
+        if msg.get("op") != "hello" or not worker_nonce or not hmac.compare_digest(
+            str(msg.get("auth", "")), _auth_digest(self.secret, "worker", nonce, worker_nonce)
+        ):
+            self.auth_failures += 1
+            print(f"[cluster] rejected unauthenticated IPC client {writer.get_extra_info('peername')}")
+            return None
+        await _send(writer, {"op": "welcome", "auth": _auth_digest(self.secret, "hub", nonce, worker_nonce)})
+        return msg
+
+    async def _on_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        cluster_id = None
+        try:
+            hello = await self._authenticate(reader, writer)
+            if hello is None:
+                return
+            cluster_id = int(hello["cluster"])
+            self.clusters[cluster_id] = writer
+            self.shards[cluster_id] = list(hello.get("shards") or [])
+            self.shard_count = int(hello.get("shard_count") or self.shard_count)
+            while line := await reader.readline():
+                msg = json.loads(line)
+                op = msg.get("op")
+                if op == "stats":
+                    self.stats[int(msg["cluster"])] = msg.get("data") or {}
+                    self.stats_at[int(msg["cluster"])] = time.monotonic()
+                elif op == "reply" and (fut := self._waiting.pop(msg.get("id"), None)):
+                    if not fut.done():
+                        fut.set_result(msg.get("data"))
+                elif op == "request":
+                    asyncio.create_task(self._relay(writer, msg))
+        except (OSError, ValueError, KeyError, asyncio.TimeoutError):
+            pass
+        finally:
+            if cluster_id is not None and self.clusters.get(cluster_id) is writer:
+                del self.clusters[cluster_id]
+            writer.close()
+
+    def owner_of(self, guild_id: int) -> int | None:
+        if not self.shard_count:
+            return None
+        shard = shard_for_guild(guild_id, self.shard_count)
+        return next((c for c, ids in self.shards.items() if shard in ids), None)
+
+    def snapshot(self) -> dict[int, dict]:
+        out = {c: dict(d) for c, d in self.stats.items()}
+        now = time.monotonic()
+        for c, d in out.items():
+            d["connected"] = c in self.clusters
+            d["stats_age_s"] = round(now - self.stats_at.get(c, now), 1)
+        return out
+
+    async def command(self, cmd: str, args: dict | None = None, *, target: int | None = None,
+                      guild_id: int | None = None, timeout: float = CLUSTER_REQUEST_TIMEOUT) -> dict[int, dict]:
+        if cmd == "cluster_stats":
+            return self.snapshot()
+        if guild_id is not None:
+            target = self.owner_of(guild_id)
+            if target is None:
+                return {}
+        targets = [target] if target is not None else list(self.clusters)
+
+        async def one(c: int):
+            writer = self.clusters.get(c)
+            if writer is None:
+                return c, {"error": "not connected"}
+            req_id = next(self._ids)
+            fut = asyncio.get_running_loop().create_future()
+            self._waiting[req_id] = fut
+            try:
+                await _send(writer, {"op": "command", "id": req_id, "cmd": cmd, "args": args or {}})
+                return c, await asyncio.wait_for(fut, timeout)
+            except (OSError, asyncio.TimeoutError):
+                return c, {"error": "timeout"}
+            finally:
+                self._waiting.pop(req_id, None)
+
+        return dict(await asyncio.gather(*(one(c) for c in targets)))
+
+    async def _relay(self, origin: asyncio.StreamWriter, msg: dict):
+        results = await self.command(
+            msg.get("cmd"), msg.get("args"), target=msg.get("target"), guild_id=msg.get("guild_id"),
+            timeout=float(msg.get("timeout") or CLUSTER_REQUEST_TIMEOUT),
+        )
+        try:
+            await _send(origin, {"op": "response", "id": msg.get("id"), "results": results})
+        except OSError:
+            pass
+
+
+# ---------- 가짜 게이트웨이 워커 (--fake) ----------
+async def fake_worker():
+    """Discord 에 접속하지 않고 맡은 샤드의 길드/재생 상태를 흉내 내는 워커"""
+    cluster_id = int(os.environ["CLUSTER_ID"])
+    shard_ids = [int(x) for x in os.environ["SHARD_IDS"].split(",")]
+    shard_count = int(os.environ["SHARD_COUNT"])
+    rng = random.Random(cluster_id)
+    guilds: set[int] = set()
+    while len(guilds) < 50 * len(shard_ids):
+        gid = rng.getrandbits(63)
+        if shard_for_guild(gid, shard_count) in shard_ids:
+            guilds.add(gid)
+    voice = set(rng.sample(sorted(guilds), len(guilds) // 5))
+
+    def stats() -> dict:
+        return {"guilds": len(guilds), "voice": len(voice), "playing": len(voice),
+                "latency_ms": round(rng.uniform(30, 90), 1), "shards": shard_ids, "fake_guilds": sorted(guilds)[:3]}
+
+    async def leave(args):
+        gid = int(args["guild_id"])
+        was = gid in voice
+        voice.discard(gid)
+        return {"left": was}
+
+    async def ping(args):
+        return {"pong": cluster_id, "pid": os.getpid()}
+
+    async def get_stats(args):
+        return stats()
+
+    link = ClusterLink(cluster_id, shard_ids, shard_count, stats)
+    link.handlers.update({"leave": leave, "ping": ping, "stats": get_stats})
+    await link.start()
+    await asyncio.Event().wait()
+
+
+# ---------- 실행기 ----------
+class Launcher:
+    def __init__(self, clusters: int, shard_count: int, fake: bool):
+        self.ranges = shard_ranges(shard_count, clusters)
+        self.shard_count = shard_count
+        self.fake = fake
+        # 따로 정하지 않았으면 이번 실행에서만 쓰는 비밀값 (워커에는 환경 변수로 전달)
+        self.hub = ClusterHub(secret=CLUSTER_SECRET or secrets.token_hex(32))
+        self.procs: dict[int, asyncio.subprocess.Process] = {}
+        self.restarts: dict[int, int] = {}
+        self._stopping = False
+
+    def _env(self, cluster_id: int) -> dict:
+        env = dict(os.environ)
+        env.update({
+            "CLUSTER_ID": str(cluster_id),
+            "SHARD_IDS": ",".join(map(str, self.ranges[cluster_id])),
+            "SHARD_COUNT": str(self.shard_count),
+            "CLUSTER_IPC": self.hub.addr,
+            "CLUSTER_SECRET": self.hub.secret,
+        })
+        return env
+
+    async def _supervise(self, cluster_id: int):
+        here = os.path.dirname(os.path.abspath(__file__))
+        argv = [os.path.join(here, "cluster.py"), "--fake-worker"] if self.fake else [os.path.join(here, "bot.py")]
+        backoff = 1.0
+        while not self._stopping:
+            started = time.monotonic()
+            proc = await asyncio.create_subprocess_exec(sys.executable, *argv, env=self._env(cluster_id), cwd=here)
+            self.procs[cluster_id] = proc
+            print(f"[cluster] #{cluster_id} pid={proc.pid} shards={self.ranges[cluster_id]}")
+            rc = await proc.wait()
+            if self._stopping:
+                return
+            self.restarts[cluster_id] = self.restarts.get(cluster_id, 0) + 1
+            backoff = 1.0 if time.monotonic() - started > 60 else min(backoff * 2, CLUSTER_RESTART_BACKOFF_MAX)
+            print(f"[cluster] #{cluster_id} exited rc={rc}, restarting in {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+
+    def report(self):
+        snap = self.hub.snapshot()
+        print(f"[cluster] total {aggregate(snap)}")
+        for c in sorted(snap):
+            d = snap[c]
+            print(f"[cluster]   #{c} guilds={d.get('guilds')} voice={d.get('voice')} playing={d.get('playing')} "
+                  f"latency={d.get('latency_ms')}ms restarts={self.restarts.get(c, 0)} connected={d['connected']}")
+
+    async def run(self, duration: float | None = None):
+        await self.hub.start()
+        supervisors = [asyncio.create_task(self._supervise(c)) for c in range(len(self.ranges))]
+        try:
+            if duration is None:
+                while True:
+                    await asyncio.sleep(CLUSTER_STATS_INTERVAL * 3)
+                    self.report()
+            else:
+                await self._self_check(duration)
+        finally:
+            await self.stop(supervisors)
+
+    async def _self_check(self, duration: float):
+        """--fake: 모든 클러스터가 붙으면 집계/브로드캐스트/길드 라우팅 명령을 한 번씩 확인"""
+        deadline = time.monotonic() + duration
+        while len(self.hub.stats) < len(self.ranges) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        self.report()
+        print(f"[cluster] ping -> {await self.hub.command('ping')}")
+        for c, d in sorted(self.hub.stats.items()):
+            gid = d["fake_guilds"][0]
+            routed = await self.hub.command("leave", {"guild_id": gid}, guild_id=gid)
+            print(f"[cluster] leave guild {gid} (shard {shard_for_guild(gid, self.shard_count)}) -> {routed}")
+
+    async def stop(self, supervisors):
+        self._stopping = True
+        for proc in self.procs.values():
+            if proc.returncode is None:
+                proc.terminate()
+        await asyncio.gather(*(p.wait() for p in self.procs.values()), return_exceptions=True)
+        for t in supervisors:
+            t.cancel()
+        await self.hub.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="discord_music_bot cluster launcher")
+    parser.add_argument("--clusters", type=int, default=int(os.getenv("CLUSTER_COUNT", "2")))
+    parser.add_argument("--shards", type=int, default=None, help="전체 샤드 수 (생략 시 Discord 권장값)")
+    parser.add_argument("--fake", action="store_true", help="가짜 게이트웨이 워커로 실행해 IPC만 확인")
+    parser.add_argument("--duration", type=float, default=10.0, help="--fake 일 때 대기 시간(초)")
+    parser.add_argument("--fake-worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.fake_worker:
+        asyncio.run(fake_worker())
+        return
+
+    shards = args.shards
+    if shards is None:
+        if args.fake:
+            shards = args.clusters * 2
+        else:
+            from dotenv import load_dotenv
+            load_dotenv()
+            shards = recommended_shards(os.environ["DISCORD_TOKEN"])
+    launcher = Launcher(args.clusters, shards, args.fake)
+
+    async def runner():
+        task = asyncio.create_task(launcher.run(args.duration if args.fake else None))
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    try:
+        asyncio.run(runner())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
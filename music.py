@@ -1,533 +1,4854 @@
-import discord
-from discord.ext import commands
-from discord import app_commands
-import yt_dlp
-import asyncio
-import datetime
-from concurrent.futures import ThreadPoolExecutor
-
-FFMPEG_PATH = "C:/Tools/ffmpeg/bin/ffmpeg.exe"
-UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
-
-def is_youtube_url(url: str) -> bool:
-    if not url:
-        return False
-    u = url.lower()
-    return "youtube.com" in u or "youtu.be" in u
-
-
-class MusicBot(commands.Cog):
-    def __init__(self, bot: commands.Bot):
-        self.bot = bot
-
-        # 길드별 상태
-        self.voice_clients: dict[int, discord.VoiceClient] = {}
-        self.queues: dict[int, list[dict]] = {}
-        self.is_playing: dict[int, bool] = {}
-        self.current_songs: dict[int, dict | None] = {}
-
-        # UI/활동/유휴/프리로드 관리
-        self.last_message: dict[int, discord.Message] = {}
-        self.last_activity: dict[int, datetime.datetime] = {}
-        self.inactivity_tasks: dict[int, asyncio.Task] = {}
-        self.ui_update_tasks: dict[int, asyncio.Task] = {}
-
-        # 프리로드: 다음 곡 오디오 소스를 미리 만들어 둠
-        self.preload_tasks: dict[int, asyncio.Task] = {}
-        self.preloaded_sources: dict[int, tuple[str, discord.AudioSource]] = {}  # key: guild_id -> (keystr, source)
-
-        # yt-dlp 검색 (블로킹) → 스레드 풀에 맡김
-        self.search_executor = ThreadPoolExecutor(max_workers=1)  # 대기열 추가 시 안정성
-
-    def cog_unload(self):
-        self.search_executor.shutdown(wait=False)
-        # 남아있는 프리로드 태스크 정리
-        for t in self.preload_tasks.values():
-            t.cancel()
-
-    # ---------- 공용 유틸 ----------
-    def update_activity(self, guild_id: int):
-        self.last_activity[guild_id] = datetime.datetime.utcnow()
-
-    async def start_inactivity_timer(self, guild_id: int, interaction: discord.Interaction):
-        if task := self.inactivity_tasks.get(guild_id):
-            task.cancel()
-
-        async def timer():
-            try:
-                await asyncio.sleep(600)  # 10분
-            except asyncio.CancelledError:
-                return
-            last_input = self.last_activity.get(guild_id)
-            if (
-                not self.is_playing.get(guild_id, False)
-                and last_input
-                and (datetime.datetime.utcnow() - last_input).total_seconds() >= 600
-            ):
-                await self.disconnect_and_cleanup(guild_id, interaction)
-
-        self.inactivity_tasks[guild_id] = asyncio.create_task(timer())
-
-    async def disconnect_and_cleanup(self, guild_id: int, interaction: discord.Interaction | None):
-        # 프리로드 리소스/태스크도 정리
-        if t := self.preload_tasks.get(guild_id):
-            t.cancel()
-        self.preload_tasks.pop(guild_id, None)
-        self.preloaded_sources.pop(guild_id, None)
-
-        vc = self.voice_clients.get(guild_id)
-        if vc and vc.is_connected():
-            try:
-                await vc.disconnect()
-            except Exception:
-                pass
-        self.voice_clients.pop(guild_id, None)
-        self.queues.pop(guild_id, None)
-        self.is_playing[guild_id] = False
-        self.current_songs[guild_id] = None
-        await self.delete_player_ui(guild_id)
-
-    # ---------- 음성 연결 ----------
-    async def join_voice_channel(self, interaction: discord.Interaction) -> discord.VoiceClient | None:
-        guild = interaction.guild
-        if guild is None:
-            await interaction.followup.send("🚫 길드 컨텍스트에서만 사용할 수 있어요.", ephemeral=True)
-            return None
-
-        if interaction.user is None or interaction.user.voice is None:
-            await interaction.followup.send("🚫 먼저 음성 채널에 들어가 주세요!", ephemeral=True)
-            return None
-
-        target_channel = interaction.user.voice.channel
-        vc = self.voice_clients.get(guild.id)
-
-        if vc is None or not vc.is_connected():
-            vc = await target_channel.connect()
-            self.voice_clients[guild.id] = vc
-            return vc
-
-        if getattr(vc, "channel", None) != target_channel:
-            await vc.move_to(target_channel)
-        return vc
-
-    # ---------- 검색 ----------
-    def search_youtube_blocking(self, query: str) -> dict | None:
-        ydl_opts = {
-            "format": "bestaudio/best",
-            "noplaylist": True,
-            "quiet": True,
-            "default_search": "ytsearch",
-            "cookiefile": "cookies.txt",  # 없으면 yt-dlp가 무시
-        }
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                target = query if is_youtube_url(query) else f"ytsearch:{query}"
-                info = ydl.extract_info(target, download=False)
-                if not info:
-                    return None
-                if "entries" in info:
-                    entries = info.get("entries") or []
-                    if not entries:
-                        return None
-                    info = entries[0]
-
-                return {
-                    "url": info.get("url"),
-                    "webpage_url": info.get("webpage_url") or info.get("original_url"),
-                    "title": info.get("title") or "(제목 없음)",
-                    "thumbnail": info.get("thumbnail", ""),
-                    "http_headers": info.get("http_headers") or {},  # ffmpeg용 헤더
-                }
-        except Exception:
-            return None
-
-    async def search_youtube_async(self, query: str) -> dict | None:
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(self.search_executor, self.search_youtube_blocking, query)
-
-    # ---------- FFmpeg 헤더/옵션 ----------
-    def _headers_to_beforeopt(self, headers: dict, referer: str | None = None) -> str:
-        """
-        ffmpeg -headers 인자에 넣을 원시 헤더(진짜 CRLF, 마지막 CRLF 포함) + UA/Origin/Referer 보강
-        """
-        add = {
-            "User-Agent": UA,
-            "Origin": "https://www.youtube.com",
-        }
-        if referer:
-            add["Referer"] = referer
-        merged = {**headers, **add}
-        raw = "\r\n".join(f"{k}: {v}" for k, v in merged.items()) + "\r\n"   # 실제 CRLF
-        return f'-headers "{raw}" '
-
-    def _make_ffmpeg_opts(
-        self,
-        headers: dict,
-        use_filter: bool,
-        for_pcm: bool = False,
-        referer: str | None = None,
-    ) -> dict:
-        before = (
-            self._headers_to_beforeopt(headers, referer=referer) +
-            "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 "
-            "-rw_timeout 30000000 "
-            "-nostdin -fflags +genpts -probesize 32M -analyzeduration 10M "
-            "-thread_queue_size 2048 "
-            f'-user_agent "{UA}" '
-        )
-        # 공통 옵션 (Opus 경로에는 -ar/-ac 넣지 않음 → 중복 경고 방지)
-        opts = "-vn -bufsize 8M -loglevel warning"
-        if use_filter:
-            opts = "-vn -af aresample=async=1:min_hard_comp=0.100:first_pts=0 -bufsize 8M -loglevel warning"
-        if for_pcm:
-            # PCM에서만 표준화
-            opts = "-vn -ar 48000 -ac 2 -bufsize 8M -loglevel warning"
-        return {"before_options": before, "options": opts, "executable": FFMPEG_PATH}
-
-    # ---------- 오디오 소스 생성(재시도) ----------
-    async def _create_source(self, url: str, headers: dict, referer: str | None):
-        # 1차: Opus 재인코딩 + aresample 필터
-        try:
-            return await discord.FFmpegOpusAudio.from_probe(
-                url, codec="libopus", bitrate=128,
-                **self._make_ffmpeg_opts(headers, use_filter=True, for_pcm=False, referer=referer)
-            )
-        except Exception:
-            pass
-        # 2차: Opus 재인코딩(필터 제거)
-        try:
-            return await discord.FFmpegOpusAudio.from_probe(
-                url, codec="libopus", bitrate=128,
-                **self._make_ffmpeg_opts(headers, use_filter=False, for_pcm=False, referer=referer)
-            )
-        except Exception:
-            pass
-        # 3차: PCM (최후 수단, 스트리밍)
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(
-            None,
-            lambda: discord.FFmpegPCMAudio(
-                url, **self._make_ffmpeg_opts(headers, use_filter=False, for_pcm=True, referer=referer)
-            )
-        )
-
-    async def create_audio_source_async(self, song: dict) -> discord.AudioSource:
-        url   = song["url"]
-        hdrs  = song.get("http_headers") or {}
-        refer = song.get("webpage_url") or None
-        return await self._create_source(url, hdrs, refer)
-
-    # ---------- 프리로드(선로딩) ----------
-    def _song_key(self, song: dict) -> str:
-        """프리로드 캐시 키(만료 최소화 위해 URL보다 webpage_url/제목 위주)"""
-        return song.get("webpage_url") or song.get("url") or song.get("title") or ""
-
-    def _cancel_preload(self, guild_id: int):
-        if t := self.preload_tasks.get(guild_id):
-            t.cancel()
-        self.preload_tasks.pop(guild_id, None)
-        self.preloaded_sources.pop(guild_id, None)
-
-    def _store_preloaded(self, guild_id: int, song: dict, source: discord.AudioSource):
-        key = self._song_key(song)
-        self.preloaded_sources[guild_id] = (key, source)
-
-    def _get_preloaded(self, guild_id: int, song: dict):
-        key = self._song_key(song)
-        stored = self.preloaded_sources.get(guild_id)
-        if stored and stored[0] == key:
-            return stored[1]
-        return None
-
-    def _schedule_preload_next(self, interaction: discord.Interaction, delay: float = 0.8):
-        """대기열 맨 앞 곡을 일정 지연 후 프리로드. 기존 태스크가 있으면 취소."""
-        guild_id = interaction.guild.id
-        # 기존 프리로드 태스크가 있으면 취소
-        if t := self.preload_tasks.get(guild_id):
-            t.cancel()
-
-        async def _task():
-            try:
-                await asyncio.sleep(delay)  # 재생 시작 직후/대기열 추가 직후 스파이크를 피해 약간 뒤에 수행
-                queue = self.queues.get(guild_id, [])
-                if not queue:
-                    return
-                next_song = queue[0]
-                # 이미 프리로드 되어 있으면 스킵
-                if self._get_preloaded(guild_id, next_song):
-                    return
-                # 소스 생성
-                src = await self.create_audio_source_async(next_song)
-                # 저장
-                self._store_preloaded(guild_id, next_song, src)
-            except asyncio.CancelledError:
-                return
-            except Exception:
-                # 프리로드 실패는 조용히 무시(실재생 시 재시도)
-                pass
-
-        self.preload_tasks[guild_id] = asyncio.create_task(_task())
-
-    # ---------- 재생/대기열 ----------
-    async def play_music(self, interaction: discord.Interaction, song: dict) -> bool:
-        guild_id = interaction.guild.id
-        vc = self.voice_clients.get(guild_id)
-        if vc is None:
-            vc = await self.join_voice_channel(interaction)
-            if vc is None:
-                self.is_playing[guild_id] = False
-                return False
-
-        try:
-            # 1순위: 프리로드된 소스가 있으면 재사용
-            source = self._get_preloaded(guild_id, song)
-            if source is None:
-                source = await self.create_audio_source_async(song)
-            else:
-                # 사용했으니 캐시 비움
-                self.preloaded_sources.pop(guild_id, None)
-        except Exception:
-            await interaction.followup.send("⚠️ 오디오 소스를 만들 수 없었어요. 다른 곡을 시도해 주세요.", ephemeral=True)
-            await self.play_next(interaction)
-            return False
-
-        self.current_songs[guild_id] = song
-
-        def _after_playback(error: Exception | None):
-            fut = asyncio.run_coroutine_threadsafe(self.play_next(interaction), self.bot.loop)
-            try:
-                fut.result()
-            except Exception:
-                pass
-
-        try:
-            vc.play(source, after=_after_playback)
-        except Exception:
-            await interaction.followup.send("⚠️ 재생을 시작할 수 없었어요.", ephemeral=True)
-            await self.play_next(interaction)
-            return False
-
-        # UI 갱신
-        await self.schedule_ui_update(interaction, delay=0.25)
-        # 다음 곡 프리로드 예약
-        self._schedule_preload_next(interaction, delay=0.8)
-        return True
-
-    async def play_next(self, interaction: discord.Interaction):
-        guild_id = interaction.guild.id
-        queue = self.queues.get(guild_id, [])
-        if queue:
-            next_song = queue.pop(0)
-            # 다음 곡 재생 → 그 다음 곡 프리로드 태스크는 새로 잡을 것
-            await self.play_music(interaction, next_song)
-        else:
-            self.is_playing[guild_id] = False
-            self.current_songs[guild_id] = None
-            # 프리로드 리소스/태스크 정리
-            self._cancel_preload(guild_id)
-            await self.delete_player_ui(guild_id)
-            await self.start_inactivity_timer(guild_id, interaction)
-
-    # ---------- UI ----------
-    async def schedule_ui_update(self, interaction: discord.Interaction, delay: float = 0.3):
-        guild_id = interaction.guild.id
-        if task := self.ui_update_tasks.get(guild_id):
-            task.cancel()
-
-        async def _task():
-            try:
-                await asyncio.sleep(delay)
-            except asyncio.CancelledError:
-                return
-            await self.send_player_ui(interaction)
-
-        self.ui_update_tasks[guild_id] = asyncio.create_task(_task())
-
-    async def send_player_ui(self, interaction: discord.Interaction):
-        guild_id = interaction.guild.id
-        song = self.current_songs.get(guild_id)
-        if not song:
-            return
-        embed = discord.Embed(
-            title="🎵 현재 재생 중",
-            description=f"[{song['title']}]({song['webpage_url']})",
-        )
-        if thumb := song.get("thumbnail"):
-            embed.set_thumbnail(url=thumb)
-
-        view = PlayerView(self, guild_id)
-
-        msg = self.last_message.get(guild_id)
-        if msg:
-            try:
-                await msg.edit(embed=embed, view=view)
-                return
-            except (discord.NotFound, discord.Forbidden):
-                pass
-
-        channel = interaction.channel
-        if channel is None:
-            return
-        try:
-            sent = await channel.send(embed=embed, view=view)
-            self.last_message[guild_id] = sent
-        except discord.Forbidden:
-            pass
-
-    async def delete_player_ui(self, guild_id: int):
-        if msg := self.last_message.get(guild_id):
-            try:
-                await msg.delete()
-            except (discord.NotFound, discord.Forbidden):
-                pass
-            finally:
-                self.last_message.pop(guild_id, None)
-
-    # ---------- Slash Commands ----------
-    @app_commands.command(name="play", description="노래를 재생합니다.")
-    async def play(self, interaction: discord.Interaction, *, query: str):
-        await interaction.response.defer()  # 3초 ACK
-
-        if interaction.guild is None:
-            await interaction.followup.send("🚫 길드에서만 사용할 수 있어요.", ephemeral=True)
-            return
-
-        guild_id = interaction.guild.id
-        self.update_activity(guild_id)
-
-        vc = await self.join_voice_channel(interaction)
-        if vc is None:
-            return
-
-        song = await self.search_youtube_async(query)
-        if not song or not song.get("url"):
-            await interaction.followup.send("🔍 검색 결과가 없어요. 다른 키워드/URL을 시도해 주세요.", ephemeral=True)
-            return
-
-        q = self.queues.setdefault(guild_id, [])
-        if self.is_playing.get(guild_id, False) and vc.is_playing():
-            q.append(song)
-            await interaction.followup.send(f"📥 **{song['title']}** 대기열에 추가됨!")
-            # 대기열이 이제 (막 추가되어) 1개가 됐다면 바로 프리로드 스케줄
-            if len(q) == 1:
-                self._schedule_preload_next(interaction, delay=0.6)
-        else:
-            self.is_playing[guild_id] = True
-            ok = await self.play_music(interaction, song)
-            if ok:
-                await interaction.followup.send(f"▶️ **{song['title']}** 재생 시작!")
-            # 실패하면 play_music 내부에서 처리
-
-    @app_commands.command(name="queue", description="대기열 보기")
-    async def queue(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True)
-        if interaction.guild is None:
-            await interaction.followup.send("🚫 길드에서만 사용할 수 있어요.", ephemeral=True)
-            return
-
-        guild_id = interaction.guild.id
-        self.update_activity(guild_id)
-        queue = self.queues.get(guild_id, [])
-        if not queue:
-            await interaction.followup.send("⛔ 대기열이 비어 있어요!", ephemeral=True)
-        else:
-            msg = "\n".join([f"{i+1}. {s['title']}" for i, s in enumerate(queue)])
-            await interaction.followup.send(f"📜 대기열:\n{msg}", ephemeral=True)
-
-    @app_commands.command(name="skip", description="다음 곡으로")
-    async def skip(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True)
-        if interaction.guild is None:
-            await interaction.followup.send("🚫 길드에서만 사용할 수 있어요.", ephemeral=True)
-            return
-
-        guild_id = interaction.guild.id
-        self.update_activity(guild_id)
-        vc = self.voice_clients.get(guild_id)
-        if vc and (vc.is_playing() or vc.is_paused()):
-            try:
-                vc.stop()  # after 콜백을 통해 다음 곡 진행
-            except Exception:
-                pass
-            # 스킵하면 기존 프리로드는 더 이상 유효하지 않을 수 있으니 취소
-            self._cancel_preload(guild_id)
-            await interaction.followup.send("⏭️ 스킵합니다.", ephemeral=True)
-        else:
-            await interaction.followup.send("⛔ 현재 재생 중인 곡이 없어요.", ephemeral=True)
-
-    @app_commands.command(name="stop", description="중지 및 퇴장")
-    async def stop(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True)
-
-        if interaction.guild is None:
-            await interaction.followup.send("🚫 길드에서만 사용할 수 있어요.", ephemeral=True)
-            return
-
-        guild_id = interaction.guild.id
-        self.update_activity(guild_id)
-
-        vc = self.voice_clients.get(guild_id)
-        if vc and (vc.is_playing() or vc.is_paused()):
-            try:
-                vc.stop()
-            except Exception:
-                pass
-            await asyncio.sleep(0.1)
-
-        await self.disconnect_and_cleanup(guild_id, interaction)
-        await interaction.followup.send("🛑 정지 및 나감", ephemeral=True)
-
-
-class PlayerView(discord.ui.View):
-    def __init__(self, music_bot: MusicBot, guild_id: int):
-        super().__init__(timeout=None)
-        self.music_bot = music_bot
-        self.guild_id = guild_id
-
-    @discord.ui.button(label="⏯️ 재생/일시정지", style=discord.ButtonStyle.primary, custom_id="player:toggle")
-    async def toggle_play(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.defer(ephemeral=True)
-        vc = self.music_bot.voice_clients.get(self.guild_id)
-        self.music_bot.update_activity(self.guild_id)
-        if not vc:
-            await interaction.followup.send("⛔ 보이스 연결이 없어요.", ephemeral=True)
-            return
-        if vc.is_playing():
-            vc.pause()
-            await interaction.followup.send("⏸️ 일시정지", ephemeral=True)
-        elif vc.is_paused():
-            vc.resume()
-            await interaction.followup.send("▶️ 재생", ephemeral=True)
-        else:
-            await interaction.followup.send("⛔ 재생 중이 아니에요.", ephemeral=True)
-
-    @discord.ui.button(label="⏭️ 다음 곡", style=discord.ButtonStyle.secondary, custom_id="player:next")
-    async def next_song(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.defer(ephemeral=True)
-        vc = self.music_bot.voice_clients.get(self.guild_id)
-        self.music_bot.update_activity(self.guild_id)
-        if vc and (vc.is_playing() or vc.is_paused()):
-            try:
-                vc.stop()
-            except Exception:
-                pass
-            # 프리로드 취소
-            self.music_bot._cancel_preload(self.guild_id)
-            await interaction.followup.send("⏭️ 다음 곡으로 이동합니다.", ephemeral=True)
-        else:
-            await interaction.followup.send("⛔ 재생 중이 아니에요.", ephemeral=True)
-
-    @discord.ui.button(label="📃 대기열 출력", style=discord.ButtonStyle.success, custom_id="player:queue")
-    async def show_queue(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.defer(ephemeral=True)
-        queue = self.music_bot.queues.get(self.guild_id, [])
-        self.music_bot.update_activity(self.guild_id)
-        if not queue:
-            await interaction.followup.send("⛔ 대기열이 비어 있어요!", ephemeral=True)
-        else:
-            msg = "\n".join([f"{i+1}. {s['title']}" for i, s in enumerate(queue)])
-            await interaction.followup.send(f"📜 대기열:\n{msg}", ephemeral=True)
-
-
-async def setup(bot: commands.Bot):
-    await bot.add_cog(MusicBot(bot))
+import discord
+from discord.ext import commands
+from discord import app_commands
+import yt_dlp
+import asyncio
+import bisect
+import datetime
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import os
+import random
+import re
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+try:
+    import numpy as np  # 선택 의존성: PCM 폴백 경로의 음량 보정
+except ImportError:
+    np = None
+
+FFMPEG_PATH = "C:/Tools/ffmpeg/bin/ffmpeg.exe"
+FFPROBE_PATH = os.path.join(os.path.dirname(FFMPEG_PATH), os.path.basename(FFMPEG_PATH).replace("ffmpeg", "ffprobe"))
+UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
+
+def is_youtube_url(url: str) -> bool:
+    if not url:
+        return False
+    u = url.lower()
+    return "youtube.com" in u or "youtu.be" in u
+
+
+# ---------- 검색 결과 캐시 ----------
+SEARCH_CACHE_MAX_ENTRIES = 512
+SEARCH_META_TTL = 24 * 3600        # 제목/썸네일/webpage_url 은 오래 보관
+SEARCH_STREAM_TTL_DEFAULT = 3600   # expire= 를 못 찾았을 때 스트림 URL 수명(초)
+SEARCH_STREAM_MARGIN = 120         # 만료 직전 URL 은 재생 도중 끊기므로 여유를 둠
+
+_YT_ID_RE = re.compile(r"(?:v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})")
+_EXPIRE_PATH_RE = re.compile(r"/expire/(\d+)")
+
+
+def youtube_video_id(url: str) -> str | None:
+    if not url or not is_youtube_url(url):
+        return None
+    m = _YT_ID_RE.search(url)
+    return m.group(1) if m else None
+
+
+def normalize_query(query: str) -> str:
+    """캐시 키: 유튜브 URL 은 정규 watch URL 로, 검색어는 소문자+공백 정리"""
+    q = (query or "").strip()
+    if vid := youtube_video_id(q):
+        return f"https://www.youtube.com/watch?v={vid}"
+    return " ".join(q.lower().split())
+
+
+def stream_url_expiry(url: str | None) -> float | None:
+    """googlevideo 서명 URL 의 expire= (epoch 초) 추출. 없으면 None"""
+    if not url:
+        return None
+    try:
+        qs = parse_qs(urlparse(url).query)
+        if vals := qs.get("expire"):
+            return float(vals[0])
+    except ValueError:
+        return None
+    if m := _EXPIRE_PATH_RE.search(url):
+        return float(m.group(1))
+    return None
+
+
+class SearchCache:
+    """
+    검색/추출 결과 LRU 캐시.
+    - 메타데이터(title/thumbnail/webpage_url)는 SEARCH_META_TTL 동안 유지
+    - 서명된 url/http_headers 는 expire= 기준으로 따로 만료
+    - 검색어 → 정규 webpage_url 별칭을 두어 같은 곡을 한 엔트리로 공유
+    """
+
+    def __init__(
+        self,
+        max_entries: int = SEARCH_CACHE_MAX_ENTRIES,
+        meta_ttl: float = SEARCH_META_TTL,
+        stream_ttl_default: float = SEARCH_STREAM_TTL_DEFAULT,
+        stream_margin: float = SEARCH_STREAM_MARGIN,
+    ):
+        self.max_entries = max_entries
+        self.meta_ttl = meta_ttl
+        self.stream_ttl_default = stream_ttl_default
+        self.stream_margin = stream_margin
+        self._entries: OrderedDict[str, dict] = OrderedDict()  # webpage_url -> entry
+        self._aliases: dict[str, str] = {}                     # 정규화된 검색어 -> webpage_url
+        self._lock = threading.Lock()  # 검색 스레드/이벤트 루프 양쪽에서 접근
+
+        self.hits = 0
+        self.misses = 0
+        self.stream_refreshes = 0  # 메타는 있지만 스트림 URL 이 만료된 경우
+        self.evictions = 0
+
+    def _resolve(self, query: str) -> tuple[str, dict] | None:
+        norm = normalize_query(query)
+        key = self._aliases.get(norm, norm)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return key, entry
+
+    def lookup(self, query: str) -> tuple[dict | None, str | None]:
+        """
+        (song, refresh_target) 반환.
+        - 완전 적중: (song 사본, None)
+        - 메타만 유효(스트림 만료): (None, webpage_url) → 검색 단계 없이 URL 로 재추출
+        - 미스: (None, None)
+        """
+        now = time.time()
+        with self._lock:
+            found = self._resolve(query)
+            if found is None:
+                self.misses += 1
+                return None, None
+            key, entry = found
+            if now - entry["stored_at"] > self.meta_ttl:
+                self._drop(key)
+                self.misses += 1
+                return None, None
+            self._entries.move_to_end(key)
+            if entry["stream_expires_at"] - self.stream_margin > now:
+                self.hits += 1
+                return self._as_song(entry), None
+            self.stream_refreshes += 1
+            return None, entry["song"]["webpage_url"]
+
+    def store(self, query: str, song: dict):
+        key = song.get("webpage_url")
+        if not key or not song.get("url"):
+            return
+        key = normalize_query(key)
+        expires = stream_url_expiry(song.get("url")) or (time.time() + self.stream_ttl_default)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {"aliases": set()}
+                self._entries[key] = entry
+            entry["song"] = dict(song)
+            entry["stored_at"] = time.time()
+            entry["stream_expires_at"] = expires
+            self._entries.move_to_end(key)
+            for alias in {normalize_query(query), key}:
+                self._aliases[alias] = key
+                entry["aliases"].add(alias)
+            while len(self._entries) > self.max_entries:
+                old_key = next(iter(self._entries))
+                self._drop(old_key)
+                self.evictions += 1
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for alias in entry["aliases"]:
+            if self._aliases.get(alias) == key:
+                self._aliases.pop(alias, None)
+
+    @staticmethod
+    def _as_song(entry: dict) -> dict:
+        song = dict(entry["song"])
+        song["http_headers"] = dict(song.get("http_headers") or {})
+        return song
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses + self.stream_refreshes
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stream_refreshes": self.stream_refreshes,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+# ---------- /play 자동완성 ----------
+SUGGEST_LIMIT = 10            # 후보 수 (Discord 최대 25)
+SUGGEST_MIN_CHARS = 2
+SUGGEST_DEBOUNCE = 0.35       # 사용자별: 마지막 입력 후 이만큼 조용해야 실제 검색
+SUGGEST_DEADLINE = 2.5        # 자동완성 응답 제한(3초) 안에 끝내기
+SUGGEST_TTL = 600
+SUGGEST_CACHE_MAX_ENTRIES = 2048
+SUGGEST_PREFIX_MIN = 3        # 접두사 결과를 걸러 이만큼 남으면 검색 없이 응답
+SUGGEST_WORKERS = 2
+SUGGEST_CHOICE_MAX = 100      # Choice.name 길이 제한
+
+
+class SuggestionCache:
+    """
+    자동완성 검색 결과 캐시 (정규화된 입력 -> 플랫 검색 상위 N개).
+    같은 입력이 없으면 가장 긴 캐시된 접두사의 결과를 지금 입력의 단어로 걸러서 씀
+    → 한 글자씩 타이핑하는 동안엔 대부분 검색 없이 응답
+    """
+
+    def __init__(self, max_entries: int = SUGGEST_CACHE_MAX_ENTRIES, ttl: float = SUGGEST_TTL,
+                 prefix_min: int = SUGGEST_PREFIX_MIN):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.prefix_min = prefix_min
+        self._entries: OrderedDict[str, tuple[float, list[dict]]] = OrderedDict()
+
+        self.hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+
+    def _get(self, key: str, now: float) -> list[dict] | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if now - entry[0] > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def lookup(self, query: str) -> tuple[list[dict] | None, bool]:
+        """(결과, 정확히 일치 여부). 접두사 결과가 prefix_min 개 미만이면 걸러진 일부만 돌려주고 미스로 셈"""
+        key, now = normalize_query(query), time.time()
+        if (results := self._get(key, now)) is not None:
+            self.hits += 1
+            return results, True
+        words = key.split()
+        for end in range(len(key) - 1, SUGGEST_MIN_CHARS - 1, -1):
+            if (base := self._get(key[:end], now)) is None:
+                continue
+            narrowed = [r for r in base if all(w in r["title"].lower() for w in words)]
+            if len(narrowed) >= self.prefix_min:
+                self.prefix_hits += 1
+                return narrowed, False
+            self.misses += 1
+            return narrowed or None, False
+        self.misses += 1
+        return None, False
+
+    def store(self, query: str, results: list[dict]):
+        key = normalize_query(query)
+        self._entries[key] = (time.time(), results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.prefix_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "prefix_hits": self.prefix_hits,
+            "misses": self.misses,
+            "hit_rate": ((self.hits + self.prefix_hits) / total) if total else 0.0,
+        }
+
+
+# ---------- 계측(메트릭) ----------
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))  # 0 이면 끔. 127.0.0.1 에만 바인딩
+METRICS_PREFIX = "musicbot_"
+METRICS_RECENT_ERRORS = 50
+METRICS_SCAN_TTL = 15.0  # /proc 스캔·길드별 메모리 추정 결과를 재사용하는 시간(초), 스크레이프마다 다시 계산하지 않음
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 기본 버킷이 너무 거친 지표만 따로 (곡 전환 간격은 20ms 프레임 단위로 봐야 함)
+_HISTOGRAM_BUCKETS = {
+    "track_gap_seconds": (0.001, 0.005, 0.02, 0.04, 0.06, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0),
+}
+
+
+class Histogram:
+    """Prometheus 식 고정 버킷 히스토그램 (분위수는 버킷 상한으로 근사)"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple[float, ...] = _LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 마지막 칸 = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.bounds[i] if i < len(self.bounds) else float("inf")
+        return float("inf")
+
+
+class Metrics:
+    """
+    파이프라인 단계별 지연 히스토그램/카운터. 음성 스레드·executor 스레드에서도 기록하므로 잠금 사용.
+    이름은 접두어 없이, 라벨은 키워드 인자로: observe("probe_seconds", 0.3, source="ffprobe")
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms: dict[tuple[str, tuple], Histogram] = {}
+        self.counters: dict[tuple[str, tuple], float] = {}
+        self.recent_errors: deque[tuple[float, str, str]] = deque(maxlen=METRICS_RECENT_ERRORS)
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if (h := self.histograms.get(key)) is None:
+                h = self.histograms[key] = Histogram(_HISTOGRAM_BUCKETS.get(name, _LATENCY_BUCKETS))
+            h.observe(value)
+
+    def inc(self, name: str, n: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def error(self, stage: str, exc: BaseException):
+        """삼키던 예외를 단계/종류별로 세고 최근 목록에 남김"""
+        # ExtractError 는 워커에서 잡은 원래 예외 종류로
+        self.inc("errors_total", stage=stage, error=getattr(exc, "kind", None) or type(exc).__name__)
+        self.recent_errors.append((time.time(), stage, repr(exc)[:200]))
+
+    def summary(self, name: str) -> dict[str, dict]:
+        """라벨 조합별 {count, p50, p95, avg} (초)"""
+        out = {}
+        with self._lock:
+            items = [(labels, h) for (n, labels), h in self.histograms.items() if n == name]
+            for labels, h in items:
+                label = ",".join(f"{k}={v}" for k, v in labels) or "all"
+                out[label] = {
+                    "count": h.count, "p50": h.quantile(0.5), "p95": h.quantile(0.95),
+                    "avg": h.sum / h.count if h.count else None,
+                }
+        return out
+
+    def counter_values(self, name: str) -> dict[tuple, float]:
+        with self._lock:
+            return {labels: v for (n, labels), v in self.counters.items() if n == name}
+
+    def counter_total(self, name: str) -> float:
+        """라벨 조합을 모두 합친 카운터 값"""
+        return sum(self.counter_values(name).values())
+
+    @staticmethod
+    def _labels(labels, le: str | None = None) -> str:
+        pairs = list(labels) + ([("le", le)] if le is not None else [])
+        parts = []
+        for k, v in pairs:
+            escaped = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            parts.append(k + '="' + escaped + '"')
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self, gauges: list[tuple[str, dict, float]]) -> str:
+        """Prometheus text exposition (0.0.4). gauges: [(이름, 라벨, 값)], 이름이 _total 이면 counter"""
+        lines: list[str] = []
+        typed: set[str] = set()
+
+        def head(name: str, kind: str):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for (name, labels), h in sorted(self.histograms.items()):
+                full = METRICS_PREFIX + name
+                head(full, "histogram")
+                cumulative = 0
+                for bound, n in zip(self.bounds_with_inf(h), h.counts):
+                    cumulative += n
+                    lines.append(f"{full}_bucket{self._labels(labels, bound)} {cumulative}")
+                lines.append(f"{full}_sum{self._labels(labels)} {h.sum}")
+                lines.append(f"{full}_count{self._labels(labels)} {h.count}")
+            for (name, labels), v in sorted(self.counters.items()):
+                full = METRICS_PREFIX + name
+                head(full, "counter")
+                lines.append(f"{full}{self._labels(labels)} {v}")
+        for name, labels, v in gauges:
+            if v is None:
+                continue
+            full = METRICS_PREFIX + name
+            head(full, "counter" if name.endswith("_total") else "gauge")  # 누적값은 counter 로 노출
+            lines.append(f"{full}{self._labels(sorted(labels.items()))} {v}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def bounds_with_inf(h: Histogram) -> list[str]:
+        return [repr(float(b)) for b in h.bounds] + ["+Inf"]
+
+
+METRICS = Metrics()
+
+
+def process_rss_bytes() -> int | None:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # 최대치(리눅스 외)
+    except (ImportError, AttributeError):
+        return None
+
+
+def ffmpeg_process_count() -> int | None:
+    """이 프로세스가 띄운 ffmpeg/ffprobe 자식 수 (/proc 없는 OS 는 None)"""
+    if not os.path.isdir("/proc"):
+        return None
+    me, n = os.getpid(), 0
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat", "r") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        comm_end = stat.rfind(")")
+        comm = stat[stat.find("(") + 1:comm_end]
+        fields = stat[comm_end + 2:].split()
+        if len(fields) > 1 and int(fields[1]) == me and comm.startswith("ffmpeg"):
+            n += 1
+    return n
+
+
+async def serve_metrics(render, port: int = METRICS_PORT) -> asyncio.AbstractServer | None:
+    """127.0.0.1:port 에서 GET /metrics 에 await render() 결과를 돌려주는 최소 HTTP 서버"""
+    if port <= 0:
+        return None
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            while (line := await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/"):
+                body, status = (await render()).encode(), "200 OK"
+            else:
+                body, status = b"not found\n", "404 Not Found"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (OSError, asyncio.TimeoutError, UnicodeError, ValueError,
+                asyncio.LimitOverrunError, asyncio.IncompleteReadError):
+            pass  # 너무 긴 줄(readline 한도 초과)/중간에 끊긴 요청 포함
+        finally:
+            writer.close()
+
+    try:
+        return await asyncio.start_server(handle, "127.0.0.1", port)
+    except OSError:
+        return None  # 포트 사용 중
+
+
+# ---------- 프로파일러(루프 지연 / 음성 스레드 정체) ----------
+PROFILE_ENABLED = os.getenv("PROFILE", "0") == "1"  # 기본은 꺼짐. 정체를 조사할 때만 PROFILE=1 로 켜고 재시작
+PROFILE_TICK = 0.1                                   # 루프 하트비트 주기(초)
+PROFILE_SLOW = float(os.getenv("PROFILE_SLOW_MS", "100")) / 1000  # 루프를 이보다 오래 잡으면 정체로 기록
+PROFILE_WINDOW = 300                                 # 보고서 롤링 구간(초)
+PROFILE_RECENT = 100                                 # 보관할 최근 정체 기록 수
+PROFILE_STACK_DEPTH = 8
+VOICE_STALL_MS = int(os.getenv("VOICE_STALL_MS", "60"))  # 프레임 간격(정상 20ms)이 이보다 길면 정체
+
+
+def _stack_summary(frame, depth: int = PROFILE_STACK_DEPTH) -> tuple[str, list[str]]:
+    """
+    (루프를 잡고 있는 코루틴/콜백, 안쪽부터 호출 위치 목록).
+    안쪽에서부터 올라가다 asyncio 디스패치 프레임을 만나면 멈춤 → 그 직전 프레임이 태스크 코루틴 또는 콜백
+    """
+    sites, owner = [], "?"
+    while frame is not None:
+        code = frame.f_code
+        path = code.co_filename
+        if f"{os.sep}asyncio{os.sep}" in path or "/asyncio/" in path:
+            if sites:
+                break
+        else:
+            if len(sites) < depth:
+                sites.append(f"{os.path.basename(path)}:{frame.f_lineno} {code.co_name}")
+            owner = getattr(code, "co_qualname", code.co_name)
+        frame = frame.f_back
+    return owner, sites
+
+
+class LoopProfiler:
+    """
+    이벤트 루프 하트비트(call_later)로 루프 지연을 재고, 감시 스레드가 하트비트가 PROFILE_SLOW 넘게 멈춘 순간
+    루프 스레드 스택을 떠서 어느 코루틴/콜백이 어디서 루프를 잡고 있었는지 남김.
+    음성 스레드 프레임 간격은 ChainedSource → GuildBufferStats 에서 재고, 정체만 voice_stall() 로 넘어옴
+    """
+
+    def __init__(self, tick: float = PROFILE_TICK, slow: float = PROFILE_SLOW, window: float = PROFILE_WINDOW):
+        self.tick = tick
+        self.slow = slow
+        self.window = window
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread_id: int | None = None
+        self._handle: asyncio.TimerHandle | None = None
+        self._beat = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watchdog: threading.Thread | None = None
+        self._pending: dict | None = None  # 감시 스레드가 정체 도중 떠 둔 스택
+        self.lag: deque[tuple[float, float]] = deque(maxlen=int(window / tick) + 1)  # (시각, 지연)
+        self.stalls: deque[dict] = deque(maxlen=PROFILE_RECENT)
+        self.voice_stalls: deque[dict] = deque(maxlen=PROFILE_RECENT)
+        self.started_at = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._handle is not None
+
+    def start(self):
+        """루프 스레드에서 호출"""
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()  # 재시작해도 이전 감시 스레드는 자기 이벤트로 종료
+        self.started_at = time.time()
+        self._beat = time.perf_counter()
+        self._handle = self._loop.call_later(self.tick, self._tick)
+        self._watchdog = threading.Thread(target=self._watch, args=(self._stop,), name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        self._stop.set()
+
+    def _tick(self):
+        now = time.perf_counter()
+        prev, self._beat = self._beat, now
+        lag = max(0.0, now - prev - self.tick)
+        self.lag.append((now, lag))
+        METRICS.observe("loop_lag_seconds", lag)
+        if lag >= self.slow:
+            with self._lock:
+                snap, self._pending = self._pending, None
+            if snap is None or snap["beat"] != prev:
+                snap = {"owner": "?", "stack": []}  # 감시 스레드가 못 본 짧은 정체
+            with self._lock:
+                self.stalls.append({
+                    "at": time.time(), "end": now, "duration": lag, "owner": snap["owner"], "stack": snap["stack"],
+                })
+            METRICS.inc("loop_stalls_total")
+        self._handle = self._loop.call_later(self.tick, self._tick)
+
+    def _watch(self, stop: threading.Event):
+        while not stop.wait(self.slow / 2):
+            beat = self._beat
+            if time.perf_counter() - beat < self.tick + self.slow:
+                continue
+            if (pending := self._pending) is not None and pending["beat"] == beat:
+                continue  # 이번 정체는 이미 떠 둠
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            owner, stack = _stack_summary(frame)
+            del frame
+            with self._lock:
+                self._pending = {"beat": beat, "owner": owner, "stack": stack}
+
+    def loop_blocked(self, start: float, end: float) -> bool:
+        """perf_counter 구간 [start, end] 동안 루프가 정체돼 있었는지 (음성 스레드에서 호출)"""
+        if self.running and end - self._beat > self.tick + self.slow:
+            return True
+        with self._lock:
+            recent = list(self.stalls)[-10:]
+        return any(s["end"] - s["duration"] < end and s["end"] > start for s in recent)
+
+    def voice_stall(self, guild_id: int | None, gap: float, read_seconds: float):
+        """
+        음성 스레드에서 호출. 원인 추정:
+        source = 직전 read() 자체가 오래 걸림(ffmpeg/네트워크/버퍼 언더런),
+        event_loop = 같은 시각 루프도 멈춰 있었음(GIL 을 잡은 루프 코드), scheduler = 그 외(스레드가 제때 못 깨어남)
+        """
+        now = time.perf_counter()
+        if read_seconds >= gap / 2:
+            cause = "source"
+        elif self.loop_blocked(now - gap, now):
+            cause = "event_loop"
+        else:
+            cause = "scheduler"
+        with self._lock:
+            self.voice_stalls.append({
+                "at": time.time(), "guild_id": guild_id, "gap": gap, "read": read_seconds, "cause": cause,
+            })
+        METRICS.inc("voice_stalls_total", cause=cause)
+
+    def report(self) -> dict:
+        now, wall = time.perf_counter(), time.time()
+        lags = sorted(lag for t, lag in list(self.lag) if now - t <= self.window)
+        with self._lock:
+            stalls = [s for s in self.stalls if wall - s["at"] <= self.window]
+            voice = [v for v in self.voice_stalls if wall - v["at"] <= self.window]
+        causes: dict[str, int] = {}
+        for v in voice:
+            causes[v["cause"]] = causes.get(v["cause"], 0) + 1
+
+        def q(p: float) -> float | None:
+            return lags[min(len(lags) - 1, int(p * len(lags)))] if lags else None
+
+        return {
+            "window": min(self.window, wall - self.started_at) if self.started_at else 0.0,
+            "lag_p50": q(0.5), "lag_p99": q(0.99), "lag_max": lags[-1] if lags else None,
+            "stalls": stalls, "voice_stalls": voice, "voice_causes": causes,
+        }
+
+    def reset(self):
+        with self._lock:
+            self.stalls.clear()
+            self.voice_stalls.clear()
+            self._pending = None
+        self.lag.clear()
+
+
+PROFILER = LoopProfiler()
+
+
+def _ms(seconds: float | None) -> str:
+    return "?" if seconds is None else f"{seconds * 1000:.0f}ms"
+
+
+# ---------- yt-dlp 추출 워커 풀 ----------
+EXTRACTOR_WORKERS = int(os.getenv("EXTRACTOR_WORKERS", "2"))
+EXTRACTOR_MODE = os.getenv("EXTRACTOR_MODE", "thread")  # "thread" | "process"(GIL 우회)
+
+YDL_OPTS = {
+    "format": "bestaudio/best",
+    "noplaylist": True,
+    "quiet": True,
+    "default_search": "ytsearch",
+    "cookiefile": "cookies.txt",  # 없으면 yt-dlp가 무시
+}
+
+# 플레이리스트: 메타데이터만(플랫) 받아 자리표시 곡으로 넣고, 스트림 URL 은 재생 직전에 해석
+FLAT_YDL_OPTS = {
+    "quiet": True,
+    "extract_flat": "in_playlist",
+    "noplaylist": False,
+    "cookiefile": "cookies.txt",
+}
+PLAYLIST_MAX_ITEMS = int(os.getenv("PLAYLIST_MAX_ITEMS", "5000"))
+PLAYLIST_FIRST_BATCH = 5    # 첫 묶음은 작게 → 바로 재생 시작
+PLAYLIST_BATCH = 50
+PLAYLIST_STREAM_WORKERS = 2
+PLAYLIST_PROGRESS_INTERVAL = 5.0  # 진행 메시지 수정 최소 간격(초)
+
+# 워커(스레드/프로세스)마다 하나씩 두고 재사용하는 YoutubeDL
+_worker_state = threading.local()
+_worker_ydls: list = []
+_worker_ydls_lock = threading.Lock()
+
+
+def _init_extractor_worker(opts: dict):
+    ydl = yt_dlp.YoutubeDL(opts)
+    _worker_state.ydl = ydl
+    with _worker_ydls_lock:
+        _worker_ydls.append(ydl)
+
+
+def _worker_flat_ydl():
+    """플레이리스트 플랫 추출용 YoutubeDL (스레드별 1개)"""
+    ydl = getattr(_worker_state, "flat_ydl", None)
+    if ydl is None:
+        ydl = _worker_state.flat_ydl = yt_dlp.YoutubeDL(FLAT_YDL_OPTS)
+        with _worker_ydls_lock:
+            _worker_ydls.append(ydl)
+    return ydl
+
+
+def _close_extractor_workers():
+    with _worker_ydls_lock:
+        for ydl in _worker_ydls:
+            try:
+                ydl.close()
+            except Exception:
+                pass
+        _worker_ydls.clear()
+
+
+def search_target(query: str) -> str:
+    return query if is_youtube_url(query) else f"ytsearch:{query}"
+
+
+class ExtractError(Exception):
+    """
+    워커 추출 실패. yt-dlp 예외는 프로세스 경계를 넘으며 언피클에 실패할 수 있어 종류/메시지만 담아 다시 던짐
+    (ExtractorPool 이 failed/outcome="fail" 로 세고 호출자에게는 None)
+    """
+
+    def __init__(self, kind: str, message: str):
+        super().__init__(kind, message)
+        self.kind = kind
+        self.message = message
+
+    def __str__(self) -> str:
+        return f"{self.kind}: {self.message}"
+
+
+def extract_song_blocking(target: str) -> dict | None:
+    """
+    워커에서 실행: 현재 워커의 YoutubeDL 로 추출 후 재생에 필요한 필드만 반환(피클 가능).
+    결과가 없으면 None, 추출 자체가 실패하면 ExtractError
+    """
+    ydl = getattr(_worker_state, "ydl", None)
+    if ydl is None:
+        _init_extractor_worker(YDL_OPTS)
+        ydl = _worker_state.ydl
+    try:
+        info = ydl.extract_info(target, download=False)
+    except Exception as e:
+        raise ExtractError(type(e).__name__, str(e)[:500]) from None
+    if not info:
+        return None
+    if "entries" in info:
+        entries = info.get("entries") or []
+        if not entries:
+            return None
+        info = entries[0]
+
+    return {
+        "url": info.get("url"),
+        "webpage_url": info.get("webpage_url") or info.get("original_url"),
+        "title": info.get("title") or "(제목 없음)",
+        "thumbnail": info.get("thumbnail", ""),
+        "duration": info.get("duration"),
+        "http_headers": info.get("http_headers") or {},  # ffmpeg용 헤더
+        # 컨테이너/코덱 정보 → 이미 Opus 면 재인코딩 없이 copy 경로 사용
+        "format_id": info.get("format_id"),
+        "acodec": info.get("acodec"),
+        "ext": info.get("ext"),
+        "abr": info.get("abr"),
+        "asr": info.get("asr"),
+    }
+
+
+def is_playlist_url(query: str) -> bool:
+    """list= 가 붙은 유튜브 URL (플레이리스트/믹스)"""
+    if not is_youtube_url(query):
+        return False
+    return bool(parse_qs(urlparse(query.strip()).query).get("list"))
+
+
+def _flat_entry_info(entry: dict) -> dict | None:
+    vid = entry.get("id")
+    page = entry.get("webpage_url") or entry.get("url")
+    if vid and not (page or "").startswith("http"):
+        page = f"https://www.youtube.com/watch?v={vid}"
+    if not page:
+        return None
+    thumbs = entry.get("thumbnails") or []
+    return {
+        "webpage_url": page,
+        "title": entry.get("title") or "(제목 없음)",
+        "duration": entry.get("duration"),
+        "thumbnail": thumbs[-1].get("url", "") if thumbs else "",
+    }
+
+
+def stream_playlist_blocking(url: str, emit, stop: threading.Event) -> str | None:
+    """
+    플레이리스트를 플랫 추출하면서 받은 항목을 묶음 단위로 emit(list[dict]) 에 흘려보냄.
+    process=False 로 받으면 entries 가 제너레이터라 페이지를 받는 대로 바로 내보낼 수 있음.
+    반환: 플레이리스트 제목
+    """
+    ydl = _worker_flat_ydl()
+    info = ydl.extract_info(url, download=False, process=False)
+    # watch?v=..&list=.. 는 플레이리스트 URL 로 한 번 더 넘겨짐
+    for _ in range(3):
+        if not info or info.get("_type") not in ("url", "url_transparent"):
+            break
+        info = ydl.extract_info(info["url"], download=False, process=False, ie_key=info.get("ie_key"))
+    if not info:
+        return None
+
+    batch, size, total = [], PLAYLIST_FIRST_BATCH, 0
+    for entry in info.get("entries") or []:
+        if stop.is_set() or total >= PLAYLIST_MAX_ITEMS:
+            break
+        if entry and (item := _flat_entry_info(entry)):
+            batch.append(item)
+            total += 1
+        if len(batch) >= size:
+            emit(batch)
+            batch, size = [], PLAYLIST_BATCH
+    if batch:
+        emit(batch)
+    return info.get("title")
+
+
+def search_suggestions_blocking(query: str, limit: int = SUGGEST_LIMIT) -> list[dict] | None:
+    """자동완성용 플랫 검색: 스트림 URL 없이 영상 id/제목/길이만 받음 (페이지 하나라 추출보다 훨씬 가벼움)"""
+    started = time.perf_counter()
+    try:
+        info = _worker_flat_ydl().extract_info(f"ytsearch{limit}:{query}", download=False)
+    except Exception as e:
+        METRICS.error("suggest", e)
+        return None
+    finally:
+        METRICS.observe("suggest_seconds", time.perf_counter() - started)
+    results = []
+    for entry in (info or {}).get("entries") or []:
+        vid = (entry or {}).get("id")
+        if not vid or len(vid) != 11:
+            continue  # 채널/플레이리스트 결과는 제외
+        results.append({"id": vid, "title": entry.get("title") or "(제목 없음)", "duration": entry.get("duration")})
+    return results
+
+
+def is_opus_passthrough(song: "Track") -> bool:
+    """추출 결과가 48kHz Opus 면 True (remux 만 하면 Discord 로 그대로 보낼 수 있음)"""
+    acodec = (song.acodec or "").lower()
+    if not acodec.startswith("opus"):
+        return False
+    return song.asr in (None, 48000)
+
+
+# ---------- 대기열 ----------
+QUEUE_PAGE_SIZE = 10
+QUEUE_TITLE_MAX = 80
+# 같은 곡을 다시 넣으면 기본은 경고만 하고 추가. "1" 이면 거절 (서버 운영자가 고르는 옵션)
+QUEUE_REJECT_DUPLICATES = os.getenv("QUEUE_REJECT_DUPLICATES", "0") == "1"
+
+_TRACK_INFO_FIELDS = (
+    "url", "webpage_url", "title", "thumbnail", "duration", "http_headers",
+    "format_id", "acodec", "ext", "abr", "asr",
+)
+_interned_headers: dict[tuple, dict] = {}
+
+
+def _intern_headers(headers: dict | None) -> dict:
+    """곡마다 같은 http_headers dict 를 들고 있지 않도록 동일 내용은 하나만 공유"""
+    key = tuple(sorted((headers or {}).items()))
+    if (shared := _interned_headers.get(key)) is None:
+        if len(_interned_headers) > 256:
+            _interned_headers.clear()
+        shared = _interned_headers[key] = dict(key)
+    return shared
+
+
+class Track:
+    """대기열 곡 레코드 (자유 형식 dict 대신 __slots__ 로 곡당 메모리 절약)"""
+
+    __slots__ = _TRACK_INFO_FIELDS + ("norm_key", "source_path", "probe_source")
+
+    def __init__(self):
+        self.url: str | None = None
+        self.webpage_url: str | None = None
+        self.title: str = "(제목 없음)"
+        self.thumbnail: str = ""
+        self.duration: float | None = None
+        self.http_headers: dict = _intern_headers(None)
+        self.format_id: str | None = None
+        self.acodec: str | None = None
+        self.ext: str | None = None
+        self.abr: float | None = None
+        self.asr: int | None = None
+        self.norm_key: str = ""               # 정규화된 key (중복 검사용, update 때 계산)
+        self.source_path: str | None = None   # 실제로 쓴 소스 경로(disk/copy/...)
+        self.probe_source: str | None = None  # 프로브 정보 출처(cache/metadata/ffprobe)
+
+    @classmethod
+    def from_info(cls, info: dict) -> "Track":
+        track = cls()
+        track.update(info)
+        return track
+
+    def update(self, info: dict):
+        """추출 결과(dict)로 필드 갱신 (스트림 URL 재해석 시에도 사용)"""
+        for name in _TRACK_INFO_FIELDS:
+            if name in info:
+                setattr(self, name, info[name])
+        self.title = self.title or "(제목 없음)"
+        self.http_headers = _intern_headers(self.http_headers)
+        self.norm_key = normalize_query(self.key)
+
+    @property
+    def key(self) -> str:
+        return self.webpage_url or self.url or self.title or ""
+
+    @property
+    def resolved(self) -> bool:
+        """플레이리스트 자리표시 곡은 스트림 URL 이 없음"""
+        return bool(self.url)
+
+
+class GuildQueue:
+    """
+    길드별 대기열. deque 기반이라 앞/뒤 push/pop 이 O(1),
+    webpage_url 인덱스로 중복 검사도 O(1)
+    """
+
+    def __init__(self):
+        self._tracks: deque[Track] = deque()
+        self._keys: dict[str, int] = {}  # 정규화 webpage_url -> 대기열 내 개수
+        self.version = 0                 # 변경될 때마다 증가 (상태 저장 시 변경 감지용)
+
+    def _index(self, track: Track):
+        k = track.norm_key
+        self._keys[k] = self._keys.get(k, 0) + 1
+        self.version += 1
+
+    def _unindex(self, track: Track):
+        k = track.norm_key
+        self.version += 1
+        if (n := self._keys.get(k, 0)) <= 1:
+            self._keys.pop(k, None)
+        else:
+            self._keys[k] = n - 1
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def __bool__(self) -> bool:
+        return bool(self._tracks)
+
+    def __iter__(self):
+        return iter(self._tracks)
+
+    def __getitem__(self, index: int) -> Track:
+        return self._tracks[index]
+
+    def discard(self, track: Track) -> bool:
+        """같은 객체(is)를 찾아 제거"""
+        for i, t in enumerate(self._tracks):
+            if t is track:
+                del self._tracks[i]
+                self._unindex(track)
+                return True
+        return False
+
+    def contains(self, webpage_url: str | None) -> bool:
+        return bool(webpage_url) and normalize_query(webpage_url) in self._keys
+
+    def append(self, track: Track):
+        self._tracks.append(track)
+        self._index(track)
+
+    def appendleft(self, track: Track):
+        self._tracks.appendleft(track)
+        self._index(track)
+
+    def popleft(self) -> Track | None:
+        if not self._tracks:
+            return None
+        track = self._tracks.popleft()
+        self._unindex(track)
+        return track
+
+    def peek(self, n: int) -> list[Track]:
+        return list(itertools.islice(self._tracks, n))
+
+    def remove(self, index: int) -> Track:
+        """0 기반 인덱스의 곡 제거 (IndexError 전파)"""
+        track = self._tracks[index]
+        del self._tracks[index]
+        self._unindex(track)
+        return track
+
+    def move(self, src: int, dst: int) -> Track:
+        track = self._tracks[src]
+        del self._tracks[src]
+        self._tracks.insert(max(0, min(dst, len(self._tracks))), track)
+        self.version += 1
+        return track
+
+    def shuffle(self):
+        items = list(self._tracks)
+        random.shuffle(items)
+        self._tracks = deque(items)
+        self.version += 1
+
+    def clear(self):
+        self._tracks.clear()
+        self._keys.clear()
+        self.version += 1
+
+    def page(self, page: int, per_page: int = QUEUE_PAGE_SIZE) -> list[tuple[int, Track]]:
+        """해당 페이지의 (인덱스, 곡)만 꺼냄 — 전체를 문자열로 만들지 않음"""
+        start = page * per_page
+        return list(zip(range(start, start + per_page), itertools.islice(self._tracks, start, start + per_page)))
+
+    def page_count(self, per_page: int = QUEUE_PAGE_SIZE) -> int:
+        return max(1, (len(self._tracks) + per_page - 1) // per_page)
+
+
+def render_queue_page(queue: GuildQueue, page: int) -> tuple[discord.Embed, int]:
+    """(embed, 보정된 page) — 보이는 페이지만 렌더링"""
+    pages = queue.page_count()
+    page = max(0, min(page, pages - 1))
+    lines = []
+    for i, track in queue.page(page):
+        title = track.title if len(track.title) <= QUEUE_TITLE_MAX else track.title[:QUEUE_TITLE_MAX - 1] + "…"
+        lines.append(f"{i + 1}. {discord.utils.escape_markdown(title)}")
+    embed = discord.Embed(title=f"📜 대기열 ({len(queue)}곡)", description="\n".join(lines))
+    embed.set_footer(text=f"페이지 {page + 1}/{pages}")
+    return embed, page
+
+
+class ExtractorPool:
+    """
+    오래 사는 yt-dlp 워커 풀 + 길드별 공정 스케줄링.
+    - 작업은 길드별 대기열에 쌓이고, 빈 워커가 생길 때마다 길드를 라운드로빈으로 하나씩 꺼냄
+      → 한 길드가 /play 를 연타해도 다른 길드가 굶지 않음
+    - mode="process" 면 JSON/JS 파싱을 별도 프로세스에서 돌려 GIL 경합을 피함
+    """
+
+    def __init__(self, workers: int = EXTRACTOR_WORKERS, mode: str = EXTRACTOR_MODE, extract_fn=extract_song_blocking):
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.extract_fn = extract_fn
+        if mode == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_extractor_worker, initargs=(YDL_OPTS,)
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="ydl",
+                initializer=_init_extractor_worker, initargs=(YDL_OPTS,),
+            )
+        # guild_id -> deque[(target, future, enqueued_at)], 순서 = 라운드로빈 순서
+        self._pending: OrderedDict[int | None, deque] = OrderedDict()
+        self._running = 0
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self._waits: deque[float] = deque(maxlen=512)  # 최근 대기 시간(초)
+        self.max_wait = 0.0
+
+    async def run(self, guild_id: int | None, target: str) -> dict | None:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.setdefault(guild_id, deque()).append((target, fut, time.perf_counter()))
+        self.submitted += 1
+        self._dispatch(loop)
+        return await fut
+
+    def _dispatch(self, loop: asyncio.AbstractEventLoop):
+        while self._running < self.workers and self._pending:
+            guild_id, jobs = next(iter(self._pending.items()))
+            target, fut, enqueued_at = jobs.popleft()
+            if jobs:
+                self._pending.move_to_end(guild_id)
+            else:
+                del self._pending[guild_id]
+            if fut.cancelled():
+                continue
+
+            wait = time.perf_counter() - enqueued_at
+            self._waits.append(wait)
+            self.max_wait = max(self.max_wait, wait)
+            METRICS.observe("extract_queue_wait_seconds", wait)
+
+            self._running += 1
+            cf = loop.run_in_executor(self._executor, self.extract_fn, target)
+            started = time.perf_counter()
+            cf.add_done_callback(lambda f, fut=fut, started=started: self._on_done(loop, f, fut, started))
+
+    def _on_done(self, loop: asyncio.AbstractEventLoop, done: asyncio.Future, fut: asyncio.Future,
+                 started: float | None = None):
+        self._running -= 1
+        failed = done.cancelled() or done.exception() is not None
+        if started is not None:
+            outcome = "fail" if failed else ("empty" if done.result() is None else "ok")
+            METRICS.observe("extract_seconds", time.perf_counter() - started, outcome=outcome)
+        if failed:
+            self.failed += 1
+            if not done.cancelled():
+                METRICS.error("extract", done.exception())
+            if not fut.done():
+                fut.set_result(None)
+        else:
+            self.completed += 1
+            if not fut.done():
+                fut.set_result(done.result())
+        self._dispatch(loop)
+
+    def queue_depth(self) -> int:
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        p95 = waits[int(len(waits) * 0.95) - 1] if waits else 0.0
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "running": self._running,
+            "queue_depth": self.queue_depth(),
+            "queue_depth_by_guild": {g: len(j) for g, j in self._pending.items()},
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "wait_avg_ms": (sum(waits) / len(waits) * 1000) if waits else 0.0,
+            "wait_p95_ms": p95 * 1000,
+            "wait_max_ms": self.max_wait * 1000,
+        }
+
+    def shutdown(self):
+        for jobs in self._pending.values():
+            for _, fut, _ in jobs:
+                fut.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self.mode != "process":
+            _close_extractor_workers()
+
+
+# ---------- 디스크 Opus 캐시 ----------
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "")  # 비워 두면 비활성
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+AUDIO_CACHE_MIN_PLAYS = int(os.getenv("AUDIO_CACHE_MIN_PLAYS", "2"))  # N번 재생(프리로드 포함)되면 저장
+AUDIO_CACHE_READER = os.getenv("AUDIO_CACHE_READER", "ogg")       # "ogg"(ffmpeg 없음) | "ffmpeg"(codec=copy)
+AUDIO_CACHE_TEE_MAX_BYTES = 32 * 1024 * 1024  # 재생 중 모으는 패킷 상한 (넘으면 이 곡은 저장 포기)
+AUDIO_CACHE_DURATION_SLACK = 3.0              # 모은 길이가 곡 길이와 이만큼 넘게 다르면 끊긴 스트림으로 보고 버림
+AUDIO_CACHE_SAVE_DELAY = 30.0                 # index.json 저장 디바운스(초)
+AUDIO_CACHE_PLAY_COUNTS_MAX = 20000
+
+# Ogg CRC(다항식 0x04C11DB7, 비반사) = 비트 뒤집은 입력에 대한 zlib crc32 → C 구현 속도로 계산
+_BIT_REVERSE = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+def _ogg_crc(data: bytes) -> int:
+    crc = ~zlib.crc32(data.translate(_BIT_REVERSE), 0xFFFFFFFF) & 0xFFFFFFFF
+    return int(f"{crc:032b}"[::-1], 2)
+
+
+def _ogg_page(serial: int, seq: int, granule: int, packets: list[bytes], header_type: int = 0) -> bytes:
+    lacing = bytearray()
+    for packet in packets:
+        lacing += b"\xff" * (len(packet) // 255) + bytes([len(packet) % 255])
+    header = struct.pack("<4sBBqIIIB", b"OggS", 0, header_type, granule, serial, seq, 0, len(lacing)) + lacing
+    body = b"".join(packets)
+    crc = _ogg_crc(header + body)
+    return header[:22] + struct.pack("<I", crc) + header[26:] + body
+
+
+def opus_packet_samples(packet: bytes) -> int:
+    """Opus 패킷 TOC 로 48kHz 샘플 수 계산 (RFC 6716 3.1)"""
+    if not packet:
+        return 0
+    toc = packet[0]
+    config = toc >> 3
+    if config < 12:
+        frame = (480, 960, 1920, 2880)[config % 4]   # SILK 10/20/40/60ms
+    elif config < 16:
+        frame = (480, 960)[config % 2]               # Hybrid 10/20ms
+    else:
+        frame = (120, 240, 480, 960)[config % 4]     # CELT 2.5/5/10/20ms
+    code = toc & 3
+    count = 1 if code == 0 else 2 if code < 3 else (packet[1] & 0x3F if len(packet) > 1 else 0)
+    return frame * count
+
+
+class OggOpusWriter:
+    """Opus 패킷을 받는 대로 Ogg 페이지 바이트로 (파일 기록/ffmpeg stdin 스트리밍 공용)"""
+
+    def __init__(self, channels: int = 2):
+        self.channels = channels
+        self.serial = random.getrandbits(32)
+        self.granule = 0
+        self._seq = 2
+        self._page: list[bytes] = []
+        self._lacing = 0
+
+    def header(self) -> bytes:
+        head = b"OpusHead" + struct.pack("<BBHIhB", 1, self.channels, 0, 48000, 0, 0)
+        tags = b"OpusTags" + struct.pack("<I", 8) + b"musicbot" + struct.pack("<I", 0)
+        return _ogg_page(self.serial, 0, 0, [head], header_type=0x02) + _ogg_page(self.serial, 1, 0, [tags])
+
+    def feed(self, packets: list[bytes]) -> bytes:
+        """채워진 페이지만 돌려줌 (덜 찬 마지막 페이지는 다음 feed/finish 로 넘어감)"""
+        out = []
+        for packet in packets:
+            need = len(packet) // 255 + 1
+            if self._page and (self._lacing + need > 255 or len(self._page) >= 50):
+                out.append(_ogg_page(self.serial, self._seq, self.granule, self._page))
+                self._seq, self._page, self._lacing = self._seq + 1, [], 0
+            self._page.append(packet)
+            self._lacing += need
+            self.granule += opus_packet_samples(packet)
+        return b"".join(out)
+
+    def finish(self) -> bytes:
+        return _ogg_page(self.serial, self._seq, self.granule, self._page, header_type=0x04)
+
+
+def write_ogg_opus(path: str, packets: list[bytes], channels: int = 2) -> int:
+    """Opus 패킷들을 Ogg/Opus 파일로 기록 (executor 에서 호출). 총 샘플 수 반환"""
+    writer = OggOpusWriter(channels)
+    with open(path, "wb") as f:
+        f.write(writer.header())
+        for i in range(0, len(packets), 500):
+            f.write(writer.feed(packets[i:i + 500]))
+        f.write(writer.finish())
+    return writer.granule
+
+
+class CacheTeeSource(discord.AudioSource):
+    """
+    재생 중인 Opus 소스를 감싸 읽은 패킷을 그대로 모아 둠 → 끝까지 재생되면 on_complete(packets).
+    디스크 캐시를 채우려고 같은 곡을 한 번 더 받지 않기 위함. 중간에 정리되면(스킵/정지) on_abort()
+    """
+
+    def __init__(self, inner: discord.AudioSource, on_complete, on_abort, max_bytes: int = AUDIO_CACHE_TEE_MAX_BYTES):
+        self.inner = inner
+        self.max_bytes = max_bytes
+        self._packets: list[bytes] | None = []
+        self._bytes = 0
+        self._on_complete = on_complete  # 읽는 스레드(지터 버퍼/음성 스레드)에서 호출됨
+        self._on_abort = on_abort
+
+    def read(self) -> bytes:
+        data = self.inner.read()
+        packets = self._packets
+        if packets is not None:
+            if not data:
+                self._packets = None
+                self._on_complete(packets)
+            else:
+                packets.append(data)
+                self._bytes += len(data)
+                if self._bytes > self.max_bytes:
+                    self._drop()
+        return data
+
+    def _drop(self):
+        if self._packets is not None:
+            self._packets = None
+            self._on_abort()
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        self._drop()
+        self.inner.cleanup()
+
+
+class OggOpusFileSource(discord.AudioSource):
+    """로컬 Ogg/Opus 파일의 패킷을 그대로 내보내는 소스 (ffmpeg 프로세스 없음)"""
+
+    def __init__(self, path: str):
+        self._fp = open(path, "rb")
+        self._packets = discord.oggparse.OggStream(self._fp).iter_packets()
+
+    def read(self) -> bytes:
+        for packet in self._packets:
+            # 헤더 패킷은 음성 프레임이 아니므로 건너뜀
+            if packet.startswith((b"OpusHead", b"OpusTags")):
+                continue
+            return packet
+        return b""
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        if self._fp and not self._fp.closed:
+            self._fp.close()
+
+
+# ---------- 지터 버퍼 ----------
+FRAME_MS = 20
+JITTER_BUFFER_MS = int(os.getenv("JITTER_BUFFER_MS", "1000"))                      # 0 이면 비활성
+JITTER_BUFFER_MAX_BYTES = int(os.getenv("JITTER_BUFFER_MAX_BYTES", str(1024 * 1024)))  # 길드당 상한
+# 버퍼가 비었을 때 음성 스레드가 기다리는 최대 시간. 넘으면 무음 프레임을 내보내고 다음 주기에 다시 봄
+JITTER_UNDERRUN_WAIT_MS = int(os.getenv("JITTER_UNDERRUN_WAIT_MS", "40"))
+
+
+class GuildBufferStats:
+    """길드별 지터 버퍼 통계 + 메모리 예산 (같은 길드의 재생/프리로드 소스가 공유)"""
+
+    def __init__(self, max_bytes: int = JITTER_BUFFER_MAX_BYTES, guild_id: int | None = None):
+        self.lock = threading.Lock()
+        self.guild_id = guild_id
+        self.max_bytes = max_bytes
+        self.bytes_in_use = 0
+        self.fill_frames = 0        # 마지막으로 재생 중 소스에서 읽을 때 남아 있던 프레임 수
+        self.underruns = 0
+        self.underrun_wait = 0.0    # 언더런으로 음성 스레드가 기다린 총 시간(초)
+        self.silence_frames = 0     # 언더런 대기 시간 초과로 대신 내보낸 무음 프레임
+        self.refills = 0
+        self.refill_total = 0.0     # 원본 read() 지연 합계(초)
+        self.refill_max = 0.0
+        # 음성 스레드 프레임 간격 (ChainedSource.read() 시작 시각 기준, 정상 20ms)
+        self.frames = 0
+        self.frame_jitter = 0.0     # |간격 - 20ms| 의 지수 이동 평균(초, RFC 3550 식 1/16)
+        self.late_frames = 0        # 한 프레임 이상 늦은 간격
+        self.frame_gap_max = 0.0
+        self.voice_stalls = 0
+
+    def add_bytes(self, n: int):
+        with self.lock:
+            self.bytes_in_use += n
+
+    def over_budget(self) -> bool:
+        return self.bytes_in_use >= self.max_bytes
+
+    def note_refill(self, seconds: float):
+        with self.lock:
+            self.refills += 1
+            self.refill_total += seconds
+            self.refill_max = max(self.refill_max, seconds)
+
+    def note_frame(self, gap: float, prev_read: float):
+        """음성 스레드에서 프레임마다 호출: 직전 read() 시작부터의 간격과 그 read() 에 걸린 시간"""
+        with self.lock:
+            self.frames += 1
+            self.frame_jitter += (abs(gap - FRAME_MS / 1000) - self.frame_jitter) / 16
+            if gap >= 2 * FRAME_MS / 1000:
+                self.late_frames += 1
+            self.frame_gap_max = max(self.frame_gap_max, gap)
+            stalled = gap * 1000 >= VOICE_STALL_MS
+            if stalled:
+                self.voice_stalls += 1
+        if stalled:
+            PROFILER.voice_stall(self.guild_id, gap, prev_read)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "bytes_in_use": self.bytes_in_use,
+                "fill_ms": self.fill_frames * FRAME_MS,
+                "underruns": self.underruns,
+                "underrun_wait_ms": self.underrun_wait * 1000,
+                "silence_frames": self.silence_frames,
+                "refill_avg_ms": (self.refill_total / self.refills * 1000) if self.refills else 0.0,
+                "refill_max_ms": self.refill_max * 1000,
+                "frames": self.frames,
+                "jitter_ms": self.frame_jitter * 1000,
+                "late_frames": self.late_frames,
+                "gap_max_ms": self.frame_gap_max * 1000,
+                "voice_stalls": self.voice_stalls,
+            }
+
+
+class BufferedSource(discord.AudioSource):
+    """
+    원본 소스를 백그라운드 스레드로 미리 읽어 링 버퍼에 쌓아 두는 래퍼.
+    원격 URL 이 잠깐 멈춰도 버퍼가 남아 있는 동안은 음성 스레드(20ms 주기)가 기다리지 않음
+    """
+
+    def __init__(self, inner: discord.AudioSource, stats: GuildBufferStats, buffer_ms: int = JITTER_BUFFER_MS):
+        self.inner = inner
+        self.stats = stats
+        self.capacity = max(2, buffer_ms // FRAME_MS)
+        self._frames: deque[bytes] = deque()
+        self._bytes = 0
+        self._cond = threading.Condition()
+        self._eof = False
+        self._closed = False
+        self._started = False  # 첫 프레임 이전의 빈 버퍼는 언더런으로 세지 않음
+        self._stalled = False  # 언더런 중 (무음을 연달아 내보내도 언더런은 한 번으로 셈)
+        self._thread = threading.Thread(target=self._fill, name="jitter-buffer", daemon=True)
+        self._thread.start()
+
+    def _fill(self):
+        try:
+            while True:
+                with self._cond:
+                    # 버퍼가 찼거나 길드 예산 초과면 대기 (최소 1프레임은 항상 허용)
+                    while not self._closed and (
+                        len(self._frames) >= self.capacity or (self._frames and self.stats.over_budget())
+                    ):
+                        self._cond.wait(0.1)
+                    if self._closed:
+                        return
+                t0 = time.perf_counter()
+                data = self.inner.read()
+                self.stats.note_refill(time.perf_counter() - t0)
+                with self._cond:
+                    if not data or self._closed:
+                        self._eof = True
+                        self._cond.notify_all()
+                        return
+                    self._frames.append(data)
+                    self._bytes += len(data)
+                    self.stats.add_bytes(len(data))
+                    self._cond.notify_all()
+        except Exception:
+            with self._cond:
+                self._eof = True
+                self._cond.notify_all()
+
+    def read(self) -> bytes:
+        with self._cond:
+            if not self._frames and not self._eof and not self._closed:
+                # 원본이 멈춰도 음성 스레드를 붙잡지 않도록 잠깐만 기다림
+                t0 = time.perf_counter()
+                self._cond.wait_for(lambda: self._frames or self._eof or self._closed,
+                                    timeout=JITTER_UNDERRUN_WAIT_MS / 1000)
+                timed_out = not (self._frames or self._eof or self._closed)
+                if self._started:
+                    with self.stats.lock:
+                        if not self._stalled:
+                            self.stats.underruns += 1
+                        self.stats.underrun_wait += time.perf_counter() - t0
+                        if timed_out:
+                            self.stats.silence_frames += 1
+                    self._stalled = timed_out
+                if timed_out:
+                    # b"" 는 곡 끝으로 해석되므로 무음으로 자리를 채움
+                    return OPUS_SILENCE if self.inner.is_opus() else b"\x00" * discord.opus.Encoder.FRAME_SIZE
+            if not self._frames:
+                return b""
+            data = self._frames.popleft()
+            self._bytes -= len(data)
+            self.stats.add_bytes(-len(data))
+            self.stats.fill_frames = len(self._frames)
+            self._started = True
+            self._stalled = False
+            self._cond.notify_all()
+            return data
+
+    def is_opus(self) -> bool:
+        return self.inner.is_opus()
+
+    def cleanup(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._frames.clear()
+            self.stats.add_bytes(-self._bytes)
+            self._bytes = 0
+            self._cond.notify_all()
+        self.inner.cleanup()
+
+
+class ChainedSource(discord.AudioSource):
+    """
+    길드별 연속 소스. 현재 곡이 끝나면 read() 안에서 미리 걸어 둔 다음 곡 소스로 바로 넘어가
+    곡 사이 무음 구간(after 콜백 → play_next → vc.play 왕복)을 없앰.
+    곡 전환은 on_advance 로 알리기만 하고 대기열/UI 처리는 이벤트 루프에서 비동기로 수행
+    """
+
+    def __init__(self, first: discord.AudioSource, track: "Track", on_advance, on_end,
+                 frame_stats: GuildBufferStats | None = None):
+        self._lock = threading.Lock()
+        self._current = first
+        self.track = track
+        self._next: tuple["Track", discord.AudioSource] | None = None
+        self._skip = False
+        self._closed = False
+        self._on_advance = on_advance  # (new_track, gap_seconds) — 음성 스레드에서 호출
+        self._on_end = on_end          # (ended_at) — 이어 붙일 곡 없이 끝날 때
+        self._frame_stats = frame_stats  # 있으면 프레임 간격(음성 스레드 지터) 기록
+        self._last_read = 0.0            # 직전 read() 시작 시각 (0 = 기준 없음: 시작/일시정지 재개)
+        self._last_cost = 0.0
+
+    def set_next(self, track: "Track", source: discord.AudioSource):
+        """다음 곡 소스 장전. 기존에 장전돼 있던 (track, source) 반환"""
+        with self._lock:
+            if self._closed:
+                source.cleanup()
+                return None
+            old, self._next = self._next, (track, source)
+            return old
+
+    def take_next(self) -> tuple["Track", discord.AudioSource] | None:
+        with self._lock:
+            nxt, self._next = self._next, None
+            return nxt
+
+    def next_track(self) -> "Track | None":
+        nxt = self._next
+        return nxt[0] if nxt else None
+
+    def skip(self):
+        """현재 곡을 끝내고 장전된 곡으로 즉시 전환 (다음 read() 에서)"""
+        self._skip = True
+
+    def mark_idle(self):
+        """일시정지 재개 직전 호출: 멈춰 있던 시간을 프레임 간격으로 세지 않게"""
+        self._last_read = 0.0
+
+    def read(self) -> bytes:
+        if self._frame_stats is None:
+            return self._read()
+        t0 = time.perf_counter()
+        data = self._read()
+        if self._last_read and data:
+            self._frame_stats.note_frame(t0 - self._last_read, self._last_cost)
+        self._last_read, self._last_cost = (t0, time.perf_counter() - t0) if data else (0.0, 0.0)
+        return data
+
+    def _read(self) -> bytes:
+        if self._skip:
+            self._skip = False
+            data = b""
+        else:
+            data = self._current.read()
+        while not data:
+            ended_at = time.perf_counter()
+            nxt = self.take_next()
+            if nxt is None:
+                self._on_end(ended_at)
+                return b""
+            old = self._current
+            self.track, self._current = nxt
+            old.cleanup()
+            data = self._current.read()
+            if data:
+                self._on_advance(self.track, time.perf_counter() - ended_at)
+        return data
+
+    def is_opus(self) -> bool:
+        # discord.py 는 프레임마다 is_opus() 를 확인하므로 Opus/PCM 곡이 섞여도 됨
+        return self._current.is_opus()
+
+    def cleanup(self):
+        with self._lock:
+            self._closed = True
+            nxt, self._next = self._next, None
+        self._current.cleanup()
+        if nxt:
+            nxt[1].cleanup()
+
+
+# ---------- 라디오(한 번 디코딩 → 여러 길드로 분배) ----------
+RADIO_BUFFER_FRAMES = 250            # 공유 프레임 버퍼 (20ms × 250 = 5초)
+RADIO_LEAD_FRAMES = 25               # 생산 스레드가 가장 앞선 청취자보다 미리 채워 두는 프레임 수
+RADIO_UNDERRUN_WAIT = 0.015          # 버퍼가 비었을 때 청취자가 기다리는 최대 시간(초), 넘으면 무음
+OPUS_SILENCE = b"\xf8\xff\xfe"      # 다음 곡 준비 중에 내보낼 Opus 무음 프레임
+
+
+class RadioListener(discord.AudioSource):
+    """라디오 청취자 한 명(= VoiceClient 하나)의 커서"""
+
+    def __init__(self, station: "RadioStation", cursor: int):
+        self.station = station
+        self.cursor = cursor
+
+    def read(self) -> bytes:
+        return self.station.read_for(self)
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        self.station.detach(self)
+
+
+class RadioStation:
+    """
+    한 곡을 한 번만 디코딩/인코딩해서 공유 프레임 버퍼에 쌓고,
+    청취자마다 커서만 따로 두어 같은 Opus 프레임을 나눠 줌.
+    원본 read()/cleanup() 은 전용 생산 스레드에서만 하고(락 밖),
+    음성 스레드들은 락을 잡고 버퍼에서 프레임을 꺼내기만 함
+    """
+
+    def __init__(self, name: str, request_next):
+        self.name = name
+        self.queue = GuildQueue()       # 편성표 (한 곡 끝나면 뒤로 다시 붙여 순환)
+        self.track: "Track | None" = None
+        self.listeners: set[RadioListener] = set()
+        self._source: discord.AudioSource | None = None  # 생산 스레드 전용
+        self._next: tuple["Track", discord.AudioSource] | None = None
+        self._request_next = request_next  # (station) — 생산 스레드에서 호출됨
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._frames: deque[bytes] = deque()
+        self._base = 0                  # _frames[0] 의 시퀀스 번호
+        self._encoder = None            # PCM 폴백 소스일 때만 한 번 인코딩
+        self._starving = False
+        self._thread: threading.Thread | None = None
+        self._drop_source = False       # suspend() 요청: 읽는 중일 수 있어 생산 스레드가 정리
+
+        self.frames_produced = 0
+        self.frames_served = 0
+        self.silence_frames = 0
+
+    @property
+    def head(self) -> int:
+        return self._base + len(self._frames)
+
+    def has_next(self) -> bool:
+        return self._next is not None
+
+    def set_next(self, track: "Track", source: discord.AudioSource):
+        with self._cond:
+            old, self._next = self._next, (track, source)
+            self._starving = False
+            self._cond.notify_all()
+            return old
+
+    def _live_cursor(self) -> int:
+        """(락 보유 상태) 가장 앞선 청취자의 커서"""
+        return max(listener.cursor for listener in self.listeners)
+
+    def attach(self) -> RadioListener:
+        with self._cond:
+            # 늦게 들어온 청취자는 현재 방송 지점(가장 앞선 청취자)부터
+            listener = RadioListener(self, self._live_cursor() if self.listeners else self.head)
+            self.listeners.add(listener)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"radio-{self.name}", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return listener
+
+    def detach(self, listener: RadioListener):
+        with self._cond:
+            self.listeners.discard(listener)
+            self._cond.notify_all()
+
+    def suspend(self):
+        """청취자가 없을 때 원본 소스를 정리 (편성표는 유지)"""
+        with self._cond:
+            sources = [self._next[1]] if self._next else []
+            self._next, self.track = None, None
+            self._base += len(self._frames)
+            self._frames.clear()
+            self._starving = False
+            if self._thread is None:
+                sources.append(self._source)
+                self._source = None
+            else:
+                self._drop_source = True
+                self._cond.notify_all()
+        for src in sources:
+            if src is not None:
+                src.cleanup()
+
+    def _encode(self, pcm: bytes) -> bytes:
+        if self._encoder is None:
+            self._encoder = discord.opus.Encoder()
+        if len(pcm) < discord.opus.Encoder.FRAME_SIZE:
+            pcm = pcm.ljust(discord.opus.Encoder.FRAME_SIZE, b"\x00")
+        return self._encoder.encode(pcm, discord.opus.Encoder.SAMPLES_PER_FRAME)
+
+    def _idle(self) -> bool:
+        """(락 보유 상태) 생산 스레드가 기다려야 하면 True"""
+        if not self.listeners or self._drop_source:
+            return False
+        if self._source is None and self._next is None:
+            return self._starving  # 다음 곡 요청은 한 번만 보내고 장전될 때까지 대기
+        return self.head - self._live_cursor() >= RADIO_LEAD_FRAMES
+
+    def _run(self):
+        """생산 스레드: 가장 앞선 청취자보다 RADIO_LEAD_FRAMES 만큼 앞서도록 원본을 읽어 채움"""
+        while True:
+            request = False
+            with self._cond:
+                while self._idle():
+                    self._cond.wait(0.1)
+                stale = None
+                if self._drop_source:
+                    stale, self._source, self._drop_source = self._source, None, False
+                running = bool(self.listeners)
+                if not running:
+                    self._thread = None
+                elif self._source is None:
+                    if self._next is not None:
+                        self.track, self._source = self._next
+                        self._next = None
+                    else:
+                        self._starving = True
+                    request = True  # 그다음 곡(또는 비어 있는 자리) 준비
+                source = self._source if running else None
+            if stale is not None:
+                stale.cleanup()
+            if request:
+                self._request_next(self)
+            if not running:
+                return
+            if source is None:
+                continue
+
+            try:
+                data = source.read()
+                frame = (data if source.is_opus() else self._encode(data)) if data else None
+            except Exception:
+                frame = None
+            with self._cond:
+                if self._drop_source:
+                    continue  # 다음 바퀴에서 정리
+                if frame is None:
+                    self._source = None
+                else:
+                    if len(self._frames) >= RADIO_BUFFER_FRAMES:
+                        self._frames.popleft()
+                        self._base += 1
+                    self._frames.append(frame)
+                    self.frames_produced += 1
+                    self._cond.notify_all()
+            if frame is None:
+                source.cleanup()
+
+    def read_for(self, listener: RadioListener) -> bytes:
+        with self._cond:
+            if listener not in self.listeners:
+                return b""
+            if listener.cursor < self._base:
+                listener.cursor = self._base  # 너무 뒤처진 청취자는 버퍼 맨 앞으로
+            if listener.cursor >= self.head:
+                # 생산이 못 따라옴: 잠깐만 기다리고 안 되면 무음 (커서는 그대로)
+                self._cond.notify_all()
+                self._cond.wait_for(lambda: listener.cursor < self.head or listener not in self.listeners,
+                                    timeout=RADIO_UNDERRUN_WAIT)
+                if listener not in self.listeners:
+                    return b""
+                if listener.cursor >= self.head:
+                    self.silence_frames += 1
+                    return OPUS_SILENCE
+                if listener.cursor < self._base:
+                    listener.cursor = self._base
+            data = self._frames[listener.cursor - self._base]
+            listener.cursor += 1
+            self.frames_served += 1
+            self._cond.notify_all()  # 앞선 거리가 줄었으면 생산 스레드가 채움
+            return data
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "listeners": len(self.listeners),
+            "track": self.track.title if self.track else None,
+            "queue": len(self.queue),
+            "frames_produced": self.frames_produced,
+            "frames_served": self.frames_served,
+            "silence_frames": self.silence_frames,
+        }
+
+
+# ---------- 라우드니스 정규화 ----------
+LOUDNESS_DB_PATH = os.getenv("LOUDNESS_DB", "loudness.json")
+LOUDNESS_TARGET_LUFS = float(os.getenv("LOUDNESS_TARGET_LUFS", "-14"))
+LOUDNESS_MAX_BOOST_DB = 6.0
+LOUDNESS_MAX_CUT_DB = 12.0
+LOUDNESS_MIN_ADJUST_DB = 0.5      # 이보다 작은 차이는 무시
+# copy/디스크 경로는 이 이상 벗어날 때만 재인코딩으로 보정. 그보다 작은 차이는 일부러 보정하지 않음:
+# 곡마다 ffmpeg 인코딩(스트림당 CPU 대부분)을 아끼는 대신 ±3dB 안의 음량 차이는 감수
+LOUDNESS_COPY_TOLERANCE_DB = 3.0
+LOUDNESS_MAX_ENTRIES = 50000
+LOUDNESS_ANALYZE_CONCURRENCY = 1
+LOUDNESS_ANALYZE_TIMEOUT = 300
+LOUDNESS_SAVE_DELAY = 60.0         # loudness.json 저장 디바운스(초)
+LOUDNESS_STREAM_MAX = 4            # 재생 출력을 흘려 넣어 동시에 측정하는 곡 수 상한
+LOUDNESS_FEED_PACKETS = 50         # 측정 ffmpeg 로 한 번에 넘기는 패킷 수 (20ms × 50 = 1초)
+LOUDNESS_FEED_BACKLOG = 10         # 측정이 재생을 못 따라갈 때 쌓아 둘 묶음 수 (넘으면 이번 측정 포기)
+_EBUR128_I_RE = re.compile(r"I:\s+(-?\d+(?:\.\d+)?) LUFS")
+
+
+class LoudnessStore:
+    """곡별 EBU R128 통합 라우드니스(LUFS) 저장소. 변경분은 모아서 JSON 으로 저장"""
+
+    def __init__(self, path: str = LOUDNESS_DB_PATH):
+        self.path = path
+        self._values: OrderedDict[str, float] = OrderedDict()
+        self._dirty = False
+        self._save_task: asyncio.Task | None = None
+        self.analyzed = 0
+        self.analyze_failures = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._values.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def _key(webpage_url: str) -> str:
+        return normalize_query(webpage_url)
+
+    def get(self, webpage_url: str | None) -> float | None:
+        if not webpage_url:
+            return None
+        return self._values.get(self._key(webpage_url))
+
+    def put(self, webpage_url: str, lufs: float):
+        key = self._key(webpage_url)
+        self._values.pop(key, None)
+        self._values[key] = lufs
+        while len(self._values) > LOUDNESS_MAX_ENTRIES:
+            self._values.popitem(last=False)
+        self._mark_dirty()
+
+    def _write(self, data: dict):
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    def _snapshot(self) -> dict:
+        self._dirty = False
+        return dict(self._values)
+
+    def _mark_dirty(self):
+        """저장 예약: LOUDNESS_SAVE_DELAY 안의 변경은 한 번에 기록 (파일 쓰기는 executor)"""
+        self._dirty = True
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.get_running_loop().create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(LOUDNESS_SAVE_DELAY)
+        if self._dirty:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, self._snapshot())
+
+    def save(self):
+        """종료 시 동기 저장 (cog_unload)"""
+        if self._save_task:
+            self._save_task.cancel()
+        if self._dirty:
+            self._write(self._snapshot())
+
+    def gain_db(self, webpage_url: str | None) -> float | None:
+        """목표 라우드니스까지 필요한 고정 이득(dB). 모르거나 차이가 작으면 None"""
+        lufs = self.get(webpage_url)
+        if lufs is None:
+            return None
+        gain = max(-LOUDNESS_MAX_CUT_DB, min(LOUDNESS_MAX_BOOST_DB, LOUDNESS_TARGET_LUFS - lufs))
+        return gain if abs(gain) >= LOUDNESS_MIN_ADJUST_DB else None
+
+
+async def measure_loudness(ffmpeg_input_args: list[str], feed: asyncio.Queue | None = None) -> float | None:
+    """
+    ffmpeg ebur128 필터로 통합 라우드니스 측정 (디코딩만, 인코딩 없음).
+    feed 를 주면 입력은 "-f ogg -i pipe:0" 이고, 큐에서 꺼낸 Opus 패킷 묶음을 Ogg 로 감싸 재생 속도대로 stdin 에 흘려 넣음
+    (None 을 꺼내면 입력 끝). 곡 전체를 메모리에 모으지 않음
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *ffmpeg_input_args, "-vn", "-sn", "-dn", "-threads", "1",
+        "-af", "ebur128=framelog=quiet", "-f", "null", "-",
+        stdin=asyncio.subprocess.PIPE if feed is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        tail = None
+        if feed is not None:
+            writer = OggOpusWriter()
+            proc.stdin.write(writer.header())
+            while (batch := await feed.get()) is not None:
+                proc.stdin.write(writer.feed(batch))
+                await proc.stdin.drain()
+            tail = writer.finish()
+        _, err = await asyncio.wait_for(proc.communicate(tail), timeout=LOUDNESS_ANALYZE_TIMEOUT)
+    except (asyncio.TimeoutError, asyncio.CancelledError, OSError):
+        if proc.returncode is None:
+            proc.kill()
+        raise
+    if proc.returncode != 0:
+        return None
+    found = _EBUR128_I_RE.findall(err.decode("utf-8", "replace"))
+    return float(found[-1]) if found else None
+
+
+class LoudnessTeeSource(discord.AudioSource):
+    """
+    재생 중인 Opus 소스를 감싸 읽은 패킷을 LOUDNESS_FEED_PACKETS 개씩 on_batch(packets) 로 넘김 → 측정 ffmpeg 에 바로 흘려 넣음.
+    끝까지 재생되면 on_complete(), 중간에 정리되면(스킵/정지) on_abort(). 콜백은 읽는 스레드에서 호출됨
+    """
+
+    def __init__(self, inner: discord.AudioSource, on_batch, on_complete, on_abort):
+        self.inner = inner
+        self._batch: list[bytes] | None = []
+        self._on_batch = on_batch
+        self._on_complete = on_complete
+        self._on_abort = on_abort
+
+    def read(self) -> bytes:
+        data = self.inner.read()
+        batch = self._batch
+        if batch is not None:
+            if not data:
+                self._batch = None
+                if batch:
+                    self._on_batch(batch)
+                self._on_complete()
+            else:
+                batch.append(data)
+                if len(batch) >= LOUDNESS_FEED_PACKETS:
+                    self._batch = []
+                    self._on_batch(batch)
+        return data
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        if self._batch is not None:
+            self._batch = None
+            self._on_abort()
+        self.inner.cleanup()
+
+
+class GainPCMSource(discord.AudioSource):
+    """PCMVolumeTransformer 와 같은 역할을 NumPy 벡터 연산으로 (16bit 스테레오 PCM, numpy 없으면 PCMVolumeTransformer)"""
+
+    def __init__(self, inner: discord.AudioSource, gain_db: float):
+        self.inner = inner
+        self.factor = 10 ** (gain_db / 20)
+
+    def read(self) -> bytes:
+        data = self.inner.read()
+        if not data:
+            return data
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        samples *= self.factor
+        np.clip(samples, -32768, 32767, out=samples)
+        return samples.astype(np.int16).tobytes()
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self):
+        self.inner.cleanup()
+
+
+class AudioCache:
+    """
+    자주 재생되는 곡을 Ogg/Opus 파일로 보관하는 디스크 캐시.
+    - 키: 정규화된 webpage_url (파일명은 sha1)
+    - 용량(바이트) 한도 안에서 LRU 퇴출, index.json 으로 재시작 후에도 유지
+    - 채우기는 재생 중인 스트림을 CacheTeeSource 로 받아 두었다가 저장 (다시 받지 않음)
+    - 이벤트 루프에서는 메모리 색인만 만지고, 파일 기록/삭제/index 저장은 executor 로
+    """
+
+    def __init__(self, root: str = AUDIO_CACHE_DIR, max_bytes: int = AUDIO_CACHE_MAX_BYTES, min_plays: int = AUDIO_CACHE_MIN_PLAYS):
+        self.root = root
+        self.enabled = bool(root)
+        self.max_bytes = max_bytes
+        self.min_plays = max(1, min_plays)
+        self._entries: OrderedDict[str, dict] = OrderedDict()  # key -> {"file", "size", "last_used"} (LRU 순)
+        self._plays: OrderedDict[str, int] = OrderedDict()
+        self._filling: set[str] = set()
+        self._dirty = False
+        self._save_task: asyncio.Task | None = None
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.fill_failures = 0
+        self.fill_aborts = 0  # 끝까지 재생되지 않아(스킵/정지) 저장하지 않은 곡
+
+        if self.enabled:
+            os.makedirs(self.root, exist_ok=True)
+            self._load_index()
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.root, "index.json")
+
+    def _load_index(self):
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        entries = sorted((data.get("entries") or {}).items(), key=lambda kv: kv[1].get("last_used", 0))
+        for key, entry in entries:
+            path = os.path.join(self.root, entry.get("file", ""))
+            if not os.path.isfile(path):
+                continue
+            entry["size"] = os.path.getsize(path)
+            self._entries[key] = entry
+            self.total_bytes += entry["size"]
+        for key, n in (data.get("plays") or {}).items():
+            self._plays[key] = int(n)
+
+    def _snapshot(self) -> dict:
+        self._dirty = False
+        return {"entries": {k: dict(v) for k, v in self._entries.items()}, "plays": dict(self._plays)}
+
+    def _write_index(self, data: dict):
+        tmp = self._index_path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self._index_path)
+        except OSError:
+            pass
+
+    def _mark_dirty(self):
+        """index 저장 예약: AUDIO_CACHE_SAVE_DELAY 안의 변경은 한 번에 기록"""
+        self._dirty = True
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.get_running_loop().create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(AUDIO_CACHE_SAVE_DELAY)
+        if self._dirty:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_index, self._snapshot())
+
+    def save(self):
+        """종료 시 동기 저장 (cog_unload)"""
+        if self._save_task:
+            self._save_task.cancel()
+        if self.enabled and self._dirty:
+            self._write_index(self._snapshot())
+
+    def _remove_files(self, names: list[str]):
+        def _remove():
+            for name in names:
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except OSError:
+                    pass
+        try:
+            asyncio.get_running_loop().run_in_executor(None, _remove)
+        except RuntimeError:
+            _remove()
+
+    @staticmethod
+    def _key(webpage_url: str) -> str:
+        return normalize_query(webpage_url)
+
+    def lookup(self, webpage_url: str | None) -> str | None:
+        """메모리 색인만 확인 (파일이 사라졌으면 여는 쪽에서 실패 → discard)"""
+        if not self.enabled or not webpage_url:
+            return None
+        key = self._key(webpage_url)
+        entry = self._entries.get(key)
+        if not entry:
+            self.misses += 1
+            return None
+        entry["last_used"] = time.time()
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return os.path.join(self.root, entry["file"])
+
+    def peek(self, webpage_url: str | None) -> str | None:
+        """적중/미스 통계와 LRU 순서를 건드리지 않고 경로만 확인"""
+        if not self.enabled or not webpage_url:
+            return None
+        entry = self._entries.get(self._key(webpage_url))
+        return os.path.join(self.root, entry["file"]) if entry else None
+
+    def note_play(self, webpage_url: str | None) -> bool:
+        """재생/프리로드 1회 기록. 이번에 캐시에 채워 넣어야 하면 True"""
+        if not self.enabled or not webpage_url:
+            return False
+        key = self._key(webpage_url)
+        n = self._plays.pop(key, 0) + 1
+        self._plays[key] = n
+        self._dirty = True  # 다음 저장 때 같이 기록
+        while len(self._plays) > AUDIO_CACHE_PLAY_COUNTS_MAX:
+            self._plays.popitem(last=False)
+        return n >= self.min_plays and key not in self._entries and key not in self._filling
+
+    def discard(self, webpage_url: str):
+        key = self._key(webpage_url)
+        if entry := self._entries.pop(key, None):
+            self.total_bytes -= entry["size"]
+            self._remove_files([entry["file"]])
+            self._mark_dirty()
+
+    def begin_fill(self, webpage_url: str) -> bool:
+        key = self._key(webpage_url)
+        if key in self._filling or key in self._entries:
+            return False
+        self._filling.add(key)
+        return True
+
+    def abort_fill(self, webpage_url: str):
+        self._filling.discard(self._key(webpage_url))
+        self.fill_aborts += 1
+
+    def _write_file(self, fname: str, packets: list[bytes], duration: float | None) -> int:
+        """executor 에서: 패킷을 임시 파일로 쓰고 길이를 검증한 뒤 교체. 파일 크기 반환"""
+        tmp = os.path.join(self.root, fname + ".part")
+        try:
+            samples = write_ogg_opus(tmp, packets)
+            if duration and abs(samples / 48000 - duration) > AUDIO_CACHE_DURATION_SLACK:
+                raise ValueError(f"incomplete stream: {samples / 48000:.1f}s of {duration}s")
+            os.replace(tmp, os.path.join(self.root, fname))
+            return os.path.getsize(os.path.join(self.root, fname))
+        finally:
+            if os.path.exists(tmp):
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+    async def store(self, webpage_url: str, packets: list[bytes], duration: float | None):
+        """재생하며 모은 Opus 패킷을 Ogg/Opus 파일로 저장 (begin_fill 한 곡만)"""
+        key = self._key(webpage_url)
+        fname = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".opus"
+        try:
+            size = await asyncio.get_running_loop().run_in_executor(None, self._write_file, fname, packets, duration)
+            self._commit(key, fname, size)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.fill_failures += 1
+        finally:
+            self._filling.discard(key)
+
+    def _commit(self, key: str, fname: str, size: int):
+        if old := self._entries.pop(key, None):
+            self.total_bytes -= old["size"]
+        self._entries[key] = {"file": fname, "size": size, "last_used": time.time()}
+        self.total_bytes += size
+        self.stores += 1
+        # LRU 퇴출 (방금 넣은 항목은 가장 뒤에 있으므로 마지막까지 남음)
+        evicted = []
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            old_key, entry = self._entries.popitem(last=False)
+            self.total_bytes -= entry["size"]
+            self.evictions += 1
+            evicted.append(entry["file"])
+        if evicted:
+            self._remove_files(evicted)
+        self._mark_dirty()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "fill_failures": self.fill_failures,
+            "fill_aborts": self.fill_aborts,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+
+# ---------- 프로브 캐시 ----------
+PROBE_CACHE_MAX_ENTRIES = 2048
+PROBE_TIMEOUT = 15
+
+
+async def probe_audio(url: str, headers: str | None = None) -> tuple[str | None, int | None]:
+    """
+    ffprobe 로 첫 오디오 스트림의 (codec, kbps). 재생 ffmpeg 와 같은 헤더/UA 로 요청해야
+    googlevideo 가 403 을 주지 않음 (discord.py 의 probe 는 헤더를 넘길 수 없음)
+    """
+    args = [FFPROBE_PATH, "-v", "error", "-print_format", "json", "-show_streams", "-select_streams", "a:0",
+            "-user_agent", UA]
+    if headers:
+        args += ["-headers", headers]
+    args.append(url)
+    proc = await asyncio.create_subprocess_exec(
+        *args, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        out, _ = await asyncio.wait_for(proc.communicate(), PROBE_TIMEOUT)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        proc.kill()
+        raise
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffprobe exited with {proc.returncode}")
+    streams = json.loads(out or b"{}").get("streams") or []
+    if not streams:
+        return None, None
+    bitrate = str(streams[0].get("bit_rate") or "")
+    return streams[0].get("codec_name"), (int(bitrate) // 1000 if bitrate.isdigit() else None)
+
+
+class ProbeCache:
+    """
+    곡별 (codec, bitrate) 프로브 결과 캐시. 키 = (정규화 webpage_url, format_id)
+    추출 메타데이터(acodec/abr)가 있으면 ffprobe 없이 채우고, 없을 때만 한 번 프로브
+    """
+
+    def __init__(self, max_entries: int = PROBE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, str], tuple[str | None, int | None]] = OrderedDict()
+        self.hits = 0
+        self.from_metadata = 0
+        self.probes = 0  # 실제로 ffprobe/ffmpeg 프로브를 띄운 횟수
+        self.probe_failures = 0
+
+    @staticmethod
+    def _key(song: Track) -> tuple[str, str]:
+        page = song.webpage_url or song.url or ""
+        return normalize_query(page), str(song.format_id or "")
+
+    def get(self, song: Track) -> tuple[str | None, int | None] | None:
+        key = self._key(song)
+        if (found := self._entries.get(key)) is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return found
+
+    def put(self, song: Track, codec: str | None, bitrate: int | None):
+        key = self._key(song)
+        self._entries[key] = (codec, bitrate)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def resolve(self, song: Track, headers: str | None = None) -> tuple[str | None, int | None]:
+        """캐시 → 메타데이터 → 프로브 순으로 (codec, bitrate) 확보. headers = ffmpeg -headers 용 원시 헤더"""
+        if (found := self.get(song)) is not None:
+            song.probe_source = "cache"
+            METRICS.inc("probe_total", source="cache")
+            return found
+        if acodec := song.acodec:
+            codec = "opus" if is_opus_passthrough(song) else acodec
+            abr = song.abr
+            self.from_metadata += 1
+            self.put(song, codec, int(abr) if abr else None)
+            song.probe_source = "metadata"
+            METRICS.inc("probe_total", source="metadata")
+            return codec, int(abr) if abr else None
+        self.probes += 1
+        started = time.perf_counter()
+        song.probe_source = "ffprobe"
+        try:
+            codec, bitrate = await probe_audio(song.url, headers)
+        except Exception as e:
+            # 실패(403/시간 초과 등)는 캐시하지 않음 → 다음 재생/프리로드 때 다시 시도
+            self.probe_failures += 1
+            METRICS.error("probe", e)
+            return None, None
+        finally:
+            METRICS.observe("probe_seconds", time.perf_counter() - started)
+            METRICS.inc("probe_total", source="ffprobe")
+        self.put(song, codec, bitrate)
+        return codec, bitrate
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "from_metadata": self.from_metadata,
+            "probes": self.probes,
+            "probe_failures": self.probe_failures,
+        }
+
+
+class TimedSource(discord.AudioSource):
+    """첫 프레임이 읽히는 순간을 알려 주는 얇은 래퍼 (time-to-first-audio 측정)"""
+
+    def __init__(self, inner: discord.AudioSource, on_first_frame):
+        self.inner = inner
+        self._on_first_frame = on_first_frame
+
+    def read(self) -> bytes:
+        data = self.inner.read()
+        if self._on_first_frame is not None and data:
+            cb, self._on_first_frame = self._on_first_frame, None
+            cb()
+        return data
+
+    def is_opus(self) -> bool:
+        return self.inner.is_opus()
+
+    def cleanup(self):
+        self.inner.cleanup()
+
+
+class PrimedSource(discord.AudioSource):
+    """소스 검증 때 미리 읽은 첫 프레임을 먼저 돌려주는 래퍼"""
+
+    def __init__(self, inner: discord.AudioSource, first: bytes):
+        self.inner = inner
+        self._first: bytes | None = first
+
+    def read(self) -> bytes:
+        if self._first is not None:
+            data, self._first = self._first, None
+            return data
+        return self.inner.read()
+
+    def is_opus(self) -> bool:
+        return self.inner.is_opus()
+
+    def cleanup(self):
+        self.inner.cleanup()
+
+
+def spawn_validated_source(factory) -> PrimedSource:
+    """
+    executor 에서: ffmpeg 소스를 만들고 첫 프레임까지 읽어 봄.
+    생성자는 프로세스만 띄우고 거의 실패하지 않으므로, 잘못된 필터/입력으로 ffmpeg 가 바로 죽는 경우는
+    첫 read() 가 비는 것으로만 알 수 있음 → 예외로 올려 다음 단계로 넘어가게 함
+    """
+    src = factory()
+    try:
+        first = src.read()
+    except Exception:
+        src.cleanup()
+        raise
+    if not first:
+        src.cleanup()
+        raise RuntimeError("ffmpeg produced no audio")
+    return PrimedSource(src, first)
+
+
+# ---------- 프리로드 스케줄러 ----------
+PRELOAD_LOOKAHEAD = int(os.getenv("PRELOAD_LOOKAHEAD", "3"))            # 길드별로 미리 준비할 곡 수(URL+프로브)
+PRELOAD_LIVE_DEPTH = int(os.getenv("PRELOAD_LIVE_DEPTH", "1"))          # 그중 ffmpeg 소스까지 띄워 둘 곡 수
+PRELOAD_MAX_CONCURRENT = int(os.getenv("PRELOAD_MAX_CONCURRENT", "4"))  # 프로세스 전체 동시 프리로드 작업 수
+PRELOAD_MAX_LIVE_SOURCES = int(os.getenv("PRELOAD_MAX_LIVE_SOURCES", "32"))  # 프로세스 전체 대기 중 ffmpeg 수
+
+
+class PreloadScheduler:
+    """
+    프로세스 전역 프리로드 예산. 우선순위가 낮은 값(= 곧 재생될 곡)부터 슬롯을 배정하는 세마포어
+    """
+
+    def __init__(self, max_concurrent: int = PRELOAD_MAX_CONCURRENT):
+        self.max_concurrent = max(1, max_concurrent)
+        self._active = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.granted = 0
+
+    async def acquire(self, priority: int):
+        if self._active < self.max_concurrent and not self._waiters:
+            self._active += 1
+            self.granted += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # 슬롯을 받은 직후 취소됐다면 반납
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        self._active -= 1
+        while self._waiters and self._active < self.max_concurrent:
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.cancelled():
+                continue
+            self._active += 1
+            self.granted += 1
+            fut.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "waiting": sum(1 for *_, f in self._waiters if not f.cancelled()),
+            "granted": self.granted,
+            "max_concurrent": self.max_concurrent,
+        }
+
+
+# ---------- 타이머 스케줄러 ----------
+INACTIVITY_TIMEOUT = 600          # 유휴 자동 퇴장(초)
+TIMER_COMPACT_MIN = 1024          # 힙의 무효 항목이 이만큼 넘게 쌓이면 재구성
+TIMER_CLOCK_EPSILON = 0.001       # 루프가 clock_resolution 을 알려 주지 않을 때 쓰는 마감 허용 오차(초)
+
+
+class TimerScheduler:
+    """
+    길드별 유휴 퇴장/UI 디바운스/지연 프리로드를 태스크 하나씩 재우지 않고 한 곳에서 관리.
+    (kind, guild_id) 키마다 타이머 하나. 예약/재예약은 힙 push(O(log n)), 취소는 O(1)(지연 삭제).
+    이벤트 루프에는 가장 이른 마감 하나에 대한 call_at 핸들만 걸어 둠. 만료된 콜백만 태스크가 됨
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, tuple]] = []
+        self._live: dict[tuple, tuple[int, object]] = {}  # key -> (seq, callback)
+        self._running: dict[tuple, asyncio.Task] = {}
+        self._seq = itertools.count()
+        self._handle: asyncio.TimerHandle | None = None
+        self._handle_when = float("inf")
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.scheduled = 0
+        self.rescheduled = 0
+        self.cancelled = 0
+        self.fired = 0
+
+    def schedule(self, key: tuple, delay: float, callback):
+        """
+        delay 초 뒤 callback() 실행 (코루틴을 돌려주면 태스크로 실행).
+        같은 키의 대기 중 타이머와 아직 실행 중인 이전 콜백은 대체/취소
+        """
+        loop = self._loop = self._loop or asyncio.get_running_loop()
+        if key in self._live:
+            self.rescheduled += 1
+        else:
+            self.scheduled += 1
+        self._cancel_running(key)
+        seq = next(self._seq)
+        when = loop.time() + delay
+        self._live[key] = (seq, callback)
+        heapq.heappush(self._heap, (when, seq, key))
+        if when < self._handle_when:
+            self._arm(when)
+        if len(self._heap) > TIMER_COMPACT_MIN and len(self._heap) > 2 * len(self._live):
+            self._compact()
+
+    def cancel(self, key: tuple) -> bool:
+        found = self._live.pop(key, None) is not None
+        found = self._cancel_running(key) or found
+        if found:
+            self.cancelled += 1
+        return found
+
+    def pending(self, kind: str | None = None) -> int:
+        if kind is None:
+            return len(self._live)
+        return sum(1 for k in self._live if k[0] == kind)
+
+    def _cancel_running(self, key: tuple) -> bool:
+        task = self._running.pop(key, None)
+        if task and not task.done() and task is not asyncio.current_task():
+            task.cancel()
+            return True
+        return False
+
+    def _arm(self, when: float):
+        if self._handle:
+            self._handle.cancel()
+        self._handle = self._loop.call_at(when, self._fire_due)
+        self._handle_when = when
+
+    def _compact(self):
+        self._heap = [e for e in self._heap if self._live.get(e[2], (None,))[0] == e[1]]
+        heapq.heapify(self._heap)
+
+    def _fire_due(self):
+        self._handle = None
+        self._handle_when = float("inf")
+        # 이벤트 루프는 clock_resolution 만큼 이르게 깨우기도 함 → 같은 기준으로 마감을 봐야 재설정 헛돌기가 없음
+        deadline = self._loop.time() + getattr(self._loop, "_clock_resolution", TIMER_CLOCK_EPSILON)
+        while self._heap and self._heap[0][0] <= deadline:
+            _, seq, key = heapq.heappop(self._heap)
+            entry = self._live.get(key)
+            if not entry or entry[0] != seq:
+                continue  # 재예약/취소된 항목
+            del self._live[key]
+            self.fired += 1
+            try:
+                result = entry[1]()
+            except Exception:
+                continue
+            if asyncio.iscoroutine(result):
+                task = self._loop.create_task(result)
+                self._running[key] = task
+                task.add_done_callback(lambda t, k=key: self._running.get(k) is t and self._running.pop(k))
+        # 맨 앞의 무효 항목은 걷어내고 다음 마감에 핸들 재설정
+        while self._heap and self._live.get(self._heap[0][2], (None,))[0] != self._heap[0][1]:
+            heapq.heappop(self._heap)
+        if self._heap:
+            self._arm(self._heap[0][0])
+
+    def shutdown(self):
+        if self._handle:
+            self._handle.cancel()
+        self._handle = None
+        self._handle_when = float("inf")
+        for task in self._running.values():
+            task.cancel()
+        self._running.clear()
+        self._live.clear()
+        self._heap.clear()
+
+    def stats(self) -> dict:
+        kinds: dict[str, int] = {}
+        for k in self._live:
+            kinds[k[0]] = kinds.get(k[0], 0) + 1
+        return {
+            "pending": kinds,
+            "running": len(self._running),
+            "heap": len(self._heap),
+            "scheduled": self.scheduled,
+            "rescheduled": self.rescheduled,
+            "cancelled": self.cancelled,
+            "fired": self.fired,
+        }
+
+
+# ---------- 플레이어 UI 렌더러 ----------
+UI_CHANNEL_BURST = 5              # 채널당 메시지 작업 한도: 5회 / 5초
+UI_CHANNEL_REFILL_PER_SEC = 1.0
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "stamp")
+
+    def __init__(self, capacity: float = UI_CHANNEL_BURST, rate: float = UI_CHANNEL_REFILL_PER_SEC):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+
+    def wait_time(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def penalize(self, retry_after: float):
+        """429 를 받으면 retry_after 동안 토큰이 없도록"""
+        self.tokens = min(self.tokens, 0) - retry_after * self.rate
+
+
+class PlayerUIRenderer:
+    """
+    채널별 렌더 큐. 길드마다 대기 중인 작업은 최신 것 하나만 남기고(coalesce),
+    채널별 토큰 버킷 한도 안에서만 write(guild_id, op, channel) 를 호출.
+    write 는 실제 보낸 API 호출 종류("edit"/"send"/"delete") 또는 None(생략)을 돌려줌
+    """
+
+    def __init__(self, write):
+        self._write = write
+        self._pending: dict[int, OrderedDict[int, tuple[str, object]]] = {}  # channel_id -> {guild_id: (op, channel)}
+        self._buckets: dict[int, TokenBucket] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+        self.submitted = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.rate_limited = 0
+        self.writes: dict[str, int] = {}
+
+    def submit(self, channel_id: int, guild_id: int, op: str, channel):
+        self.submitted += 1
+        pending = self._pending.setdefault(channel_id, OrderedDict())
+        if guild_id in pending:
+            self.coalesced += 1
+        pending[guild_id] = (op, channel)
+        if channel_id not in self._workers:
+            self._workers[channel_id] = asyncio.create_task(self._drain(channel_id))
+
+    async def _drain(self, channel_id: int):
+        bucket = self._buckets.setdefault(channel_id, TokenBucket())
+        try:
+            while pending := self._pending.get(channel_id):
+                if (wait := bucket.wait_time()) > 0:
+                    await asyncio.sleep(wait)  # 기다리는 동안 들어온 갱신은 위에서 합쳐짐
+                    continue
+                guild_id, (op, channel) = pending.popitem(last=False)
+                bucket.take()
+                try:
+                    kind = await self._write(guild_id, op, channel)
+                except discord.HTTPException as e:
+                    if e.status != 429:
+                        continue
+                    self.rate_limited += 1
+                    bucket.penalize(float(getattr(e, "retry_after", 1.0) or 1.0))
+                    pending.setdefault(guild_id, (op, channel))  # 더 새 작업이 없으면 재시도
+                    continue
+                except Exception:
+                    continue
+                if kind is None:
+                    self.skipped += 1
+                else:
+                    self.writes[kind] = self.writes.get(kind, 0) + 1
+        finally:
+            self._workers.pop(channel_id, None)
+            if not self._pending.get(channel_id):
+                self._pending.pop(channel_id, None)
+            if bucket.wait_time() == 0 and bucket.tokens >= bucket.capacity:
+                self._buckets.pop(channel_id, None)
+
+    def shutdown(self):
+        for task in self._workers.values():
+            task.cancel()
+        self._workers.clear()
+        self._pending.clear()
+
+    def stats(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "written": sum(self.writes.values()),
+            "writes": dict(self.writes),
+            "coalesced": self.coalesced,
+            "skipped_unchanged": self.skipped,
+            "rate_limited": self.rate_limited,
+            "pending": sum(len(p) for p in self._pending.values()),
+            "channels_busy": len(self._workers),
+        }
+
+
+# ---------- 재생 상태 저장/복구 ----------
+STATE_DB_PATH = os.getenv("STATE_DB", "music_state.sqlite3")
+STATE_FLUSH_INTERVAL = 2.0        # 변경분을 모아 쓰는 주기(초)
+STATE_POSITION_INTERVAL = 15.0    # 재생 중인 길드의 재생 위치 기록 주기(초)
+RESUME_STAGGER = 1.5              # 길드별 복구(음성 재접속) 간격(초)
+RESUME_MAX_AGE = 6 * 3600         # 이보다 오래된 상태는 복구하지 않음
+_PERSISTED_TRACK_FIELDS = ("webpage_url", "title", "thumbnail", "duration")
+
+
+def _track_record(track: Track) -> dict:
+    """저장용 최소 필드 (스트림 URL 은 만료되므로 저장하지 않고 재생 직전에 재해석)"""
+    return {name: getattr(track, name) for name in _PERSISTED_TRACK_FIELDS}
+
+
+class StateStore:
+    """
+    길드별 대기열/현재 곡을 SQLite 에 저장. 연결은 전용 스레드 하나에서만 쓰고,
+    이벤트 루프는 executor 에 묶음(write-behind)만 넘김
+    """
+
+    def __init__(self, path: str = STATE_DB_PATH):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-db")
+        self._conn = None
+        self.writes = 0
+        self.rows_written = 0
+        self.positions_written = 0
+        self.rows_deleted = 0
+        self.failures = 0
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS guild_state ("
+                " guild_id INTEGER PRIMARY KEY, voice_channel_id INTEGER, text_channel_id INTEGER,"
+                " current TEXT, position REAL, playing INTEGER, queue TEXT, updated_at REAL)"
+            )
+        return self._conn
+
+    def _load_blocking(self) -> list[dict]:
+        cur = self._db().execute(
+            "SELECT guild_id, voice_channel_id, text_channel_id, current, position, playing, queue, updated_at"
+            " FROM guild_state"
+        )
+        rows = []
+        for gid, vch, tch, current, position, playing, queue, updated_at in cur:
+            try:
+                rows.append({
+                    "guild_id": gid, "voice_channel_id": vch, "text_channel_id": tch,
+                    "current": json.loads(current) if current else None, "position": position or 0.0,
+                    "playing": bool(playing), "queue": json.loads(queue or "[]"), "updated_at": updated_at or 0.0,
+                })
+            except ValueError:
+                continue
+        return rows
+
+    def _write_blocking(self, rows: list[tuple], positions: list[tuple], deletes: list[int]):
+        db = self._db()
+        with db:
+            if rows:
+                db.executemany(
+                    "INSERT OR REPLACE INTO guild_state"
+                    " (guild_id, voice_channel_id, text_channel_id, current, position, playing, queue, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows,
+                )
+            if positions:
+                # 재생 위치만 바뀐 길드: 대기열 JSON 은 다시 쓰지 않음
+                db.executemany("UPDATE guild_state SET position = ?, updated_at = ? WHERE guild_id = ?", positions)
+            if deletes:
+                db.executemany("DELETE FROM guild_state WHERE guild_id = ?", [(g,) for g in deletes])
+        self.writes += 1
+        self.rows_written += len(rows)
+        self.positions_written += len(positions)
+        self.rows_deleted += len(deletes)
+
+    async def load_all(self) -> list[dict]:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._load_blocking)
+
+    async def write(self, rows: list[tuple], positions: list[tuple], deletes: list[int]):
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._write_blocking, rows, positions, deletes
+            )
+        except sqlite3.Error:
+            self.failures += 1
+
+    def close(self, rows: list[tuple] | None = None, positions: list[tuple] | None = None,
+              deletes: list[int] | None = None):
+        """마지막 변경분을 동기로 기록하고 연결 종료 (cog_unload 용)"""
+        def _final():
+            if rows or positions or deletes:
+                self._write_blocking(rows or [], positions or [], deletes or [])
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        try:
+            self._executor.submit(_final).result(timeout=10)
+        except Exception:
+            self.failures += 1
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        return {"writes": self.writes, "rows_written": self.rows_written, "positions_written": self.positions_written,
+                "rows_deleted": self.rows_deleted, "failures": self.failures}
+
+
+class ResumeContext:
+    """재시작 후 복구 재생용: play_music/play_next 가 쓰는 Interaction 속성만 흉내 (응답은 채널 메시지로)"""
+
+    def __init__(self, guild: discord.Guild, channel):
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = channel
+        self.user = None
+        self.followup = self
+
+    async def send(self, content: str | None = None, *, ephemeral: bool = False, **kwargs):
+        # 나만 보기 메시지(오류 안내 등)는 받을 사용자가 없으므로 채널에 공개로 올리지 않음
+        if self.channel is None or ephemeral:
+            return None
+        try:
+            return await self.channel.send(content, **kwargs)
+        except discord.HTTPException:
+            return None
+
+
+# ---------- 스트림 URL 선제 갱신 ----------
+STREAM_REFRESH_INTERVAL = 30        # 대기열 스캔 주기(초)
+STREAM_REFRESH_LEAD = 300           # 재생 예상 시각보다 이만큼 먼저 만료되면 갱신
+STREAM_REFRESH_HORIZON = 1800       # 재생 예상 시각이 이 안에 든 곡만 갱신 (서명 URL 수명 ~6시간보다 짧게)
+STREAM_REFRESH_BATCH = 8            # 스캔 한 번에 갱신할 최대 곡 수 (재생 예상 시각이 이른 곡부터)
+STREAM_REFRESH_CONCURRENCY = 2
+STREAM_DURATION_FALLBACK = 240      # 길이를 모르는 곡의 추정 길이(초)
+
+
+# ---------- 일괄 재생 ----------
+BATCH_PLAY_MAX = 25
+BATCH_PLAY_CONCURRENCY = 4
+BATCH_PLAY_PROGRESS_INTERVAL = 1.0
+_BATCH_SPLIT_RE = re.compile(r"[;\n]")
+
+
+class MusicBot(commands.Cog):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+        # 길드별 상태
+        self.voice_clients: dict[int, discord.VoiceClient] = {}
+        self.queues: dict[int, GuildQueue] = {}
+        self.is_playing: dict[int, bool] = {}
+        self.current_songs: dict[int, Track | None] = {}
+
+        # UI/활동/유휴/프리로드 관리
+        self.last_message: dict[int, discord.Message] = {}
+        self.ui_rendered: dict[int, str] = {}  # guild_id -> 마지막으로 그린 곡 키
+        self.ui_renderer = PlayerUIRenderer(self._write_player_ui)
+        self.player_view: PlayerView | None = None
+        self.last_activity: dict[int, datetime.datetime] = {}
+        # 유휴 퇴장/UI 디바운스/지연 프리로드 타이머: ("idle"|"ui"|"preload", guild_id)
+        self.timers = TimerScheduler()
+
+        # 프리로드: 다음 K곡은 URL/프로브를 준비하고, 앞쪽 곡은 오디오 소스까지 미리 만들어 둠
+        self.preloaded_sources: dict[int, dict[str, discord.AudioSource]] = {}  # guild_id -> {keystr: source}
+        self.preload_scheduler = PreloadScheduler()
+        self.preload_hits = 0
+        self.preload_misses = 0
+
+        # 검색 결과 캐시 (같은 곡 재요청 시 yt-dlp 추출 생략)
+        self.search_cache = SearchCache()
+
+        # yt-dlp 검색 (블로킹) → 길드별로 공정하게 워커 풀에 맡김
+        self.extractor_pool = ExtractorPool()
+
+        # /play 자동완성: 플랫 검색은 추출 풀과 따로 돌려 재생 요청을 막지 않음
+        self.suggestions = SuggestionCache()
+        self.suggest_executor = ThreadPoolExecutor(max_workers=SUGGEST_WORKERS, thread_name_prefix="ydl-suggest")
+        self.suggest_inflight: dict[str, list] = {}           # 정규화된 입력 -> [concurrent future, 대기자 수]
+        self.suggest_waiters: dict[int, asyncio.Future] = {}  # user_id -> 디바운스 중인 응답
+
+        # 자주 듣는 곡은 디스크에 Opus 로 보관 → 네트워크/인코딩 생략
+        self.audio_cache = AudioCache()
+        self.audio_cache_tasks: set[asyncio.Task] = set()
+
+        # 소스 생성 경로 통계 (copy 경로 비율 = 재인코딩 절감)
+        self.source_path_counts: dict[str, int] = {}
+        # 최근 재생한 곡별 (경로, 프로브 출처, time-to-first-audio) → /stats. 분포는 METRICS "ttff_seconds"
+        self.source_reports: deque[dict] = deque(maxlen=20)
+
+        # 프로브 결과 캐시: 곡 하나당 프로브는 평생 최대 1회 (프리로드/재생 공유)
+        self.probe_cache = ProbeCache()
+
+        # 무간격 전환: 길드별 연속 소스. 곡 사이 간격은 METRICS "track_gap_seconds"{mode=chained|cold}
+        self.chains: dict[int, ChainedSource] = {}
+        self.last_track_end: dict[int, float] = {}
+
+        # 라디오: 이름 -> 방송국, 길드 -> (방송국 이름, 청취자)
+        self.stations: dict[str, RadioStation] = {}
+        self.radio_guilds: dict[int, tuple[str, RadioListener]] = {}
+        self.station_tasks: dict[str, asyncio.Task] = {}
+
+        # 곡별 라우드니스 (한 번 측정해서 저장, 재생 시 고정 이득만 적용)
+        self.loudness = LoudnessStore()
+        self.loudness_sem = asyncio.Semaphore(LOUDNESS_ANALYZE_CONCURRENCY)
+        self.loudness_inflight: set[str] = set()
+        self.loudness_tasks: set[asyncio.Task] = set()
+        self.loudness_streams: set[asyncio.Task] = set()  # 재생 출력을 흘려 넣는 측정
+
+        # 길드별 지터 버퍼 통계/메모리 예산
+        self.buffer_stats: dict[int, GuildBufferStats] = {}
+
+        # 플레이리스트 스트리밍 수집
+        self.playlist_executor = ThreadPoolExecutor(max_workers=PLAYLIST_STREAM_WORKERS, thread_name_prefix="ydl-playlist")
+        self.playlist_tasks: dict[int, set[asyncio.Task]] = {}
+
+        # 재생 상태 영속화 (변경 감지 후 묶어서 SQLite 에 기록) 및 재시작 복구
+        self.state_store = StateStore()
+        self.state_sigs: dict[int, tuple] = {}       # guild_id -> 마지막으로 기록한 상태 서명
+        self.state_saved_at: dict[int, float] = {}
+        self.state_queue_json: dict[int, tuple[tuple, str]] = {}  # guild_id -> ((id(queue), version), 직렬화 결과)
+        self.state_task: asyncio.Task | None = None
+        self.restore_task: asyncio.Task | None = None
+
+        # 메트릭 HTTP 엔드포인트 (Prometheus, localhost 전용)
+        self.metrics_server: asyncio.AbstractServer | None = None
+        self.resumed_guilds = 0
+        self.ffmpeg_count_cache: tuple[float, int | None] = (-METRICS_SCAN_TTL, None)  # (monotonic, 값)
+        self.guild_memory_cache: tuple[float, dict] = (-METRICS_SCAN_TTL, {})
+
+        # 대기열 곡의 서명 URL 만료 추적/선제 갱신
+        self.track_started_at: dict[int, float] = {}
+        self.track_paused_at: dict[int, float] = {}  # 일시정지 시각 (재개하면 그만큼 시작 시각을 뒤로 미룸)
+        self.stream_refresh_task: asyncio.Task | None = None
+        self.stream_refresh_sem = asyncio.Semaphore(STREAM_REFRESH_CONCURRENCY)
+        self._refreshing: set[int] = set()  # id(song)
+
+    async def cog_load(self):
+        # 버튼은 custom_id 로 라우팅되는 영구 뷰 하나로 처리 (재시작 후 예전 메시지 버튼도 동작)
+        self.player_view = PlayerView(self)
+        self.bot.add_view(self.player_view)
+        # 클러스터 모드: 다른 프로세스가 중계한 관리 명령 처리
+        if link := getattr(self.bot, "cluster", None):
+            link.handlers.update({
+                "stats": self._cluster_cmd_stats,
+                "leave": self._cluster_cmd_leave,
+            })
+        self.stream_refresh_task = asyncio.create_task(self._stream_refresh_loop())
+        self.state_task = asyncio.create_task(self._state_flush_loop())
+        self.restore_task = asyncio.create_task(self._restore_state())
+        if PROFILE_ENABLED:
+            PROFILER.start()
+        # 클러스터 모드에선 프로세스마다 포트를 하나씩 밀어서 사용
+        port = METRICS_PORT + int(os.getenv("CLUSTER_ID", "0")) if METRICS_PORT > 0 else 0
+        self.metrics_server = await serve_metrics(self.render_metrics, port)
+
+    def cog_unload(self):
+        if self.stream_refresh_task:
+            self.stream_refresh_task.cancel()
+        if self.state_task:
+            self.state_task.cancel()
+        if self.restore_task:
+            self.restore_task.cancel()
+        if self.metrics_server:
+            self.metrics_server.close()
+        PROFILER.stop()
+        self.state_store.close(*self._collect_state_changes(force_positions=True))
+        if self.player_view:
+            self.player_view.stop()
+        self.ui_renderer.shutdown()
+        self.extractor_pool.shutdown()
+        for t in self.station_tasks.values():
+            t.cancel()
+        for station in self.stations.values():
+            station.suspend()
+        for guild_id in list(self.playlist_tasks):
+            self._cancel_playlists(guild_id)
+        self.playlist_executor.shutdown(wait=False, cancel_futures=True)
+        self.suggest_executor.shutdown(wait=False, cancel_futures=True)
+        for t in self.audio_cache_tasks:
+            t.cancel()
+        for t in self.loudness_tasks:
+            t.cancel()
+        self.audio_cache.save()
+        self.loudness.save()
+        # 남아있는 타이머/프리로드 태스크 정리
+        self.timers.shutdown()
+        for guild_id in list(self.preloaded_sources):
+            self._discard_preloaded(guild_id)
+
+    # ---------- 공용 유틸 ----------
+    def update_activity(self, guild_id: int):
+        self.last_activity[guild_id] = datetime.datetime.utcnow()
+
+    async def start_inactivity_timer(self, guild_id: int, interaction: discord.Interaction):
+        async def timer():
+            last_input = self.last_activity.get(guild_id)
+            if (
+                not self.is_playing.get(guild_id, False)
+                and last_input
+                and (datetime.datetime.utcnow() - last_input).total_seconds() >= INACTIVITY_TIMEOUT
+            ):
+                await self.disconnect_and_cleanup(guild_id, interaction)
+
+        self.timers.schedule(("idle", guild_id), INACTIVITY_TIMEOUT, timer)  # 10분
+
+    async def disconnect_and_cleanup(self, guild_id: int, interaction: discord.Interaction | None):
+        # 프리로드 리소스/태스크도 정리
+        self._cancel_preload(guild_id)
+        self._cancel_playlists(guild_id)
+        self._leave_radio(guild_id)
+
+        vc = self.voice_clients.get(guild_id)
+        if vc and vc.is_connected():
+            try:
+                await vc.disconnect()
+            except Exception:
+                pass
+        self.voice_clients.pop(guild_id, None)
+        self.chains.pop(guild_id, None)
+        self.last_track_end.pop(guild_id, None)
+        self.buffer_stats.pop(guild_id, None)
+        self.queues.pop(guild_id, None)
+        self.is_playing[guild_id] = False
+        self.current_songs[guild_id] = None
+        await self.delete_player_ui(guild_id)
+
+    # ---------- 음성 연결 ----------
+    async def join_voice_channel(self, interaction: discord.Interaction) -> discord.VoiceClient | None:
+        guild = interaction.guild
+        if guild is None:
+            await interaction.followup.send("🚫 길드 컨텍스트에서만 사용할 수 있어요.", ephemeral=True)
+            return None
+
+        if interaction.user is None or interaction.user.voice is None:
+            await interaction.followup.send("🚫 먼저 음성 채널에 들어가 주세요!", ephemeral=True)
+            return None
+
+        target_channel = interaction.user.voice.channel
+        vc = self.voice_clients.get(guild.id)
+
+        if vc is None or not vc.is_connected():
+            vc = await target_channel.connect()
+            self.voice_clients[guild.id] = vc
+            return vc
+
+        if getattr(vc, "channel", None) != target_channel:
+            await vc.move_to(target_channel)
+        return vc
+
+    # ---------- 검색 ----------
+    async def search_youtube_async(self, query: str, guild_id: int | None = None, fresh: bool = False) -> dict | None:
+        """
+        검색/추출의 유일한 진입점: 캐시 → 추출 풀(길드별 공정 스케줄링).
+        메타만 살아 있으면 검색 없이 webpage_url 로 바로 재추출.
+        fresh=True 면 캐시된 스트림 URL 을 쓰지 않고 새로 추출 (만료 임박 URL 갱신용)
+        """
+        started = time.perf_counter()
+        cached, refresh_target = (None, None) if fresh else self.search_cache.lookup(query)
+        if cached:
+            METRICS.observe("search_seconds", time.perf_counter() - started, cache="hit")
+            return cached
+        song = await self.extractor_pool.run(guild_id, refresh_target or search_target(query))
+        if song:
+            self.search_cache.store(query, song)
+        cache = "fresh" if fresh else ("refresh" if refresh_target else "miss")
+        METRICS.observe("search_seconds", time.perf_counter() - started, cache=cache)
+        return song
+
+    # ---------- FFmpeg 헤더/옵션 ----------
+    def _raw_headers(self, headers: dict, referer: str | None = None) -> str:
+        """
+        ffmpeg -headers 인자에 넣을 원시 헤더(진짜 CRLF, 마지막 CRLF 포함) + UA/Origin/Referer 보강
+        """
+        add = {
+            "User-Agent": UA,
+            "Origin": "https://www.youtube.com",
+        }
+        if referer:
+            add["Referer"] = referer
+        merged = {**headers, **add}
+        return "\r\n".join(f"{k}: {v}" for k, v in merged.items()) + "\r\n"   # 실제 CRLF
+
+    def _headers_to_beforeopt(self, headers: dict, referer: str | None = None) -> str:
+        return f'-headers "{self._raw_headers(headers, referer)}" '
+
+    def _make_ffmpeg_opts(
+        self,
+        headers: dict,
+        use_filter: bool,
+        for_pcm: bool = False,
+        referer: str | None = None,
+        gain_db: float | None = None,
+        start: float = 0.0,
+    ) -> dict:
+        before = (
+            self._headers_to_beforeopt(headers, referer=referer) +
+            "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 "
+            "-rw_timeout 30000000 "
+            "-nostdin -fflags +genpts -probesize 32M -analyzeduration 10M "
+            "-thread_queue_size 2048 "
+            f'-user_agent "{UA}" '
+        )
+        if start > 0:
+            before += f"-ss {start:.2f} "  # 재시작 후 이어 재생
+        # 공통 옵션 (Opus 경로에는 -ar/-ac 넣지 않음 → 중복 경고 방지)
+        if for_pcm:
+            # PCM에서만 표준화 (라우드니스 보정은 파이썬에서 적용)
+            opts = "-vn -ar 48000 -ac 2 -bufsize 8M -loglevel warning"
+        else:
+            filters = []
+            if use_filter:
+                filters.append("aresample=async=1:min_hard_comp=0.100:first_pts=0")
+            if gain_db is not None:
+                # 라우드니스 보정: 측정해 둔 고정 이득을 volume 필터 하나로
+                filters.append(f"volume={gain_db:.2f}dB")
+            af = f"-af {','.join(filters)} " if filters else ""
+            opts = f"-vn {af}-bufsize 8M -loglevel warning"
+        return {"before_options": before, "options": opts, "executable": FFMPEG_PATH}
+
+    # ---------- 오디오 소스 생성(재시도) ----------
+    async def _create_source(self, url: str, headers: dict, referer: str | None, passthrough: bool = False,
+                             gain_db: float | None = None, start: float = 0.0):
+        """
+        (source, 사용한 경로 이름) 반환.
+        코덱은 ProbeCache 로 미리 알고 있으므로 from_probe(매번 ffprobe 추가 실행) 대신 생성자를 직접 호출하고,
+        단계마다 첫 프레임이 나오는지 확인한 뒤에야 채택 (죽은 ffmpeg 를 성공으로 치지 않음).
+        copy 경로는 음량을 바꿀 수 없으므로 |gain_db| < LOUDNESS_COPY_TOLERANCE_DB 인 곡은 보정 없이 그대로 내보냄
+        (재인코딩 CPU 를 아끼려는 의도된 절충. 그 이상 벗어난 곡만 opus_filter 로 보내 volume 필터를 씀)
+        """
+        def opts(**kw):
+            return self._make_ffmpeg_opts(headers, referer=referer, start=start, **kw)
+
+        tiers = []
+        # 0차: 원본이 이미 48kHz Opus → 디코딩/재인코딩 없이 remux(copy)
+        #      (보정해야 할 음량 차이가 크면 copy 로는 못 하므로 재인코딩 경로로)
+        if passthrough and (gain_db is None or abs(gain_db) < LOUDNESS_COPY_TOLERANCE_DB):
+            # opus/libopus → discord.py 가 -c:a copy 로 처리
+            tiers.append(("copy", lambda: discord.FFmpegOpusAudio(url, codec="opus", bitrate=128, **opts(use_filter=False))))
+        # 1차: Opus 재인코딩 + aresample 필터 (codec=None → discord.py 가 libopus 로 인코딩)
+        tiers.append(("opus_filter", lambda: discord.FFmpegOpusAudio(
+            url, codec=None, bitrate=128, **opts(use_filter=True, gain_db=gain_db))))
+        # 2차: Opus 재인코딩(필터 제거)
+        tiers.append(("opus", lambda: discord.FFmpegOpusAudio(
+            url, codec=None, bitrate=128, **opts(use_filter=False, gain_db=gain_db))))
+        # 3차: PCM (최후 수단, 스트리밍)
+        tiers.append(("pcm", lambda: discord.FFmpegPCMAudio(url, **opts(use_filter=False, for_pcm=True))))
+
+        loop = asyncio.get_running_loop()
+        error: Exception | None = None
+        for name, factory in tiers:
+            started = time.perf_counter()
+            try:
+                src = await loop.run_in_executor(None, spawn_validated_source, factory)
+            except Exception as e:
+                METRICS.error(f"source_{name}", e)
+                error = e
+                continue
+            # 생성 + 첫 프레임까지 (실제로 소리가 나올 준비가 된 시간)
+            METRICS.observe("source_ready_seconds", time.perf_counter() - started, tier=name)
+            if name == "pcm" and gain_db is not None:
+                src = GainPCMSource(src, gain_db) if np is not None else discord.PCMVolumeTransformer(src, 10 ** (gain_db / 20))
+            return src, name
+        raise error
+
+    async def create_audio_source_async(self, song: Track, guild_id: int | None = None,
+                                        start: float = 0.0) -> discord.AudioSource:
+        url   = song.url
+        hdrs  = song.http_headers or {}
+        refer = song.webpage_url or None
+
+        gain_db = self.loudness.gain_db(refer)
+
+        # 디스크 캐시 적중: 원격 fetch/재인코딩 없이 로컬 Opus 재생 (파일 열기/ffmpeg 생성은 executor 에서)
+        if path := self.audio_cache.lookup(refer):
+            try:
+                source = await asyncio.get_running_loop().run_in_executor(
+                    None, self._open_cached_source, path, gain_db, start
+                )
+                self._record_source_path(song, "disk")
+                return source
+            except Exception:
+                self.audio_cache.discard(refer)
+        want_fill = not start and self.audio_cache.note_play(refer)
+        codec, _ = await self.probe_cache.resolve(song, self._raw_headers(hdrs, referer=refer))
+        passthrough = codec == "opus" and song.asr in (None, 48000)
+        source, path_name = await self._create_source(url, hdrs, refer, passthrough=passthrough, gain_db=gain_db,
+                                                      start=start)
+        self._record_source_path(song, path_name)
+        # 캐시에 넣을 곡: 음량 보정이 구워지지 않은 Opus 출력만 그대로 받아 둠 (디스크에서 재생할 때 따로 보정)
+        # 라우드니스를 아직 모르는 곡은 같은 출력으로 측정 (모르면 gain_db 가 None 이라 보정 전 소리)
+        fill = want_fill and (path_name == "copy" or (gain_db is None and path_name != "pcm"))
+        measure = not start and path_name != "pcm" and self.loudness.get(refer) is None
+        if fill or measure:
+            source = self._tee_playback(song, source, fill=fill, measure=measure)
+        # 원격 스트림만 지터 버퍼로 감쌈 (디스크 캐시는 필요 없음)
+        if JITTER_BUFFER_MS > 0 and guild_id is not None:
+            source = BufferedSource(source, self._buffer_stats(guild_id))
+        return source
+
+    def _buffer_stats(self, guild_id: int) -> GuildBufferStats:
+        if (stats := self.buffer_stats.get(guild_id)) is None:
+            stats = self.buffer_stats[guild_id] = GuildBufferStats(guild_id=guild_id)
+        return stats
+
+    def _record_ttfa(self, song: Track, bucket: str, seconds: float):
+        """bucket = 프로브 출처(cache/metadata/ffprobe/preloaded/disk). 음성 스레드에서 호출됨 (deque.append 는 원자적)"""
+        METRICS.observe("ttff_seconds", seconds, probe=bucket)
+        self.source_reports.append({
+            "title": song.title,
+            "webpage_url": song.webpage_url,
+            "path": song.source_path,
+            "probe": bucket,
+            "ttfa": seconds,
+        })
+
+    def _record_source_path(self, song: Track, path_name: str):
+        """곡별로 어떤 소스 경로(disk/copy/opus_filter/opus/pcm)를 썼는지 기록 → CPU 절감 측정용"""
+        song.source_path = path_name
+        self.source_path_counts[path_name] = self.source_path_counts.get(path_name, 0) + 1
+
+    # ---------- 디스크 캐시 ----------
+    def _open_cached_source(self, path: str, gain_db: float | None = None, start: float = 0.0) -> discord.AudioSource:
+        seek = f"-ss {start:.2f}" if start > 0 else None
+        if gain_db is not None and abs(gain_db) >= LOUDNESS_COPY_TOLERANCE_DB:
+            # 음량 차이가 큰 곡만 로컬 파일을 재인코딩하며 보정
+            return discord.FFmpegOpusAudio(
+                path, codec=None, bitrate=128, executable=FFMPEG_PATH, before_options=seek,
+                options=f"-vn -af volume={gain_db:.2f}dB -loglevel warning",
+            )
+        if AUDIO_CACHE_READER == "ffmpeg" or seek:
+            return discord.FFmpegOpusAudio(path, codec="copy", executable=FFMPEG_PATH, before_options=seek)
+        return OggOpusFileSource(path)
+
+    def _tee_playback(self, song: Track, source: discord.AudioSource, fill: bool, measure: bool) -> discord.AudioSource:
+        """
+        재생 출력을 다시 씀: fill 이면 끝까지 재생된 패킷을 디스크 캐시에 저장하고 그 파일로 라우드니스 측정,
+        캐시에 넣지 않는 곡은 패킷을 조금씩 측정 ffmpeg 에 흘려 넣음 (곡 전체를 메모리에 들고 있지 않음)
+        """
+        refer = song.webpage_url
+        loop = self.bot.loop
+        if fill and self.audio_cache.begin_fill(refer):
+            return CacheTeeSource(
+                source,
+                on_complete=lambda packets: loop.call_soon_threadsafe(self._schedule_cache_store, song, packets),
+                on_abort=lambda: loop.call_soon_threadsafe(self.audio_cache.abort_fill, refer),
+            )
+        key = normalize_query(refer)
+        if not measure or key in self.loudness_inflight or len(self.loudness_streams) >= LOUDNESS_STREAM_MAX:
+            return source
+        self.loudness_inflight.add(key)
+        feed: asyncio.Queue[list[bytes] | None] = asyncio.Queue(maxsize=LOUDNESS_FEED_BACKLOG)
+        args = [FFMPEG_PATH, "-nostdin", "-hide_banner", "-nostats", "-f", "ogg", "-i", "pipe:0"]
+        task = self._start_loudness_task(refer, key, args, feed)
+        self.loudness_streams.add(task)
+        task.add_done_callback(self.loudness_streams.discard)
+
+        def _offer(batch: list[bytes] | None):
+            try:
+                feed.put_nowait(batch)
+            except asyncio.QueueFull:
+                task.cancel()  # 측정이 재생을 못 따라감 → 이번엔 포기 (다음 재생 때 다시)
+
+        return LoudnessTeeSource(
+            source,
+            on_batch=lambda batch: loop.call_soon_threadsafe(_offer, batch),
+            on_complete=lambda: loop.call_soon_threadsafe(_offer, None),
+            on_abort=lambda: loop.call_soon_threadsafe(task.cancel),
+        )
+
+    def _schedule_cache_store(self, song: Track, packets: list[bytes]):
+        task = asyncio.create_task(self.audio_cache.store(song.webpage_url, packets, song.duration))
+        self.audio_cache_tasks.add(task)
+        task.add_done_callback(self.audio_cache_tasks.discard)
+        # 저장된 파일로 라우드니스 측정 (저장 실패면 peek 가 None 이라 건너뜀)
+        task.add_done_callback(lambda _t: self._schedule_loudness(song))
+
+    # ---------- 라우드니스 분석 ----------
+    # 측정은 이미 가진 데이터로만 함: 디스크 캐시 사본, 또는 재생 중인 Opus 출력 (원격 재다운로드 없음)
+    def _schedule_loudness(self, song: Track):
+        """디스크 사본이 있는데 아직 측정 안 된 곡이면 백그라운드로 한 번만 측정"""
+        refer = song.webpage_url
+        if not refer or self.loudness.get(refer) is not None:
+            return
+        key = normalize_query(refer)
+        if key in self.loudness_inflight:
+            return
+        if not (path := self.audio_cache.peek(refer)):
+            return  # 재생할 때 출력에서 측정 (_tee_playback)
+        self.loudness_inflight.add(key)
+        self._start_loudness_task(refer, key, [FFMPEG_PATH, "-nostdin", "-hide_banner", "-nostats", "-i", path])
+
+    def _start_loudness_task(self, refer: str, key: str, args: list[str],
+                             feed: asyncio.Queue | None = None) -> asyncio.Task:
+        """inflight 키를 잡아 둔 상태에서 호출. feed 가 있으면 재생 속도대로 흐르므로 세마포어 대신 LOUDNESS_STREAM_MAX 로 제한"""
+        async def _task():
+            try:
+                if feed is not None:
+                    lufs = await measure_loudness(args, feed)
+                else:
+                    async with self.loudness_sem:
+                        lufs = await measure_loudness(args)
+                if lufs is None:
+                    self.loudness.analyze_failures += 1
+                else:
+                    self.loudness.put(refer, lufs)
+                    self.loudness.analyzed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.loudness.analyze_failures += 1
+
+        task = asyncio.create_task(_task())
+        self.loudness_tasks.add(task)
+        task.add_done_callback(self.loudness_tasks.discard)
+        # 시작 전에 취소돼도 키가 풀리도록 finally 대신 완료 콜백에서
+        task.add_done_callback(lambda _t: self.loudness_inflight.discard(key))
+        return task
+
+    # ---------- 프리로드(선로딩) ----------
+    def _song_key(self, song: Track) -> str:
+        """프리로드 캐시 키(만료 최소화 위해 URL보다 webpage_url/제목 위주)"""
+        return song.key
+
+    def _cancel_preload(self, guild_id: int, keep_sources: bool = False):
+        self.timers.cancel(("preload", guild_id))
+        if not keep_sources:
+            self._discard_preloaded(guild_id)
+
+    def _discard_preloaded(self, guild_id: int, keep: set[str] | None = None):
+        """쓰지 않을 프리로드 소스는 cleanup() 으로 ffmpeg 프로세스까지 정리"""
+        stored = self.preloaded_sources.get(guild_id)
+        if not stored:
+            return
+        for key in [k for k in stored if not keep or k not in keep]:
+            try:
+                stored.pop(key).cleanup()
+            except Exception:
+                pass
+        if not stored:
+            self.preloaded_sources.pop(guild_id, None)
+
+    def _store_preloaded(self, guild_id: int, song: Track, source: discord.AudioSource):
+        key = self._song_key(song)
+        stored = self.preloaded_sources.setdefault(guild_id, {})
+        if old := stored.get(key):
+            old.cleanup()
+        stored[key] = source
+
+    def _get_preloaded(self, guild_id: int, song: Track):
+        return self.preloaded_sources.get(guild_id, {}).get(self._song_key(song))
+
+    def _take_preloaded(self, guild_id: int, song: Track):
+        stored = self.preloaded_sources.get(guild_id)
+        if not stored:
+            return None
+        return stored.pop(self._song_key(song), None)
+
+    def _live_preload_count(self) -> int:
+        return sum(len(v) for v in self.preloaded_sources.values())
+
+    def _schedule_preload_next(self, interaction: discord.Interaction, delay: float = 0.8):
+        """대기열 앞쪽 K곡을 일정 지연 후 프리로드. 대기 중이거나 진행 중인 이전 프리로드는 대체."""
+        guild_id = interaction.guild.id
+
+        async def _task():
+            try:
+                await self._preload_window(guild_id)
+            except asyncio.CancelledError:
+                return
+            except Exception as e:
+                # 프리로드 실패는 재생을 막지 않음(실재생 시 재시도). 기록만
+                METRICS.error("preload", e)
+
+        # 재생 시작 직후/대기열 추가 직후 스파이크를 피해 약간 뒤에 수행
+        self.timers.schedule(("preload", guild_id), delay, _task)
+
+    def _disarm_stale_next(self, guild_id: int):
+        """
+        장전된 다음 곡이 더 이상 대기열 맨 앞이 아니면 즉시 회수.
+        대기열 맨 앞을 바꾸는 명령은 바로 불러야 함 (프리로드 예약을 기다리는 동안 곡이 끝나면
+        연속 소스가 삭제/이동된 곡으로 넘어가 버림)
+        """
+        chain = self.chains.get(guild_id)
+        if chain is None or (armed := chain.next_track()) is None:
+            return
+        queue = self.queues.get(guild_id)
+        if queue and queue[0] is armed:
+            return
+        if taken := chain.take_next():
+            live_keys = {self._song_key(s) for s in queue.peek(PRELOAD_LIVE_DEPTH)} if queue else set()
+            if self._song_key(taken[0]) in live_keys:
+                self._store_preloaded(guild_id, taken[0], taken[1])
+            else:
+                taken[1].cleanup()
+
+    async def _preload_window(self, guild_id: int):
+        queue = self.queues.get(guild_id)
+        window = queue.peek(PRELOAD_LOOKAHEAD) if queue else []
+        live_keys = {self._song_key(s) for s in window[:PRELOAD_LIVE_DEPTH]}
+        self._disarm_stale_next(guild_id)
+        # 창에서 벗어난 소스는 즉시 정리
+        self._discard_preloaded(guild_id, keep=live_keys)
+
+        for pos, song in enumerate(window):
+            await self.preload_scheduler.acquire(pos)
+            try:
+                await self._warm_song(guild_id, song, live=self._song_key(song) in live_keys)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                METRICS.error("preload_warm", e)
+            finally:
+                self.preload_scheduler.release()
+
+    async def _warm_song(self, guild_id: int, song: Track, live: bool):
+        # 1) 자리표시 곡이거나 스트림 URL 만료 임박이면 (재)해석
+        if not song.resolved or self._stream_expired(song):
+            if not await self._refresh_stream(song, guild_id):
+                return
+        # 2) 프로브 정보 확보 (캐시 공유) + 라우드니스 미측정이면 백그라운드 분석
+        await self.probe_cache.resolve(song, self._raw_headers(song.http_headers or {}, referer=song.webpage_url))
+        self._schedule_loudness(song)
+        # 3) 앞쪽 곡은 ffmpeg 소스까지 (전역 상한 내에서)
+        if not live or self._get_preloaded(guild_id, song):
+            return
+        if self._live_preload_count() >= PRELOAD_MAX_LIVE_SOURCES:
+            return
+        src = await self._create_preload_source(song, guild_id)
+        queue = self.queues.get(guild_id)
+        if queue and self._song_key(song) in {self._song_key(s) for s in queue.peek(PRELOAD_LIVE_DEPTH)}:
+            self._store_preloaded(guild_id, song, src)
+            self._arm_next(guild_id)
+        else:
+            src.cleanup()  # 만드는 사이 대기열이 바뀜
+
+    async def _create_preload_source(self, song: Track, guild_id: int) -> discord.AudioSource:
+        task = asyncio.ensure_future(self.create_audio_source_async(song, guild_id))
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # 취소돼도 생성은 끝까지 진행되므로 결과물의 ffmpeg 를 정리
+            def _cleanup(t: asyncio.Future):
+                if not t.cancelled() and t.exception() is None:
+                    t.result().cleanup()
+            task.add_done_callback(_cleanup)
+            raise
+
+    # ---------- 스트림 URL 선제 갱신 ----------
+    @staticmethod
+    def _stream_expired(song: Track, margin: float = SEARCH_STREAM_MARGIN) -> bool:
+        expires = stream_url_expiry(song.url)
+        return expires is not None and expires - margin < time.time()
+
+    async def _refresh_stream(self, song: Track, guild_id: int | None) -> bool:
+        """webpage_url 로 다시 추출해 url/http_headers 등을 제자리 갱신"""
+        if not song.webpage_url or id(song) in self._refreshing:
+            return False
+        self._refreshing.add(id(song))
+        try:
+            async with self.stream_refresh_sem:
+                fresh = await self.search_youtube_async(song.webpage_url, guild_id, fresh=True)
+        finally:
+            self._refreshing.discard(id(song))
+        if not fresh or not fresh.get("url"):
+            METRICS.inc("stream_refresh_failures_total")
+            return False
+        song.update(fresh)
+        METRICS.inc("stream_refreshes_total")
+        return True
+
+    def _songs_due_for_refresh(self, limit: int = STREAM_REFRESH_BATCH) -> list[tuple[int, Track]]:
+        """
+        재생 예상 시각(현재 곡 남은 시간 + 앞선 곡 길이 합)이 STREAM_REFRESH_HORIZON 안에 있고
+        그 전에 만료될 곡 목록 (이른 순으로 최대 limit 개).
+        먼 뒤쪽 곡은 지금 갱신해도 재생 전에 다시 만료되므로 건드리지 않음
+        """
+        now = time.time()
+        due = []
+        for guild_id, queue in self.queues.items():
+            current = self.current_songs.get(guild_id)
+            eta = now + max(0.0, ((current and current.duration) or STREAM_DURATION_FALLBACK) - self._track_position(guild_id))
+            for song in queue:
+                if eta - now > STREAM_REFRESH_HORIZON:
+                    break
+                expires = stream_url_expiry(song.url)
+                if expires is not None and expires - STREAM_REFRESH_LEAD < eta and id(song) not in self._refreshing:
+                    due.append((eta, guild_id, song))
+                eta += song.duration or STREAM_DURATION_FALLBACK
+        due.sort(key=lambda d: d[0])
+        return [(guild_id, song) for _, guild_id, song in due[:limit]]
+
+    async def _stream_refresh_loop(self):
+        while True:
+            await asyncio.sleep(STREAM_REFRESH_INTERVAL)
+            try:
+                due = self._songs_due_for_refresh()
+                if due:
+                    # 묶음 크기는 STREAM_REFRESH_BATCH 로 제한, 세마포어로 동시 추출 수 제한
+                    await asyncio.gather(*(self._refresh_stream(song, gid) for gid, song in due))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                METRICS.error("stream_refresh", e)
+
+    # ---------- 플레이리스트 ----------
+    def _cancel_playlists(self, guild_id: int):
+        for t in self.playlist_tasks.pop(guild_id, set()):
+            t.cancel()
+
+    def _is_duplicate(self, guild_id: int, webpage_url: str | None) -> bool:
+        """재생 중인 곡이나 대기열에 같은 곡이 있으면 True (대기열은 인덱스라 O(1))"""
+        if not webpage_url:
+            return False
+        q = self.queues.get(guild_id)
+        if q is not None and q.contains(webpage_url):
+            return True
+        current = self.current_songs.get(guild_id)
+        return (current is not None and bool(current.webpage_url)
+                and normalize_query(current.webpage_url) == normalize_query(webpage_url))
+
+    def _enqueue_placeholders(self, guild_id: int, batch: list[dict]) -> tuple[int, int]:
+        """(추가, 중복) 개수. 중복은 QUEUE_REJECT_DUPLICATES 일 때만 빼고 나머진 세기만 함"""
+        q = self.queues.setdefault(guild_id, GuildQueue())
+        added = dup = 0
+        for info in batch:
+            if self._is_duplicate(guild_id, info["webpage_url"]):
+                dup += 1
+                if QUEUE_REJECT_DUPLICATES:
+                    continue
+            q.append(Track.from_info(info))
+            added += 1
+        return added, dup
+
+    async def enqueue_playlist(self, interaction: discord.Interaction, url: str) -> bool:
+        """
+        플레이리스트를 스트리밍으로 대기열에 추가. 첫 묶음이 들어오면 바로 반환하고
+        나머지는 백그라운드에서 계속 받음. 항목이 하나도 없으면 False
+        """
+        guild_id = interaction.guild.id
+        loop = asyncio.get_running_loop()
+        batches: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def emit(batch: list[dict]):
+            loop.call_soon_threadsafe(batches.put_nowait, batch)
+
+        fut = loop.run_in_executor(self.playlist_executor, stream_playlist_blocking, url, emit, stop)
+        # 종료 표식 (emit 콜백들보다 나중에 실행됨)
+        fut.add_done_callback(lambda _: batches.put_nowait(None))
+
+        first = await batches.get()
+        if first is None:
+            if not fut.cancelled():
+                fut.exception()  # 미회수 예외 경고 방지
+            return False
+
+        added, dup = self._enqueue_placeholders(guild_id, first)
+        msg = await interaction.followup.send(f"📃 플레이리스트 불러오는 중… ({added}곡 추가)", wait=True)
+
+        task = asyncio.create_task(self._drain_playlist(guild_id, batches, fut, stop, msg, added, dup))
+        tasks = self.playlist_tasks.setdefault(guild_id, set())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return True
+
+    async def _drain_playlist(self, guild_id: int, batches: asyncio.Queue, fut: asyncio.Future,
+                              stop: threading.Event, msg: discord.Message, added: int, dup: int):
+        last_edit = time.monotonic()
+        try:
+            while (batch := await batches.get()) is not None:
+                a, d = self._enqueue_placeholders(guild_id, batch)
+                added += a
+                dup += d
+                if time.monotonic() - last_edit >= PLAYLIST_PROGRESS_INTERVAL:
+                    last_edit = time.monotonic()
+                    try:
+                        await msg.edit(content=f"📃 플레이리스트 불러오는 중… ({added}곡 추가)")
+                    except discord.HTTPException:
+                        pass
+            try:
+                title = fut.result()
+            except Exception:
+                title = None
+            text = f"📃 **{title or '플레이리스트'}** {added}곡 추가 완료"
+            if dup:
+                text += f" (중복 {dup}곡 {'제외' if QUEUE_REJECT_DUPLICATES else '포함'})"
+            try:
+                await msg.edit(content=text)
+            except discord.HTTPException:
+                pass
+        except asyncio.CancelledError:
+            stop.set()
+            raise
+
+    # ---------- 무간격 전환 ----------
+    def _arm_next(self, guild_id: int):
+        """대기열 맨 앞 곡의 프리로드 소스를 연속 소스에 장전"""
+        chain = self.chains.get(guild_id)
+        queue = self.queues.get(guild_id)
+        if chain is None or not queue:
+            return
+        head = queue[0]
+        if chain.next_track() is head:
+            return
+        if (src := self._take_preloaded(guild_id, head)) is None:
+            return
+        if old := chain.set_next(head, src):
+            old[1].cleanup()
+
+    def _handle_chain_advance(self, interaction: discord.Interaction, track: Track, gap: float):
+        """(이벤트 루프) 연속 소스가 다음 곡으로 넘어간 뒤의 대기열/UI 처리"""
+        guild_id = interaction.guild.id
+        if queue := self.queues.get(guild_id):
+            if queue[0] is track:
+                queue.popleft()
+            elif not queue.discard(track):
+                # 대기열에 없는 곡으로 넘어감 (장전 해제가 늦음) — 없어야 하는 경로라 세어 둠
+                METRICS.inc("chain_advance_mismatch_total")
+        self.preload_hits += 1
+        self.current_songs[guild_id] = track
+        self.track_started_at[guild_id] = time.time()
+        self.track_paused_at.pop(guild_id, None)
+        METRICS.observe("track_gap_seconds", gap, mode="chained")
+        asyncio.create_task(self.schedule_ui_update(interaction, delay=0.25))
+        self._schedule_preload_next(interaction, delay=0.8)
+
+    def _on_first_frame(self, guild_id: int, song: Track, bucket: str, started: float):
+        # 음성 스레드에서 호출됨
+        now = time.perf_counter()
+        self._record_ttfa(song, bucket, now - started)
+        if (ended := self.last_track_end.pop(guild_id, None)) is not None:
+            METRICS.observe("track_gap_seconds", now - ended, mode="cold")
+
+    def _skip_current(self, guild_id: int, vc: discord.VoiceClient):
+        """다음 곡이 장전돼 있으면 연속 소스 안에서 전환, 아니면 정지(after 콜백 경로)"""
+        chain = self.chains.get(guild_id)
+        if chain and vc.is_playing() and chain.next_track() is not None:
+            chain.skip()
+        else:
+            vc.stop()
+
+    # ---------- 라디오 ----------
+    def _get_station(self, name: str, create: bool = False) -> RadioStation | None:
+        station = self.stations.get(name)
+        if station is None and create:
+            loop = self.bot.loop
+            station = self.stations[name] = RadioStation(
+                name, request_next=lambda st: loop.call_soon_threadsafe(self._schedule_station_next, st)
+            )
+        return station
+
+    def _schedule_station_next(self, station: RadioStation):
+        if (t := self.station_tasks.get(station.name)) and not t.done():
+            return
+        self.station_tasks[station.name] = asyncio.create_task(self._station_prepare_next(station))
+
+    async def _station_prepare_next(self, station: RadioStation):
+        """편성표 맨 앞 곡의 소스를 만들어 방송국에 장전 (곡은 다시 편성표 뒤로)"""
+        if station.has_next() or not station.queue or not station.listeners:
+            return
+        track = station.queue.popleft()
+        station.queue.append(track)
+        src = None
+        try:
+            if not track.resolved or self._stream_expired(track):
+                await self._refresh_stream(track, None)
+            if track.resolved:
+                src = await self.create_audio_source_async(track)  # 공유 소스라 지터 버퍼 없이
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            src = None
+        if src is None:
+            # 실패하면 잠시 후 다음 곡으로 재시도
+            self.bot.loop.call_later(5, self._schedule_station_next, station)
+            return
+        if station.name not in self.stations or not station.listeners:
+            src.cleanup()
+            return
+        if old := station.set_next(track, src):
+            old[1].cleanup()
+
+    def _leave_radio(self, guild_id: int) -> str | None:
+        entry = self.radio_guilds.pop(guild_id, None)
+        if entry is None:
+            return None
+        name, listener = entry
+        if station := self.stations.get(name):
+            station.detach(listener)
+            if not station.listeners:
+                station.suspend()
+        return name
+
+    radio = app_commands.Group(name="radio", description="여러 서버가 함께 듣는 라디오")
+
+    @radio.command(name="add", description="라디오 편성표에 곡 추가 (없으면 새로 만듦)")
+    async def radio_add(self, interaction: discord.Interaction, name: str, *, query: str):
+        await interaction.response.defer(ephemeral=True)
+        if interaction.guild is None:
+            await interaction.followup.send("🚫 길드에서만 사용할 수 있어요.", ephemeral=True)
+            return
+
+        info = await self.search_youtube_async(query, interaction.guild.id)
+        if not info or not info.get("url"):
+            await interaction.followup.send("🔍 검색 결과가 없어요. 다른 키워드/URL을 시도해 주세요.", ephemeral=True)
+            return
+        station = self._get_station(name, create=True)
+        track = Track.from_info(info)
+        station.queue.append(track)
+        if station.listeners and not station.has_next():
+            self._schedule_station_next(station)
+        await interaction.followup.send(f"📻 **{name}** 편성표에 **{track.title}** 추가 ({len(station.queue)}곡)", ephemeral=True)
+
+    @radio.command(name="join", description="라디오 청취 시작")
+    async def radio_join(self, interaction: discord.Interaction, name: str):
+        await interaction.response.defer()
+        if interaction.guild is None:
+            await interaction.followup.send("🚫 길드에서만 사용할 수 있어요.", ephemeral=True)
+            return
+
+        guild_id = interaction.guild.id
+        self.update_activity(guild_id)
+        station = self._get_station(name)
+        if station is None or not station.queue:
+            await interaction.followup.send("⛔ 그런 라디오가 없거나 편성표가 비어 있어요.", ephemeral=True)
+            return
+        vc = await self.join_voice_channel(interaction)
+        if vc is None:
+            return
+
+        # 로컬 재생 중단 (radio_guilds 에 먼저 넣어서 after 콜백이 다음 곡을 틀지 않게)
+        self._leave_radio(guild_id)
+        self.radio_guilds[guild_id] = (name, station.attach())
+        self._cancel_preload(guild_id)
+        self.is_playing[guild_id] = False
+        self.current_songs[guild_id] = None
+        self.chains.pop(guild_id, None)
+        if vc.is_playing() or vc.is_paused():
+            vc.stop()
+        await self.delete_player_ui(guild_id)
+
+        vc.play(self.radio_guilds[guild_id][1])
+        if station.track is None and not station.has_next():
+            self._schedule_station_next(station)
+        await interaction.followup.send(f"📻 **{name}** 라디오 청취 시작! (청취 중인 서버 {len(station.listeners)}곳)")
+
+    @radio.command(name="leave", description="라디오 청취 종료")
+    async def radio_leave(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        if interaction.guild is None:
+            await interaction.followup.send("🚫 길드에서만 사용할 수 있어요.", ephemeral=True)
+            return
+
+        guild_id = interaction.guild.id
+        self.update_activity(guild_id)
+        name = self._leave_radio(guild_id)
+        if name is None:
+            await interaction.followup.send("⛔ 라디오를 듣고 있지 않아요.", ephemeral=True)
+            return
+        vc = self.voice_clients.get(guild_id)
+        if vc and (vc.is_playing() or vc.is_paused()):
+            vc.stop()
+        await interaction.followup.send(f"📻 **{name}** 라디오 청취 종료", ephemeral=True)
+
+    @radio.command(name="list", description="라디오 목록")
+    async def radio_list(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        if not self.stations:
+            await interaction.followup.send("⛔ 라디오가 없어요.", ephemeral=True)
+            return
+        lines = []
+        for name, st in self.stations.items():
+            r = st.stats()
+            now = f" — 🎵 {r['track']}" if r["track"] else ""
+            lines.append(f"📻 **{name}** ({r['queue']}곡, 청취 {r['listeners']}곳){now}")
+        await interaction.followup.send("\n".join(lines)[:1900], ephemeral=True)
+
+    # ---------- 재생 상태 저장/복구 ----------
+    def _track_position(self, guild_id: int) -> float:
+        """현재 곡 재생 위치(초). 일시정지한 시간은 빼고 셈"""
+        started = self.track_started_at.get(guild_id)
+        if started is None:
+            return 0.0
+        return max(0.0, self.track_paused_at.get(guild_id, time.time()) - started)
+
+    def _mark_paused(self, guild_id: int):
+        self.track_paused_at.setdefault(guild_id, time.time())
+
+    def _mark_resumed(self, guild_id: int):
+        paused = self.track_paused_at.pop(guild_id, None)
+        if paused is not None and guild_id in self.track_started_at:
+            self.track_started_at[guild_id] += time.time() - paused
+
+    def _queue_json(self, guild_id: int, queue: GuildQueue | None) -> str:
+        """대기열 직렬화. version 이 그대로면 지난번 결과를 재사용"""
+        if not queue:
+            self.state_queue_json.pop(guild_id, None)
+            return "[]"
+        key = (id(queue), queue.version)
+        cached = self.state_queue_json.get(guild_id)
+        if cached is None or cached[0] != key:
+            cached = self.state_queue_json[guild_id] = (
+                key, json.dumps([_track_record(t) for t in queue], ensure_ascii=False)
+            )
+        return cached[1]
+
+    def _state_row(self, guild_id: int) -> tuple | None:
+        """저장할 행. 남길 상태가 없으면 None (행 삭제)"""
+        if guild_id in self.radio_guilds:
+            return None
+        queue = self.queues.get(guild_id)
+        current = self.current_songs.get(guild_id)
+        if not queue and current is None:
+            return None
+        vc = self.voice_clients.get(guild_id)
+        msg = self.last_message.get(guild_id)
+        position = self._track_position(guild_id) if current is not None else 0.0
+        return (
+            guild_id,
+            vc.channel.id if vc and getattr(vc, "channel", None) else None,
+            msg.channel.id if msg else None,
+            json.dumps(_track_record(current), ensure_ascii=False) if current else None,
+            position,
+            int(bool(self.is_playing.get(guild_id))),
+            self._queue_json(guild_id, queue),
+            time.time(),
+        )
+
+    def _state_sig(self, guild_id: int) -> tuple:
+        queue = self.queues.get(guild_id)
+        vc = self.voice_clients.get(guild_id)
+        return (
+            id(queue), queue.version if queue else 0, id(self.current_songs.get(guild_id)),
+            bool(self.is_playing.get(guild_id)), getattr(getattr(vc, "channel", None), "id", None),
+            guild_id in self.last_message, guild_id in self.radio_guilds,
+        )
+
+    def _collect_state_changes(self, force_positions: bool = False) -> tuple[list[tuple], list[tuple], list[int]]:
+        """
+        (행, 위치, 삭제). 바뀐 길드만 행으로 만듦. 핫 패스에서는 아무것도 하지 않고(대기열은 version 만 증가),
+        여기서 서명 비교로 변경을 감지. 재생 중인 길드는 STATE_POSITION_INTERVAL 마다 위치만 UPDATE
+        """
+        now = time.monotonic()
+        rows, positions, deletes = [], [], []
+        guild_ids = set(self.queues) | {g for g, s in self.current_songs.items() if s is not None} | set(self.state_sigs)
+        for gid in guild_ids:
+            current = self.current_songs.get(gid)
+            sig = self._state_sig(gid)
+            playing = current is not None and self.is_playing.get(gid)
+            stale_position = playing and (force_positions or now - self.state_saved_at.get(gid, 0) >= STATE_POSITION_INTERVAL)
+            if self.state_sigs.get(gid) == sig:
+                if stale_position:
+                    positions.append((self._track_position(gid), time.time(), gid))
+                    self.state_saved_at[gid] = now
+                continue
+            row = self._state_row(gid)
+            if row is None:
+                if gid in self.state_sigs:
+                    deletes.append(gid)
+                self.state_sigs.pop(gid, None)
+                self.state_saved_at.pop(gid, None)
+                self.state_queue_json.pop(gid, None)
+                continue
+            rows.append(row)
+            self.state_sigs[gid] = sig
+            self.state_saved_at[gid] = now
+        return rows, positions, deletes
+
+    async def _state_flush_loop(self):
+        while True:
+            await asyncio.sleep(STATE_FLUSH_INTERVAL)
+            try:
+                rows, positions, deletes = self._collect_state_changes()
+                if rows or positions or deletes:
+                    await self.state_store.write(rows, positions, deletes)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                METRICS.error("state_flush", e)
+
+    async def _restore_state(self):
+        """
+        재시작 후 복구: 대기열은 자리표시 곡(스트림 URL 없음)으로 바로 채우고,
+        재생 중이던 길드만 타이머로 간격을 두고 음성 재접속 + 저장된 위치부터 재생.
+        URL 은 곧 재생될 곡만 프리로드/재생 시점에 재해석
+        """
+        await self.bot.wait_until_ready()
+        try:
+            rows = await self.state_store.load_all()
+        except Exception:
+            return
+        delay = 0.0
+        for row in rows:
+            gid = row["guild_id"]
+            guild = self.bot.get_guild(gid)
+            if guild is None or time.time() - row["updated_at"] > RESUME_MAX_AGE:
+                continue  # 다른 클러스터 담당이거나 너무 오래된 상태
+            if self.queues.get(gid) or self.current_songs.get(gid):
+                continue  # 복구 전에 이미 새로 재생 시작
+            queue = self.queues[gid] = GuildQueue()
+            for rec in row["queue"]:
+                if rec.get("webpage_url"):
+                    queue.append(Track.from_info(rec))
+            if row["playing"] and row["current"] and row["voice_channel_id"]:
+                self.timers.schedule(("resume", gid), delay, lambda g=guild, r=row: self._resume_guild(g, r))
+                delay += RESUME_STAGGER
+            elif row["current"]:
+                queue.appendleft(Track.from_info(row["current"]))
+            # 복구 직후 상태를 기록된 것으로 간주 (복구 대기 중에 현재 곡 정보를 덮어쓰지 않게)
+            self.state_sigs[gid] = self._state_sig(gid)
+            self.state_saved_at[gid] = time.monotonic()
+
+    async def _resume_guild(self, guild: discord.Guild, row: dict):
+        gid = guild.id
+        if self.current_songs.get(gid) or gid in self.radio_guilds:
+            return
+        song = Track.from_info(row["current"])
+        channel = guild.get_channel(row["voice_channel_id"])
+        vc = self.voice_clients.get(gid)
+        try:
+            if channel is None or not any(not m.bot for m in getattr(channel, "members", [])):
+                raise LookupError("no listeners")
+            if vc is None or not vc.is_connected():
+                vc = await channel.connect()
+                self.voice_clients[gid] = vc
+        except Exception:
+            # 듣는 사람이 없거나 접속 실패: 현재 곡을 대기열 맨 앞에 돌려놓고 대기열만 남겨 둠
+            self.queues.setdefault(gid, GuildQueue()).appendleft(song)
+            return
+        text = guild.get_channel(row["text_channel_id"]) if row["text_channel_id"] else None
+        start = float(row["position"] or 0.0)
+        if song.duration and start >= song.duration - 5:
+            start = 0.0
+        ctx = ResumeContext(guild, text)
+        self.is_playing[gid] = True
+        self.update_activity(gid)
+        if await self.play_music(ctx, song, start=start):
+            self.resumed_guilds += 1
+            if text is not None:
+                await ctx.send(f"🔁 재시작 전 재생 상태를 복구했어요: **{song.title}** ({int(start) // 60}:{int(start) % 60:02d}부터)")
+
+    # ---------- 메트릭/통계 ----------
+    def _guild_memory_bytes(self, guild_id: int, sample: int = 200) -> int:
+        """길드별 메모리 추정: 대기열 곡 레코드(표본 추정) + 지터 버퍼 사용량"""
+        total = 0
+        if queue := self.queues.get(guild_id):
+            picked = queue.peek(sample)
+            per_track = sum(
+                sys.getsizeof(t) + sys.getsizeof(t.title) + sys.getsizeof(t.webpage_url or "")
+                + sys.getsizeof(t.url or "") + sys.getsizeof(t.thumbnail) + sys.getsizeof(t.norm_key)
+                for t in picked
+            ) / max(1, len(picked))
+            total += int(per_track * len(queue))
+        if stats := self.buffer_stats.get(guild_id):
+            total += stats.bytes_in_use
+        return total
+
+    async def _ffmpeg_count(self) -> int | None:
+        """ffmpeg 자식 수. /proc 전체를 훑으므로 executor 에서, METRICS_SCAN_TTL 동안은 지난 값"""
+        at, value = self.ffmpeg_count_cache
+        if time.monotonic() - at >= METRICS_SCAN_TTL:
+            value = await asyncio.get_running_loop().run_in_executor(None, ffmpeg_process_count)
+            self.ffmpeg_count_cache = (time.monotonic(), value)
+        return value
+
+    def _guild_memory_summary(self) -> dict:
+        """길드별 메모리 추정의 합/최대/상위 5 (METRICS_SCAN_TTL 동안 재사용)"""
+        at, summary = self.guild_memory_cache
+        if time.monotonic() - at >= METRICS_SCAN_TTL:
+            sizes = [(self._guild_memory_bytes(g), g) for g in set(self.queues) | set(self.buffer_stats)]
+            summary = {
+                "sum": sum(b for b, _ in sizes),
+                "max": max((b for b, _ in sizes), default=0),
+                "top": sorted(sizes, reverse=True)[:5],
+            }
+            self.guild_memory_cache = (time.monotonic(), summary)
+        return summary
+
+    def _gauges(self, ffmpeg_count: int | None) -> list[tuple[str, dict, float]]:
+        hits, misses = self.preload_hits, self.preload_misses
+        pool = self.extractor_pool.stats()
+        ps = self.preload_scheduler.stats()
+        pc = self.probe_cache.stats()
+        ts = self.timers.stats()
+        ss = self.state_store.stats()
+        sc = self.search_cache.stats()
+        gauges: list[tuple[str, dict, float]] = [
+            ("preload_hits_total", {}, hits),
+            ("preload_misses_total", {}, misses),
+            ("preload_hit_ratio", {}, hits / (hits + misses) if hits + misses else None),
+            ("preloaded_sources", {}, self._live_preload_count()),
+            ("preload_slots_active", {}, ps["active"]),
+            ("preload_slots_waiting", {}, ps["waiting"]),
+            ("preload_slots_granted_total", {}, ps["granted"]),
+            ("ffmpeg_processes", {}, ffmpeg_count),
+            ("process_resident_bytes", {}, process_rss_bytes()),
+            ("voice_connections", {}, sum(1 for vc in self.voice_clients.values() if vc.is_connected())),
+            ("queued_tracks", {}, sum(len(q) for q in self.queues.values())),
+            ("extract_queue_depth", {}, pool["queue_depth"]),
+            ("extract_running", {}, pool["running"]),
+            ("timers_running", {}, ts["running"]),
+            ("timer_heap_entries", {}, ts["heap"]),
+            ("ui_writes_total", {}, self.ui_renderer.stats()["written"]),
+            ("ui_coalesced_total", {}, self.ui_renderer.coalesced),
+            ("search_cache_hits_total", {}, sc["hits"]),
+            ("search_cache_misses_total", {}, sc["misses"]),
+            ("search_cache_stream_refreshes_total", {}, sc["stream_refreshes"]),
+            ("search_cache_evictions_total", {}, sc["evictions"]),
+            ("search_cache_entries", {}, sc["entries"]),
+            ("suggest_cache_entries", {}, self.suggestions.stats()["entries"]),
+            ("probe_cache_entries", {}, pc["entries"]),
+            ("probe_lookups_total", {"result": "cache"}, pc["hits"]),
+            ("probe_lookups_total", {"result": "metadata"}, pc["from_metadata"]),
+            ("probe_lookups_total", {"result": "ffprobe"}, pc["probes"]),
+            ("probe_failures_total", {}, pc["probe_failures"]),
+            ("state_writes_total", {}, ss["writes"]),
+            ("state_rows_total", {"op": "upsert"}, ss["rows_written"]),
+            ("state_rows_total", {"op": "position"}, ss["positions_written"]),
+            ("state_rows_total", {"op": "delete"}, ss["rows_deleted"]),
+            ("state_write_failures_total", {}, ss["failures"]),
+        ]
+        for path_name, n in self.source_path_counts.items():
+            gauges.append(("source_path_total", {"tier": path_name}, n))
+        # kind 는 idle/ui/preload/resume/suggest 고정된 몇 가지뿐
+        for kind, n in ts["pending"].items():
+            gauges.append(("timers_pending", {"kind": kind}, n))
+        for event in ("scheduled", "rescheduled", "cancelled", "fired"):
+            gauges.append(("timer_events_total", {"event": event}, ts[event]))
+        if (ac := self.audio_cache.stats())["enabled"]:
+            gauges += [
+                ("audio_cache_hits_total", {}, ac["hits"]),
+                ("audio_cache_misses_total", {}, ac["misses"]),
+                ("audio_cache_hit_ratio", {}, ac["hit_rate"] if ac["hits"] + ac["misses"] else None),
+                ("audio_cache_entries", {}, ac["entries"]),
+                ("audio_cache_bytes", {}, ac["bytes"]),
+                ("audio_cache_stores_total", {}, ac["stores"]),
+                ("audio_cache_evictions_total", {}, ac["evictions"]),
+                ("audio_cache_fill_failures_total", {}, ac["fill_failures"]),
+                ("audio_cache_fill_aborts_total", {}, ac["fill_aborts"]),
+            ]
+        if self.stations:
+            # 방송국 이름은 사용자가 정하므로 라벨로 쓰지 않고 합계만 (방송국별은 /stats, /radio list)
+            radios = [st.stats() for st in self.stations.values()]
+            gauges += [
+                ("radio_stations", {}, len(radios)),
+                ("radio_listeners", {}, sum(r["listeners"] for r in radios)),
+                ("radio_frames_produced_total", {}, sum(r["frames_produced"] for r in radios)),
+                ("radio_frames_served_total", {}, sum(r["frames_served"] for r in radios)),
+                ("radio_silence_frames_total", {}, sum(r["silence_frames"] for r in radios)),
+            ]
+        # 길드 id 를 라벨로 쓰면 길드 수만큼 시계열이 생기므로 집계값만 (길드별은 /stats, /profile 에서)
+        memory = self._guild_memory_summary()
+        gauges.append(("guild_memory_bytes", {"stat": "sum"}, memory["sum"]))
+        gauges.append(("guild_memory_bytes", {"stat": "max"}, memory["max"]))
+        buffers = [stats.snapshot() for stats in self.buffer_stats.values()]
+        if buffers:
+            gauges += [
+                ("jitter_buffer_bytes", {}, sum(b["bytes_in_use"] for b in buffers)),
+                ("jitter_buffer_fill_seconds", {"stat": "min"}, min(b["fill_ms"] for b in buffers) / 1000),
+                ("jitter_buffer_refill_seconds", {"stat": "max"}, max(b["refill_max_ms"] for b in buffers) / 1000),
+                ("jitter_buffer_underruns", {}, sum(b["underruns"] for b in buffers)),
+                ("jitter_buffer_silence_frames", {}, sum(b["silence_frames"] for b in buffers)),
+            ]
+        jitters = [stats.frame_jitter for stats in self.buffer_stats.values() if stats.frames]
+        if jitters:
+            gauges.append(("voice_frame_jitter_seconds", {"stat": "avg"}, sum(jitters) / len(jitters)))
+            gauges.append(("voice_frame_jitter_seconds", {"stat": "max"}, max(jitters)))
+        return gauges
+
+    async def render_metrics(self) -> str:
+        return METRICS.render(self._gauges(await self._ffmpeg_count()))
+
+    @staticmethod
+    def _fmt_summary(name: str) -> str:
+        rows = []
+        for label, v in sorted(METRICS.summary(name).items()):
+            if not v["count"]:
+                continue
+            p95 = "∞" if v["p95"] == float("inf") else f"{v['p95'] * 1000:.0f}"
+            rows.append(f"`{label}` n={v['count']} avg {v['avg'] * 1000:.0f}ms · p50≤{v['p50'] * 1000:.0f} · p95≤{p95}")
+        return "\n".join(rows)[:1000] or "—"
+
+    @app_commands.command(name="stats", description="재생 파이프라인 통계 (관리자)")
+    @app_commands.default_permissions(administrator=True)
+    async def stats(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        hits, misses = self.preload_hits, self.preload_misses
+        rss = process_rss_bytes()
+        procs = await self._ffmpeg_count()
+        embed = discord.Embed(title="📊 재생 파이프라인 통계")
+        sc = self.search_cache.stats()
+        embed.add_field(
+            name="검색",
+            value=f"캐시 적중 {sc['hits']} · 메타만(재추출) {sc['stream_refreshes']} · 미스 {sc['misses']} "
+                  f"({sc['hit_rate']:.0%}) · {sc['entries']}곡 · 퇴출 {sc['evictions']}\n"
+                  + self._fmt_summary("search_seconds"),
+            inline=False,
+        )
+        sg = self.suggestions.stats()
+        embed.add_field(
+            name="자동완성",
+            value=f"캐시 적중 {sg['hits']} · 접두사 {sg['prefix_hits']} · 미스 {sg['misses']} ({sg['hit_rate']:.0%})\n"
+                  + self._fmt_summary("suggest_seconds"),
+            inline=False,
+        )
+        embed.add_field(name="추출 대기열 대기", value=self._fmt_summary("extract_queue_wait_seconds"), inline=False)
+        pc = self.probe_cache.stats()
+        embed.add_field(
+            name="프로브",
+            value=f"캐시 {pc['hits']} · 메타데이터 {pc['from_metadata']} · ffprobe {pc['probes']} "
+                  f"(실패 {pc['probe_failures']}) · {pc['entries']}곡\n" + self._fmt_summary("probe_seconds"),
+            inline=False,
+        )
+        embed.add_field(name="소스 준비(첫 프레임까지, 경로별)", value=self._fmt_summary("source_ready_seconds"), inline=False)
+        embed.add_field(name="첫 프레임까지", value=self._fmt_summary("ttff_seconds"), inline=False)
+        embed.add_field(name="곡 전환 간격(chained=연속 소스, cold=정지 후 재시작)",
+                        value=self._fmt_summary("track_gap_seconds"), inline=False)
+        tiers = " · ".join(f"{k} {v}" for k, v in sorted(self.source_path_counts.items())) or "—"
+        embed.add_field(name="소스 경로", value=tiers, inline=False)
+        if self.source_reports:
+            recent = list(self.source_reports)[-5:]
+            embed.add_field(
+                name="최근 재생(경로/프로브 · 첫 프레임까지)",
+                value="\n".join(
+                    f"{r['path'] or '?'}/{r['probe']} · {r['ttfa'] * 1000:.0f}ms · {(r['title'] or '?')[:40]}"
+                    for r in reversed(recent)
+                ),
+                inline=False,
+            )
+        embed.add_field(
+            name="스트림 URL 갱신",
+            value=(
+                f"갱신 {int(METRICS.counter_total('stream_refreshes_total'))} · "
+                f"실패 {int(METRICS.counter_total('stream_refresh_failures_total'))} · "
+                f"재생 시점 만료 {int(METRICS.counter_total('stream_expired_at_play_total'))}"
+            ),
+            inline=False,
+        )
+        ratio = f" ({hits / (hits + misses):.0%})" if hits + misses else ""
+        ps = self.preload_scheduler.stats()
+        embed.add_field(
+            name="자원",
+            value=(
+                f"프리로드 적중 {hits}/{hits + misses}{ratio} · "
+                f"슬롯 {ps['active']}/{ps['max_concurrent']} (대기 {ps['waiting']})\n"
+                f"ffmpeg 프로세스 {procs if procs is not None else '?'} · "
+                f"RSS {f'{rss / 2 ** 20:.0f}MiB' if rss else '?'}\n"
+                f"음성 연결 {sum(1 for vc in self.voice_clients.values() if vc.is_connected())}"
+            ),
+            inline=False,
+        )
+        ss = self.state_store.stats()
+        embed.add_field(
+            name="상태 저장(SQLite)",
+            value=(
+                f"쓰기 {ss['writes']}회 · 대기열 {ss['rows_written']}행 · 위치만 {ss['positions_written']}행 · "
+                f"삭제 {ss['rows_deleted']} · 실패 {ss['failures']}"
+            ),
+            inline=False,
+        )
+        ts = self.timers.stats()
+        embed.add_field(
+            name="타이머",
+            value=(
+                f"대기 {' · '.join(f'{k} {n}' for k, n in sorted(ts['pending'].items())) or '0'} · "
+                f"실행 중 {ts['running']} · 힙 {ts['heap']}\n"
+                f"예약 {ts['scheduled']} · 재예약 {ts['rescheduled']} · 취소 {ts['cancelled']} · 실행 {ts['fired']}"
+            ),
+            inline=False,
+        )
+        if self.buffer_stats:
+            # 언더런 많은 길드부터 (채움=남은 버퍼, 리필=원본 read 지연)
+            snaps = sorted(((st.snapshot(), g) for g, st in self.buffer_stats.items()),
+                           key=lambda x: (-x[0]["underruns"], x[0]["fill_ms"]))[:5]
+            embed.add_field(
+                name="지터 버퍼(길드별, 언더런 순 상위 5)",
+                value="\n".join(
+                    f"{g}: 채움 {b['fill_ms']:.0f}ms · 리필 avg {b['refill_avg_ms']:.1f}/max {b['refill_max_ms']:.0f}ms · "
+                    f"언더런 {b['underruns']} ({b['underrun_wait_ms']:.0f}ms, 무음 {b['silence_frames']})"
+                    for b, g in snaps
+                ),
+                inline=False,
+            )
+        if (ac := self.audio_cache.stats())["enabled"]:
+            embed.add_field(
+                name="디스크 캐시",
+                value=(
+                    f"적중 {ac['hits']}/{ac['hits'] + ac['misses']} ({ac['hit_rate']:.0%}) · "
+                    f"{ac['entries']}곡 {ac['bytes'] / 2 ** 20:.0f}/{ac['max_bytes'] / 2 ** 20:.0f}MiB\n"
+                    f"저장 {ac['stores']} · 퇴출 {ac['evictions']} · 실패 {ac['fill_failures']} · 중단 {ac['fill_aborts']}"
+                ),
+                inline=False,
+            )
+        if self.stations:
+            radios = sorted((st.stats() for st in self.stations.values()), key=lambda r: -r["listeners"])[:5]
+            embed.add_field(
+                name="라디오(청취 순 상위 5)",
+                value="\n".join(
+                    f"{r['name']}: 청취 {r['listeners']} · {r['queue']}곡 · "
+                    f"생산 {r['frames_produced']}/송출 {r['frames_served']} · 무음 {r['silence_frames']}"
+                    for r in radios
+                ),
+                inline=False,
+            )
+        top = self._guild_memory_summary()["top"]
+        if top:
+            embed.add_field(
+                name="길드별 메모리(상위 5)",
+                value="\n".join(f"{g}: {b / 1024:.0f}KiB" for b, g in top),
+                inline=False,
+            )
+        errors = METRICS.counter_values("errors_total")
+        if errors:
+            worst = sorted(errors.items(), key=lambda kv: -kv[1])[:6]
+            embed.add_field(
+                name="오류(단계/종류)",
+                value="\n".join(f"{dict(labels)['stage']}/{dict(labels)['error']}: {int(n)}" for labels, n in worst),
+                inline=False,
+            )
+        if METRICS_PORT > 0 and self.metrics_server:
+            embed.set_footer(text=f"Prometheus: http://127.0.0.1:{self.metrics_server.sockets[0].getsockname()[1]}/metrics")
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+    def profile_report_text(self, report: dict) -> str:
+        """/profile 첨부용 전체 보고서 (스택 포함)"""
+        lines = [
+            f"window {report['window']:.0f}s  loop lag p50 {_ms(report['lag_p50'])} p99 {_ms(report['lag_p99'])} "
+            f"max {_ms(report['lag_max'])}  slow threshold {PROFILE_SLOW * 1000:.0f}ms",
+            "",
+            f"## event loop stalls ({len(report['stalls'])})",
+        ]
+        for st in sorted(report["stalls"], key=lambda x: -x["duration"]):
+            lines.append(f"{time.strftime('%H:%M:%S', time.localtime(st['at']))} {st['duration'] * 1000:.0f}ms {st['owner']}")
+            lines.extend(f"    {site}" for site in st["stack"])
+        lines += ["", f"## voice thread stalls ({len(report['voice_stalls'])}, >= {VOICE_STALL_MS}ms)"]
+        for v in report["voice_stalls"]:
+            lines.append(
+                f"{time.strftime('%H:%M:%S', time.localtime(v['at']))} guild {v['guild_id']} gap {v['gap'] * 1000:.0f}ms "
+                f"read {v['read'] * 1000:.0f}ms cause {v['cause']}"
+            )
+        lines += ["", "## per-guild frame timing"]
+        for guild_id, stats in sorted(self.buffer_stats.items()):
+            snap = stats.snapshot()
+            if snap["frames"]:
+                lines.append(
+                    f"guild {guild_id} frames {snap['frames']} jitter {snap['jitter_ms']:.1f}ms late {snap['late_frames']} "
+                    f"gap max {snap['gap_max_ms']:.0f}ms stalls {snap['voice_stalls']} underruns {snap['underruns']} silence {snap['silence_frames']}"
+                )
+        return "\n".join(lines) + "\n"
+
+    @app_commands.command(name="profile", description="이벤트 루프/음성 스레드 정체 보고서 (관리자)")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.describe(reset="보고서를 보낸 뒤 기록을 비웁니다")
+    async def profile(self, interaction: discord.Interaction, reset: bool = False):
+        await interaction.response.defer(ephemeral=True)
+        if not PROFILER.running:
+            await interaction.followup.send("⛔ 프로파일러가 꺼져 있어요. 환경 변수 `PROFILE=1` 로 봇을 다시 시작하면 켜져요.", ephemeral=True)
+            return
+        report = PROFILER.report()
+        embed = discord.Embed(title=f"🩺 정체 보고서 (최근 {report['window'] / 60:.0f}분)")
+        embed.add_field(
+            name="이벤트 루프 지연",
+            value=f"p50 {_ms(report['lag_p50'])} · p99 {_ms(report['lag_p99'])} · 최대 {_ms(report['lag_max'])}",
+            inline=False,
+        )
+        worst = sorted(report["stalls"], key=lambda x: -x["duration"])[:5]
+        embed.add_field(
+            name=f"루프 정체 {len(report['stalls'])}회 (≥{PROFILE_SLOW * 1000:.0f}ms)",
+            value="\n".join(
+                f"{st['duration'] * 1000:.0f}ms `{st['owner']}`" + (f" @ `{st['stack'][0]}`" if st["stack"] else "")
+                for st in worst
+            )[:1000] or "—",
+            inline=False,
+        )
+        causes = " · ".join(f"{k} {v}" for k, v in sorted(report["voice_causes"].items())) or "없음"
+        jittery = sorted(
+            ((st.frame_jitter, g, st) for g, st in self.buffer_stats.items() if st.frames), key=lambda x: -x[0]
+        )[:5]
+        embed.add_field(
+            name=f"음성 스레드 정체 {len(report['voice_stalls'])}회 (≥{VOICE_STALL_MS}ms)",
+            value=(f"원인: {causes}\n" + "\n".join(
+                f"{g}: 지터 {j * 1000:.1f}ms · 늦은 프레임 {st.late_frames} · 최대 간격 {st.frame_gap_max * 1000:.0f}ms"
+                for j, g, st in jittery
+            ))[:1000],
+            inline=False,
+        )
+        text = self.profile_report_text(report)
+        if reset:
+            PROFILER.reset()
+        await interaction.followup.send(
+            embed=embed, file=discord.File(io.BytesIO(text.encode()), filename="profile.txt"), ephemeral=True,
+        )
+
+    # ---------- 클러스터(멀티 프로세스) ----------
+    def cluster_stats(self) -> dict:
+        return {
+            "voice": sum(1 for vc in self.voice_clients.values() if vc.is_connected()),
+            "playing": sum(1 for v in self.is_playing.values() if v),
+            "queued": sum(len(q) for q in self.queues.values()),
+            "radio_listeners": len(self.radio_guilds),
+            "preloaded_sources": self._live_preload_count(),
+        }
+
+    async def _cluster_cmd_stats(self, args: dict) -> dict:
+        return self.cluster_stats()
+
+    async def _cluster_cmd_leave(self, args: dict) -> dict:
+        guild_id = int(args["guild_id"])
+        if guild_id not in self.voice_clients:
+            return {"left": False}
+        await self.disconnect_and_cleanup(guild_id, None)
+        return {"left": True}
+
+    cluster = app_commands.Group(
+        name="cluster", description="클러스터 관리", default_permissions=discord.Permissions(administrator=True)
+    )
+
+    @cluster.command(name="status", description="전체 클러스터 통계")
+    async def cluster_status(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        link = getattr(self.bot, "cluster", None)
+        if link is None:
+            per_cluster = {0: {"guilds": len(self.bot.guilds), **self.cluster_stats()}}
+        else:
+            try:
+                per_cluster = await link.request("cluster_stats")
+            except (ConnectionError, asyncio.TimeoutError):
+                await interaction.followup.send("⛔ 클러스터 허브에 연결되어 있지 않아요.", ephemeral=True)
+                return
+        lines = [
+            f"#{c} 서버 {d.get('guilds', '?')} · 음성 {d.get('voice', '?')} · 재생 {d.get('playing', '?')} · "
+            f"대기열 {d.get('queued', '?')} · 지연 {d.get('latency_ms', '?')}ms"
+            for c, d in sorted(per_cluster.items())
+        ]
+        total_guilds = sum(d.get("guilds", 0) for d in per_cluster.values())
+        total_voice = sum(d.get("voice", 0) for d in per_cluster.values())
+        lines.append(f"합계: 클러스터 {len(per_cluster)} · 서버 {total_guilds} · 음성 {total_voice}")
+        await interaction.followup.send("\n".join(lines)[:1900], ephemeral=True)
+
+    @cluster.command(name="leave", description="어느 클러스터에 있든 해당 서버의 음성 연결 종료")
+    async def cluster_leave(self, interaction: discord.Interaction, guild_id: str):
+        await interaction.response.defer(ephemeral=True)
+        try:
+            gid = int(guild_id)
+        except ValueError:
+            await interaction.followup.send("⛔ 서버 ID 는 숫자여야 해요.", ephemeral=True)
+            return
+        link = getattr(self.bot, "cluster", None)
+        if link is None:
+            result = {0: await self._cluster_cmd_leave({"guild_id": gid})}
+        else:
+            try:
+                result = await link.request("leave", {"guild_id": gid}, guild_id=gid)
+            except (ConnectionError, asyncio.TimeoutError):
+                await interaction.followup.send("⛔ 클러스터 허브에 연결되어 있지 않아요.", ephemeral=True)
+                return
+        if any(r.get("left") for r in result.values()):
+            await interaction.followup.send(f"🛑 {gid} 음성 연결 종료 (클러스터 {list(result)})", ephemeral=True)
+        else:
+            await interaction.followup.send("⛔ 그 서버는 음성에 연결되어 있지 않아요.", ephemeral=True)
+
+    # ---------- 재생/대기열 ----------
+    async def play_music(self, interaction: discord.Interaction, song: Track, start: float = 0.0) -> bool:
+        guild_id = interaction.guild.id
+        vc = self.voice_clients.get(guild_id)
+        if vc is None:
+            vc = await self.join_voice_channel(interaction)
+            if vc is None:
+                self.is_playing[guild_id] = False
+                return False
+
+        started = time.perf_counter()
+        try:
+            # 1순위: 프리로드된 소스가 있으면 재사용
+            source = self._take_preloaded(guild_id, song) if not start else None
+            if source is None:
+                self.preload_misses += 1
+                if not song.resolved:
+                    # 플레이리스트 자리표시 곡: 프리로드가 못 따라왔으면 여기서 해석
+                    if not await self._refresh_stream(song, guild_id):
+                        raise LookupError(f"could not resolve {song.webpage_url}")
+                # 갱신이 못 따라간 경우: 만료된 URL 로 ffmpeg 403 루프에 빠지지 않게 여기서라도 재해석
+                elif self._stream_expired(song, margin=30):
+                    METRICS.inc("stream_expired_at_play_total")
+                    await self._refresh_stream(song, guild_id)
+                source = await self.create_audio_source_async(song, guild_id, start=start)
+                ttfa_bucket = "disk" if song.source_path == "disk" else (song.probe_source or "unknown")
+            else:
+                self.preload_hits += 1
+                ttfa_bucket = "preloaded"
+        except Exception as e:
+            METRICS.error("play_source", e)
+            await interaction.followup.send("⚠️ 오디오 소스를 만들 수 없었어요. 다른 곡을 시도해 주세요.", ephemeral=True)
+            await self.play_next(interaction)
+            return False
+
+        self.current_songs[guild_id] = song
+        self.track_started_at[guild_id] = time.time() - start
+        self.track_paused_at.pop(guild_id, None)
+        source = TimedSource(source, lambda: self._on_first_frame(guild_id, song, ttfa_bucket, started))
+
+        loop = self.bot.loop
+        chain = ChainedSource(
+            source, song,
+            on_advance=lambda track, gap: loop.call_soon_threadsafe(self._handle_chain_advance, interaction, track, gap),
+            on_end=lambda ended_at: self.last_track_end.__setitem__(guild_id, ended_at),
+            frame_stats=self._buffer_stats(guild_id) if PROFILE_ENABLED else None,
+        )
+        self.chains[guild_id] = chain
+
+        def _after_playback(error: Exception | None):
+            # 음성 스레드를 막지 않도록 결과를 기다리지 않고 루프에 넘기기만 함
+            self.last_track_end.setdefault(guild_id, time.perf_counter())
+            fut = asyncio.run_coroutine_threadsafe(self.play_next(interaction), loop)
+            fut.add_done_callback(lambda f: None if f.cancelled() else f.exception())
+
+        try:
+            vc.play(chain, after=_after_playback)
+        except Exception as e:
+            METRICS.error("play_start", e)
+            await interaction.followup.send("⚠️ 재생을 시작할 수 없었어요.", ephemeral=True)
+            await self.play_next(interaction)
+            return False
+
+        # UI 갱신
+        await self.schedule_ui_update(interaction, delay=0.25)
+        # 다음 곡 프리로드 예약
+        self._schedule_preload_next(interaction, delay=0.8)
+        return True
+
+    async def play_next(self, interaction: discord.Interaction):
+        guild_id = interaction.guild.id
+        if guild_id in self.radio_guilds:
+            return  # 라디오로 넘어가며 멈춘 로컬 재생의 after 콜백
+        queue = self.queues.get(guild_id)
+        if queue:
+            next_song = queue.popleft()
+            # 다음 곡 재생 → 그 다음 곡 프리로드 태스크는 새로 잡을 것
+            await self.play_music(interaction, next_song)
+        else:
+            self.is_playing[guild_id] = False
+            self.current_songs[guild_id] = None
+            self.chains.pop(guild_id, None)
+            self.last_track_end.pop(guild_id, None)
+            # 프리로드 리소스/태스크 정리
+            self._cancel_preload(guild_id)
+            await self.delete_player_ui(guild_id)
+            await self.start_inactivity_timer(guild_id, interaction)
+
+    # ---------- UI ----------
+    async def schedule_ui_update(self, interaction: discord.Interaction, delay: float = 0.3):
+        guild_id = interaction.guild.id
+        self.timers.schedule(("ui", guild_id), delay, lambda: self.send_player_ui(interaction))
+
+    async def send_player_ui(self, interaction: discord.Interaction):
+        """채널 렌더 큐에 갱신 요청만 넣음 (실제 내용은 쓰는 시점의 최신 상태)"""
+        guild_id = interaction.guild.id
+        msg = self.last_message.get(guild_id)
+        channel = msg.channel if msg else interaction.channel
+        if channel is None:
+            return
+        self.ui_renderer.submit(channel.id, guild_id, "update", channel)
+
+    async def delete_player_ui(self, guild_id: int):
+        if msg := self.last_message.get(guild_id):
+            self.ui_renderer.submit(msg.channel.id, guild_id, "delete", msg.channel)
+
+    async def _write_player_ui(self, guild_id: int, op: str, channel) -> str | None:
+        msg = self.last_message.get(guild_id)
+        if op == "delete":
+            if not msg:
+                return None
+            try:
+                await msg.delete()
+            except (discord.NotFound, discord.Forbidden):
+                pass
+            self.last_message.pop(guild_id, None)
+            self.ui_rendered.pop(guild_id, None)
+            return "delete"
+
+        song = self.current_songs.get(guild_id)
+        if not song:
+            return None
+        if msg and self.ui_rendered.get(guild_id) == song.key:
+            return None  # 이미 같은 곡을 그려 둠
+        embed = discord.Embed(
+            title="🎵 현재 재생 중",
+            description=f"[{song.title}]({song.webpage_url})",
+        )
+        if thumb := song.thumbnail:
+            embed.set_thumbnail(url=thumb)
+
+        if msg:
+            try:
+                await msg.edit(embed=embed, view=self.player_view)
+                self.ui_rendered[guild_id] = song.key
+                return "edit"
+            except (discord.NotFound, discord.Forbidden):
+                self.last_message.pop(guild_id, None)
+
+        try:
+            sent = await channel.send(embed=embed, view=self.player_view)
+        except discord.Forbidden:
+            return None
+        self.last_message[guild_id] = sent
+        self.ui_rendered[guild_id] = song.key
+        return "send"
+
+    # ---------- /play 자동완성 ----------
+    async def _suggest_lookup(self, query: str) -> list[dict] | None:
+        """같은 입력의 진행 중 검색은 공유. 기다리던 쪽이 모두 떠나면 아직 시작 안 한 검색은 버림"""
+        key = normalize_query(query)
+        entry = self.suggest_inflight.get(key)
+        if entry is None:
+            loop = asyncio.get_running_loop()
+            cf = self.suggest_executor.submit(search_suggestions_blocking, query)
+            entry = self.suggest_inflight[key] = [cf, 0]
+            cf.add_done_callback(lambda f: loop.call_soon_threadsafe(self._suggest_done, key, query, f))
+        entry[1] += 1
+        try:
+            return await asyncio.shield(asyncio.wrap_future(entry[0]))
+        except asyncio.CancelledError:
+            if entry[1] == 1 and entry[0].cancel():
+                METRICS.inc("suggest_total", result="dropped")
+            raise
+        finally:
+            entry[1] -= 1
+
+    def _suggest_done(self, key: str, query: str, cf):
+        if self.suggest_inflight.get(key, (None,))[0] is cf:
+            del self.suggest_inflight[key]
+        # 응답이 이미 늦었어도 결과는 캐시 → 다음 키 입력이 접두사로 재사용
+        if not cf.cancelled() and cf.exception() is None and (results := cf.result()) is not None:
+            self.suggestions.store(query, results)
+
+    async def _suggest_fetch(self, query: str, waiter: asyncio.Future):
+        try:
+            results = await self._suggest_lookup(query)
+        except Exception:
+            results = None
+        if not waiter.done():
+            waiter.set_result(results)
+
+    @staticmethod
+    def _suggest_choices(results: list[dict]) -> list[app_commands.Choice[str]]:
+        # 값은 정확한 watch URL → /play 가 검색 단계 없이 그 영상만 추출
+        choices = []
+        for r in results[:SUGGEST_LIMIT]:
+            name = r["title"]
+            if (d := r.get("duration")) is not None:
+                suffix = f" ({int(d) // 60}:{int(d) % 60:02d})"
+                name = name[:SUGGEST_CHOICE_MAX - len(suffix)] + suffix
+            choices.append(app_commands.Choice(
+                name=name[:SUGGEST_CHOICE_MAX], value=f"https://www.youtube.com/watch?v={r['id']}",
+            ))
+        return choices
+
+    # ---------- Slash Commands ----------
+    @app_commands.command(name="play", description="노래를 재생합니다.")
+    async def play(self, interaction: discord.Interaction, *, query: str):
+        await interaction.response.defer()  # 3초 ACK
+
+        if interaction.guild is None:
+            await interaction.followup.send("🚫 길드에서만 사용할 수 있어요.", ephemeral=True)
+            return
+
+        guild_id = interaction.guild.id
+        self.update_activity(guild_id)
+
+        if guild_id in self.radio_guilds:
+            await interaction.followup.send("📻 라디오 청취 중이에요. `/radio leave` 후에 재생해 주세요.", ephemeral=True)
+            return
+
+        vc = await self.join_voice_channel(interaction)
+        if vc is None:
+            return
+
+        # 플레이리스트/믹스: 자리표시 곡으로 바로 넣고 스트림 URL 은 재생 직전에 해석
+        if is_playlist_url(query) and await self.enqueue_playlist(interaction, query):
+            if self.is_playing.get(guild_id, False) and vc.is_playing():
+                self._schedule_preload_next(interaction, delay=0.6)
+            else:
+                self.is_playing[guild_id] = True
+                await self.play_next(interaction)
+            return
+
+        info = await self.search_youtube_async(query, guild_id)
+        if not info or not info.get("url"):
+            await interaction.followup.send("🔍 검색 결과가 없어요. 다른 키워드/URL을 시도해 주세요.", ephemeral=True)
+            return
+        song = Track.from_info(info)
+
+        q = self.queues.setdefault(guild_id, GuildQueue())
+        if self.is_playing.get(guild_id, False) and vc.is_playing():
+            duplicate = self._is_duplicate(guild_id, song.webpage_url)
+            if duplicate and QUEUE_REJECT_DUPLICATES:
+                await interaction.followup.send(f"🔁 **{song.title}** 은(는) 이미 재생 중이거나 대기열에 있어요.", ephemeral=True)
+                return
+            q.append(song)
+            note = " (🔁 이미 재생 중이거나 대기열에 있는 곡이에요)" if duplicate else ""
+            await interaction.followup.send(f"📥 **{song.title}** 대기열에 추가됨!{note}")
+            # 막 추가된 곡이 프리로드 창 안에 들어오면 바로 프리로드 스케줄
+            if len(q) <= PRELOAD_LOOKAHEAD:
+                self._schedule_preload_next(interaction, delay=0.6)
+        else:
+            self.is_playing[guild_id] = True
+            ok = await self.play_music(interaction, song)
+            if ok:
+                await interaction.followup.send(f"▶️ **{song.title}** 재생 시작!")
+            # 실패하면 play_music 내부에서 처리
+
+    @play.autocomplete("query")
+    async def play_query_autocomplete(self, interaction: discord.Interaction, current: str):
+        query = " ".join((current or "").split())
+        if len(query) < SUGGEST_MIN_CHARS or is_youtube_url(query):
+            return []
+        user_id = interaction.user.id
+        # 이 사용자의 이전 입력은 이제 낡음: 기다리던 응답은 비우고, 예약된 검색은 아래에서 대체
+        if old := self.suggest_waiters.pop(user_id, None):
+            old.cancel()
+
+        cached, exact = self.suggestions.lookup(query)
+        if exact or (cached and len(cached) >= SUGGEST_PREFIX_MIN):
+            self.timers.cancel(("suggest", user_id))
+            METRICS.inc("suggest_total", result="exact" if exact else "prefix")
+            return self._suggest_choices(cached)
+
+        # 디바운스: 입력이 SUGGEST_DEBOUNCE 동안 멈춰야 검색. 재예약되면 진행 중이던 검색 태스크도 취소됨
+        waiter = asyncio.get_running_loop().create_future()
+        self.suggest_waiters[user_id] = waiter
+        self.timers.schedule(("suggest", user_id), SUGGEST_DEBOUNCE, lambda: self._suggest_fetch(query, waiter))
+        await asyncio.wait({waiter}, timeout=SUGGEST_DEADLINE)
+        if self.suggest_waiters.get(user_id) is waiter:
+            del self.suggest_waiters[user_id]
+        if waiter.done() and not waiter.cancelled() and (results := waiter.result()) is not None:
+            METRICS.inc("suggest_total", result="search")
+            return self._suggest_choices(results)
+        # 더 새 입력에 밀렸거나 시간 초과: 접두사 결과에서 걸러 둔 일부라도 보여 줌
+        METRICS.inc("suggest_total", result="stale" if waiter.cancelled() else "timeout")
+        return self._suggest_choices(cached or [])
+
+    @app_commands.command(name="playmany", description="여러 곡을 한 번에 추가합니다. (; 로 구분)")
+    async def playmany(self, interaction: discord.Interaction, *, queries: str):
+        await interaction.response.defer()
+
+        if interaction.guild is None:
+            await interaction.followup.send("🚫 길드에서만 사용할 수 있어요.", ephemeral=True)
+            return
+
+        guild_id = interaction.guild.id
+        self.update_activity(guild_id)
+
+        items = [q.strip() for q in _BATCH_SPLIT_RE.split(queries) if q.strip()][:BATCH_PLAY_MAX]
+        if not items:
+            await interaction.followup.send("🔍 추가할 곡이 없어요. 검색어/URL 을 ; 로 구분해 주세요.", ephemeral=True)
+            return
+
+        if guild_id in self.radio_guilds:
+            await interaction.followup.send("📻 라디오 청취 중이에요. `/radio leave` 후에 재생해 주세요.", ephemeral=True)
+            return
+
+        vc = await self.join_voice_channel(interaction)
+        if vc is None:
+            return
+
+        # 병렬로 해석하되(동시 BATCH_PLAY_CONCURRENCY 개), 대기열에는 입력 순서대로 반영.
+        # 단 재생 중인 곡이 없으면 가장 먼저 해석된 곡을 순서와 상관없이 바로 재생
+        total = len(items)
+        sem = asyncio.Semaphore(BATCH_PLAY_CONCURRENCY)
+        results: list[dict | None] = [None] * total
+        finished = [False] * total
+        consumed = [False] * total   # 먼저 재생을 시작한 곡 (순서대로 반영할 때 건너뜀)
+        next_commit = 0
+        added, failed, dup = [], [], 0
+        started_title = None
+
+        async def resolve(i: int, query: str):
+            async with sem:
+                return i, await self.search_youtube_async(query, guild_id)
+
+        def progress_text(done: int) -> str:
+            text = f"📥 일괄 추가 {done}/{total} — 추가 {len(added)}곡"
+            if dup:
+                text += f", 중복 {dup}곡{' 제외' if QUEUE_REJECT_DUPLICATES else ''}"
+            if failed:
+                text += f", 실패 {len(failed)}곡"
+            if started_title:
+                text += f"\n▶️ **{started_title}** 재생 시작!"
+            if failed and done == total:
+                text += "\n🔍 결과 없음/재생 실패: " + ", ".join(failed)[:1500]
+            return text
+
+        msg = await interaction.followup.send(progress_text(0), wait=True)
+        last_edit = time.monotonic()
+        done = 0
+
+        async def start_now(song: Track, query: str):
+            nonlocal started_title
+            if guild_id in self.radio_guilds:
+                failed.append(query)  # 해석하는 사이 라디오로 전환됨: 라디오 소스를 끊지 않음
+                return
+            self.is_playing[guild_id] = True
+            if await self.play_music(interaction, song):
+                added.append(song.title)
+                started_title = started_title or song.title
+            else:
+                failed.append(query)
+
+        for coro in asyncio.as_completed([resolve(i, q) for i, q in enumerate(items)]):
+            i, info = await coro
+            results[i], finished[i] = info, True
+            done += 1
+
+            # 아무것도 안 나오고 있으면 앞 순번을 기다리지 않고 지금 해석된 곡부터 재생
+            if (info and info.get("url") and i != next_commit
+                    and not (self.is_playing.get(guild_id, False) and vc.is_playing())):
+                consumed[i] = True
+                await start_now(Track.from_info(info), items[i])
+
+            while next_commit < total and finished[next_commit]:
+                info = results[next_commit]
+                query = items[next_commit]
+                skip = consumed[next_commit]
+                next_commit += 1
+                if skip:
+                    continue
+                if not info or not info.get("url"):
+                    failed.append(query)
+                    continue
+                song = Track.from_info(info)
+                q = self.queues.setdefault(guild_id, GuildQueue())
+                if self.is_playing.get(guild_id, False) and vc.is_playing():
+                    if self._is_duplicate(guild_id, song.webpage_url):
+                        dup += 1
+                        if QUEUE_REJECT_DUPLICATES:
+                            continue
+                    q.append(song)
+                    added.append(song.title)
+                    if len(q) <= PRELOAD_LOOKAHEAD:
+                        self._schedule_preload_next(interaction, delay=0.6)
+                else:
+                    await start_now(song, query)
+
+            if done == total or time.monotonic() - last_edit >= BATCH_PLAY_PROGRESS_INTERVAL:
+                last_edit = time.monotonic()
+                try:
+                    await msg.edit(content=progress_text(done))
+                except discord.HTTPException:
+                    pass
+
+    @app_commands.command(name="queue", description="대기열 보기")
+    async def queue(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        if interaction.guild is None:
+            await interaction.followup.send("🚫 길드에서만 사용할 수 있어요.", ephemeral=True)
+            return
+
+        guild_id = interaction.guild.id
+        self.update_activity(guild_id)
+        await self.send_queue_page(interaction, guild_id)
+
+    async def send_queue_page(self, interaction: discord.Interaction, guild_id: int):
+        queue = self.queues.get(guild_id)
+        if not queue:
+            await interaction.followup.send("⛔ 대기열이 비어 있어요!", ephemeral=True)
+            return
+        embed, _ = render_queue_page(queue, 0)
+        view = QueuePageView(self, guild_id) if queue.page_count() > 1 else discord.utils.MISSING
+        await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+
+    @app_commands.command(name="remove", description="대기열에서 곡 삭제")
+    async def remove(self, interaction: discord.Interaction, index: int):
+        await interaction.response.defer(ephemeral=True)
+        if interaction.guild is None:
+            await interaction.followup.send("🚫 길드에서만 사용할 수 있어요.", ephemeral=True)
+            return
+
+        guild_id = interaction.guild.id
+        self.update_activity(guild_id)
+        queue = self.queues.get(guild_id)
+        if not queue or not 1 <= index <= len(queue):
+            await interaction.followup.send("⛔ 해당 번호의 곡이 없어요.", ephemeral=True)
+            return
+        track = queue.remove(index - 1)
+        self._disarm_stale_next(guild_id)  # 맨 앞이 바뀌었을 때만 회수
+        if index <= PRELOAD_LOOKAHEAD:
+            self._schedule_preload_next(interaction, delay=0.6)
+        await interaction.followup.send(f"🗑️ **{track.title}** 삭제됨", ephemeral=True)
+
+    @app_commands.command(name="move", description="대기열 곡 순서 이동")
+    async def move(self, interaction: discord.Interaction, source: int, target: int):
+        await interaction.response.defer(ephemeral=True)
+        if interaction.guild is None:
+            await interaction.followup.send("🚫 길드에서만 사용할 수 있어요.", ephemeral=True)
+            return
+
+        guild_id = interaction.guild.id
+        self.update_activity(guild_id)
+        queue = self.queues.get(guild_id)
+        if not queue or not 1 <= source <= len(queue):
+            await interaction.followup.send("⛔ 해당 번호의 곡이 없어요.", ephemeral=True)
+            return
+        track = queue.move(source - 1, target - 1)
+        self._disarm_stale_next(guild_id)
+        if min(source, target) <= PRELOAD_LOOKAHEAD:
+            self._schedule_preload_next(interaction, delay=0.6)
+        await interaction.followup.send(f"↕️ **{track.title}** → {min(max(target, 1), len(queue))}번", ephemeral=True)
+
+    @app_commands.command(name="shuffle", description="대기열 섞기")
+    async def shuffle(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        if interaction.guild is None:
+            await interaction.followup.send("🚫 길드에서만 사용할 수 있어요.", ephemeral=True)
+            return
+
+        guild_id = interaction.guild.id
+        self.update_activity(guild_id)
+        queue = self.queues.get(guild_id)
+        if not queue:
+            await interaction.followup.send("⛔ 대기열이 비어 있어요!", ephemeral=True)
+            return
+        queue.shuffle()
+        self._disarm_stale_next(guild_id)
+        self._schedule_preload_next(interaction, delay=0.6)
+        await interaction.followup.send("🔀 대기열을 섞었어요.", ephemeral=True)
+
+    @app_commands.command(name="skip", description="다음 곡으로")
+    async def skip(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        if interaction.guild is None:
+            await interaction.followup.send("🚫 길드에서만 사용할 수 있어요.", ephemeral=True)
+            return
+
+        guild_id = interaction.guild.id
+        self.update_activity(guild_id)
+        vc = self.voice_clients.get(guild_id)
+        if vc and (vc.is_playing() or vc.is_paused()):
+            try:
+                self._skip_current(guild_id, vc)  # 장전된 곡으로 즉시 전환 또는 after 콜백을 통해 다음 곡 진행
+            except Exception:
+                pass
+            # 진행 중인 프리로드만 취소 (이미 만든 소스는 곡 키로 매칭되므로 다음 곡에서 재사용)
+            self._cancel_preload(guild_id, keep_sources=True)
+            await interaction.followup.send("⏭️ 스킵합니다.", ephemeral=True)
+        else:
+            await interaction.followup.send("⛔ 현재 재생 중인 곡이 없어요.", ephemeral=True)
+
+    @app_commands.command(name="stop", description="중지 및 퇴장")
+    async def stop(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+
+        if interaction.guild is None:
+            await interaction.followup.send("🚫 길드에서만 사용할 수 있어요.", ephemeral=True)
+            return
+
+        guild_id = interaction.guild.id
+        self.update_activity(guild_id)
+
+        vc = self.voice_clients.get(guild_id)
+        if vc and (vc.is_playing() or vc.is_paused()):
+            try:
+                vc.stop()
+            except Exception:
+                pass
+            await asyncio.sleep(0.1)
+
+        await self.disconnect_and_cleanup(guild_id, interaction)
+        await interaction.followup.send("🛑 정지 및 나감", ephemeral=True)
+
+
+class PlayerView(discord.ui.View):
+    """영구 뷰: 봇 전체에 하나만 등록하고 길드는 interaction 에서 가져옴"""
+
+    def __init__(self, music_bot: MusicBot):
+        super().__init__(timeout=None)
+        self.music_bot = music_bot
+
+    @discord.ui.button(label="⏯️ 재생/일시정지", style=discord.ButtonStyle.primary, custom_id="player:toggle")
+    async def toggle_play(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.defer(ephemeral=True)
+        guild_id = interaction.guild_id
+        vc = self.music_bot.voice_clients.get(guild_id)
+        self.music_bot.update_activity(guild_id)
+        if not vc:
+            await interaction.followup.send("⛔ 보이스 연결이 없어요.", ephemeral=True)
+            return
+        if vc.is_playing():
+            vc.pause()
+            self.music_bot._mark_paused(guild_id)
+            await interaction.followup.send("⏸️ 일시정지", ephemeral=True)
+        elif vc.is_paused():
+            if chain := self.music_bot.chains.get(guild_id):
+                chain.mark_idle()
+            vc.resume()
+            self.music_bot._mark_resumed(guild_id)
+            await interaction.followup.send("▶️ 재생", ephemeral=True)
+        else:
+            await interaction.followup.send("⛔ 재생 중이 아니에요.", ephemeral=True)
+
+    @discord.ui.button(label="⏭️ 다음 곡", style=discord.ButtonStyle.secondary, custom_id="player:next")
+    async def next_song(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.defer(ephemeral=True)
+        guild_id = interaction.guild_id
+        vc = self.music_bot.voice_clients.get(guild_id)
+        self.music_bot.update_activity(guild_id)
+        if vc and (vc.is_playing() or vc.is_paused()):
+            try:
+                self.music_bot._skip_current(guild_id, vc)
+            except Exception:
+                pass
+            # 진행 중인 프리로드만 취소 (준비된 소스는 다음 곡에서 재사용)
+            self.music_bot._cancel_preload(guild_id, keep_sources=True)
+            await interaction.followup.send("⏭️ 다음 곡으로 이동합니다.", ephemeral=True)
+        else:
+            await interaction.followup.send("⛔ 재생 중이 아니에요.", ephemeral=True)
+
+    @discord.ui.button(label="📃 대기열 출력", style=discord.ButtonStyle.success, custom_id="player:queue")
+    async def show_queue(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.defer(ephemeral=True)
+        guild_id = interaction.guild_id
+        self.music_bot.update_activity(guild_id)
+        await self.music_bot.send_queue_page(interaction, guild_id)
+
+
+class QueuePageView(discord.ui.View):
+    """대기열 페이지 넘김 (현재 페이지만 렌더링)"""
+
+    def __init__(self, music_bot: MusicBot, guild_id: int):
+        super().__init__(timeout=180)
+        self.music_bot = music_bot
+        self.guild_id = guild_id
+        self.page = 0
+
+    async def _show(self, interaction: discord.Interaction, page: int):
+        queue = self.music_bot.queues.get(self.guild_id)
+        if not queue:
+            await interaction.response.edit_message(content="⛔ 대기열이 비어 있어요!", embed=None, view=None)
+            return
+        embed, self.page = render_queue_page(queue, page)
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    @discord.ui.button(label="◀️ 이전", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page - 1)
+
+    @discord.ui.button(label="다음 ▶️", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page + 1)
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(MusicBot(bot))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# bench/ 스크립트와 같이 저장소 루트의 모듈(music, cluster ...)을 바로 import
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,83 @@
+import asyncio
+
+import cluster
+
+
+async def _hub(secret: str) -> tuple[cluster.ClusterHub, str]:
+    hub = cluster.ClusterHub(addr="127.0.0.1:0", secret=secret)
+    await hub.start()
+    port = hub._server.sockets[0].getsockname()[1]
+    return hub, f"127.0.0.1:{port}"
+
+
+async def _connect(hub_secret: str, link_secret: str) -> tuple[cluster.ClusterHub, cluster.ClusterLink]:
+    hub, addr = await _hub(hub_secret)
+    link = cluster.ClusterLink(1, [0], 1, lambda: {"guilds": 3}, addr=addr, secret=link_secret)
+    await link.start()
+    await asyncio.sleep(0.2)
+    return hub, link
+
+
+async def _teardown(hub, link):
+    await link.close()
+    await hub.close()
+
+
+def test_mutual_auth_succeeds():
+    async def main():
+        hub, link = await _connect("s3cret", "s3cret")
+        result = (link.connected, sorted(hub.clusters), hub.auth_failures, link.auth_failures)
+        await _teardown(hub, link)
+        return result
+
+    assert asyncio.run(main()) == (True, [1], 0, 0)
+
+
+def test_hub_rejects_worker_with_wrong_secret():
+    async def main():
+        hub, link = await _connect("s3cret", "wrong")
+        result = (link.connected, hub.clusters, hub.auth_failures)
+        await _teardown(hub, link)
+        return result
+
+    connected, clusters, failures = asyncio.run(main())
+    assert not connected and clusters == {} and failures == 1
+
+
+def test_worker_rejects_impostor_hub():
+    # 비밀값을 모르는 가짜 허브: hello 는 받지만 welcome 을 서명할 수 없음 → 워커가 명령을 받지 않음
+    commands_sent = []
+
+    async def main():
+        async def impostor(reader, writer):
+            await cluster._send(writer, {"op": "challenge", "nonce": "n"})
+            await reader.readline()
+            await cluster._send(writer, {"op": "welcome", "auth": "0" * 64})
+            await cluster._send(writer, {"op": "command", "id": 1, "cmd": "leave", "args": {"guild_id": 1}})
+            commands_sent.append(1)
+            await reader.read()
+
+        server = await asyncio.start_server(impostor, "127.0.0.1", 0)
+        addr = f"127.0.0.1:{server.sockets[0].getsockname()[1]}"
+        handled = []
+
+        async def leave(args):
+            handled.append(args)
+            return {}
+
+        link = cluster.ClusterLink(1, [0], 1, dict, addr=addr, secret="s3cret")
+        link.handlers["leave"] = leave
+        await link.start()
+        await asyncio.sleep(0.2)
+        result = (link.connected, link.auth_failures, handled)
+        await link.close()
+        server.close()
+        return result
+
+    connected, failures, handled = asyncio.run(main())
+    assert not connected and failures == 1 and handled == []
+    assert commands_sent
+
+
+def test_digest_is_role_bound():
+    assert cluster._auth_digest("k", "worker", "a", "b") != cluster._auth_digest("k", "hub", "a", "b")
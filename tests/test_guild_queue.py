@@ -0,0 +1,94 @@
+import pytest
+
+pytest.importorskip("discord")
+
+import music  # noqa: E402
+
+
+def track(vid: str, **extra) -> music.Track:
+    info = {"url": f"https://cdn.example/{vid}", "webpage_url": f"https://youtu.be/{vid}", "title": vid}
+    info.update(extra)
+    return music.Track.from_info(info)
+
+
+def test_track_from_info():
+    t = track("aaaaaaaaaaa", duration=61, http_headers={"User-Agent": "x"})
+    assert t.title == "aaaaaaaaaaa"
+    assert t.resolved
+    assert t.norm_key == "https://www.youtube.com/watch?v=aaaaaaaaaaa"
+    # 같은 헤더는 곡마다 복사하지 않고 공유
+    assert t.http_headers is track("bbbbbbbbbbb", http_headers={"User-Agent": "x"}).http_headers
+
+
+def test_track_placeholder_and_update():
+    t = music.Track.from_info({"webpage_url": "https://youtu.be/ccccccccccc", "title": ""})
+    assert not t.resolved
+    assert t.title == "(제목 없음)"
+    t.update({"url": "https://cdn.example/ccccccccccc", "title": "real"})
+    assert t.resolved and t.title == "real"
+    with pytest.raises(AttributeError):
+        t.extra = 1  # __slots__
+
+
+def test_queue_fifo_and_index():
+    q = music.GuildQueue()
+    a, b, c = track("aaaaaaaaaaa"), track("bbbbbbbbbbb"), track("ccccccccccc")
+    for t in (a, b, c):
+        q.append(t)
+    assert len(q) == 3 and q[0] is a
+    assert q.contains("https://www.youtube.com/watch?v=bbbbbbbbbbb")
+    assert q.popleft() is a
+    assert not q.contains("https://youtu.be/aaaaaaaaaaa")
+    q.appendleft(a)
+    assert [t.title for t in q] == ["aaaaaaaaaaa", "bbbbbbbbbbb", "ccccccccccc"]
+    assert q.peek(2) == [a, b]
+
+
+def test_duplicate_counts():
+    q = music.GuildQueue()
+    first, second = track("aaaaaaaaaaa"), track("aaaaaaaaaaa")
+    q.append(first)
+    q.append(second)
+    assert q.discard(first)
+    assert q.contains("https://youtu.be/aaaaaaaaaaa")
+    assert q.discard(second)
+    assert not q.contains("https://youtu.be/aaaaaaaaaaa")
+    assert not q.discard(second)
+
+
+def test_remove_move_clear_bump_version():
+    q = music.GuildQueue()
+    tracks = [track(f"{i:011d}") for i in range(5)]
+    for t in tracks:
+        q.append(t)
+    v = q.version
+    assert q.remove(1) is tracks[1]
+    assert q.move(0, 10) is tracks[0]
+    assert list(q) == [tracks[2], tracks[3], tracks[4], tracks[0]]
+    with pytest.raises(IndexError):
+        q.remove(10)
+    assert q.version > v
+    q.clear()
+    assert not q and q.popleft() is None
+    assert not q.contains(tracks[2].webpage_url)
+
+
+def test_shuffle_keeps_members():
+    q = music.GuildQueue()
+    tracks = [track(f"{i:011d}") for i in range(20)]
+    for t in tracks:
+        q.append(t)
+    q.shuffle()
+    assert sorted(t.title for t in q) == sorted(t.title for t in tracks)
+    assert all(q.contains(t.webpage_url) for t in tracks)
+
+
+def test_pages():
+    q = music.GuildQueue()
+    for i in range(23):
+        q.append(track(f"{i:011d}"))
+    assert q.page_count(10) == 3
+    last = q.page(2, 10)
+    assert [i for i, _ in last] == [20, 21, 22]
+    assert q.page(5, 10) == []
+    assert music.GuildQueue().page_count() == 1
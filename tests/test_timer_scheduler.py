@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("discord")
+
+import music  # noqa: E402
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_fires_in_deadline_order():
+    async def main():
+        timers = music.TimerScheduler()
+        fired = []
+        timers.schedule(("ui", 3), 0.03, lambda: fired.append(3))
+        timers.schedule(("ui", 1), 0.01, lambda: fired.append(1))
+        timers.schedule(("ui", 2), 0.02, lambda: fired.append(2))
+        await asyncio.sleep(0.08)
+        timers.shutdown()
+        return fired, timers.stats()
+
+    fired, stats = run(main())
+    assert fired == [1, 2, 3]
+    assert stats["fired"] == 3
+    assert stats["pending"] == {}
+
+
+def test_reschedule_replaces_pending_timer():
+    async def main():
+        timers = music.TimerScheduler()
+        fired = []
+        timers.schedule(("ui", 1), 0.01, lambda: fired.append("old"))
+        timers.schedule(("ui", 1), 0.04, lambda: fired.append("new"))
+        await asyncio.sleep(0.02)
+        early = list(fired)
+        await asyncio.sleep(0.05)
+        timers.shutdown()
+        return early, fired, timers.stats()
+
+    early, fired, stats = run(main())
+    assert early == []
+    assert fired == ["new"]
+    assert stats["scheduled"] == 1 and stats["rescheduled"] == 1
+
+
+def test_cancel():
+    async def main():
+        timers = music.TimerScheduler()
+        fired = []
+        timers.schedule(("idle", 1), 0.01, lambda: fired.append(1))
+        assert timers.pending("idle") == 1
+        assert timers.cancel(("idle", 1)) is True
+        assert timers.cancel(("idle", 1)) is False
+        assert timers.cancel(("idle", 2)) is False
+        await asyncio.sleep(0.03)
+        timers.shutdown()
+        return fired, timers.stats()
+
+    fired, stats = run(main())
+    assert fired == []
+    assert stats["cancelled"] == 1
+    assert stats["heap"] == 0
+
+
+def test_coroutine_callback_is_cancelled_by_reschedule():
+    async def main():
+        timers = music.TimerScheduler()
+        events = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                events.append("cancelled")
+                raise
+
+        timers.schedule(("preload", 1), 0, slow)
+        await asyncio.sleep(0.01)
+        assert timers.stats()["running"] == 1
+        timers.schedule(("preload", 1), 0, lambda: events.append("second"))
+        await asyncio.sleep(0.01)
+        timers.shutdown()
+        return events
+
+    assert run(main()) == ["cancelled", "second"]
+
+
+def test_early_wakeup_within_clock_resolution_fires():
+    # 루프가 마감보다 clock_resolution 이내로 이르게 _fire_due 를 불러도 재설정만 반복하지 않고 바로 실행
+    # (Windows 의 monotonic 해상도 ~15.6ms 흉내)
+    async def main():
+        loop = asyncio.get_running_loop()
+        loop._clock_resolution = 0.0156
+        timers = music.TimerScheduler()
+        fired = []
+        timers.schedule(("ui", 1), 0.005, lambda: fired.append(1))
+        timers._fire_due()
+        result = (list(fired), timers._handle)
+        timers.shutdown()
+        return result
+
+    fired, handle = run(main())
+    assert fired == [1]
+    assert handle is None
+
+
+def test_stale_entries_are_compacted():
+    async def main():
+        timers = music.TimerScheduler()
+        for i in range(music.TIMER_COMPACT_MIN * 4):
+            timers.schedule(("ui", i % 10), 60, lambda: None)
+        stats = timers.stats()
+        timers.shutdown()
+        return stats
+
+    stats = run(main())
+    assert sum(stats["pending"].values()) == 10
+    assert stats["heap"] <= music.TIMER_COMPACT_MIN + 1